@@ -25,17 +25,37 @@
 # TODO: Support for motion and contact sensors
 #
 
+import array
+import base64
 import binascii
+import collections
+import contextlib
 import hashlib
+import inspect
+import json
 import logging
+import os
+import random
 import socket
 import struct
 import threading
 import time
+from collections.abc import Mapping
+from concurrent import futures
 from enum import Enum
 
+from .constants import (ADDR_OFFSET, COMMAND_OFFSET, DEFAULT_PIPELINE_WINDOW,
+                        FRAME_BUFFER_SIZE, FRAME_HEADER,
+                        GATEWAY_TIMEOUT_SECONDS, MAX_PIPELINE_WINDOW, MODULE,
+                        POLL_BACKOFF, POLL_GROUPS_INTERVAL,
+                        POLL_LIGHTS_INTERVAL, POLL_RESOURCES,
+                        POLL_SCENES_INTERVAL, RESPONSE_COMMAND_OFFSET,
+                        RESPONSE_SEQ_OFFSET, RESPONSE_STATUS_OFFSET,
+                        SEQ_OFFSET)
+from .pipeline import FrameReader, Pipeline
+from .polling import Poller, PollSchedule
+
 __version__ = '1.0.7.2'
-MODULE = __name__
 PORT = 4000
 
 COMMAND_ALL_LIGHT_STATUS = 0x13
@@ -76,10 +96,94 @@ MAX_TEMPERATURE_RGBW = 6500
 MAX_LUMINANCE = 100
 MAX_COLOUR = 255
 
-GATEWAY_TIMEOUT_SECONDS = 10
 OUTDATED_TIMESTAMP = 1
 UNKNOWN_DEVICENAME = 'unknown device'
 
+# command packets: header (length, flag, command id, 0, 0, 0x07, sequence
+# number), target address (light mac address or group/scene index) and the
+# payloads of the light/group commands
+COMMAND_HEADER = struct.Struct('<H6B')
+LIGHT_ADDR = struct.Struct('<Q')
+GROUP_ADDR = struct.Struct('<B7x')
+PAYLOAD_ONOFF = struct.Struct('<B')
+PAYLOAD_TEMP = struct.Struct('<HH')
+PAYLOAD_LUMINANCE = struct.Struct('<BH')
+PAYLOAD_COLOUR = struct.Struct('<BBBBH')
+
+# version of the on-disk snapshot format and the snapshot resources in the
+# order they are applied
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_RESOURCES = ('lights', 'scenes', 'groups')
+
+# upper bounds in seconds of the command latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# connection health: tcp keepalive options (idle time and interval in seconds,
+# number of probes) set where the platform supports them, interval and timeout
+# in seconds of the probes sent while the connection is idle and the reconnect
+# backoff in seconds (minimum, maximum)
+KEEPALIVE_OPTIONS = (('TCP_KEEPIDLE', 10), ('TCP_KEEPINTVL', 5),
+                     ('TCP_KEEPCNT', 3))
+PROBE_INTERVAL = 15
+PROBE_TIMEOUT = 2
+RECONNECT_BACKOFF = (0.5, 30)
+
+# adaptive command timeouts: a multiple of a percentile of the last round trip
+# times per command id, within bounds in seconds (minimum, maximum). the
+# maximum applies until enough round trip times were measured. a timed out
+# command multiplies the timeout by the backoff until the next round trip
+# time is measured
+RTT_WINDOW = 64
+RTT_MIN_SAMPLES = 8
+TIMEOUT_PERCENTILE = 99
+TIMEOUT_FACTOR = 3
+TIMEOUT_BOUNDS = (0.25, GATEWAY_TIMEOUT_SECONDS)
+TIMEOUT_BACKOFF = 2
+
+# commands rate limited by a Debouncer, the others are sent immediately
+DEBOUNCE_COMMANDS = frozenset((COMMAND_LUMINANCE, COMMAND_ONOFF, COMMAND_TEMP,
+                               COMMAND_COLOUR))
+# minimum time in seconds between two commands to the same target
+DEBOUNCE_INTERVAL = 0.1
+
+# maximum age in seconds of the cached light status for skipping commands
+# that would not change it
+ELISION_MAX_AGE = 30
+
+# commands collected by a batch, the others are sent immediately
+BATCH_COMMANDS = frozenset((COMMAND_LUMINANCE, COMMAND_ONOFF, COMMAND_TEMP,
+                            COMMAND_COLOUR, COMMAND_ACTIVATE_SCENE))
+
+# record of the all light status response: addr, type id, version (4 bytes),
+# reachable, groups, onoff, lum, temp, red, green, blue, alpha, name, last seen
+LIGHT_RECORD = struct.Struct('<2xQ5BBH2BH4B16sI4x')
+LIGHT_RECORD_ADDR = struct.Struct('<2xQ')
+# position of the last seen time in a record
+LIGHT_RECORD_LAST_SEEN = LIGHT_RECORD.size - 8
+# fields compared by LightsDiff (names of the Light accessors)
+LIGHT_FIELDS = ('name', 'reachable', 'last_seen', 'on', 'lum', 'temp', 'rgb',
+                'groups', 'version', 'idx')
+# light fields covered by the lookup indexes
+INDEXED_FIELDS = frozenset(('name', 'reachable', 'on'))
+
+# supported feature flags
+FEATURE_ON = 0x1
+FEATURE_LUM = 0x2
+FEATURE_TEMP = 0x4
+FEATURE_RGB = 0x8
+FEATURE_ALL = FEATURE_ON | FEATURE_LUM | FEATURE_TEMP | FEATURE_RGB
+FEATURES = (('on', FEATURE_ON), ('lum', FEATURE_LUM), ('temp', FEATURE_TEMP),
+            ('rgb', FEATURE_RGB))
+# columns of the light store: name, array type code, default value
+LIGHT_COLUMNS = (('addr', 'Q', 0), ('type_id', 'B', 0), ('idx', 'H', 0),
+                 ('reachable', 'B', 1), ('last_seen', 'Q', 0),
+                 ('onoff', 'B', 0), ('lum', 'i', 0), ('temp', 'H', 0),
+                 ('red', 'i', 0), ('green', 'i', 0), ('blue', 'i', 0),
+                 ('groups', 'H', 0), ('raw', 'B', 0), ('raw_onoff', 'B', 0),
+                 ('raw_lum', 'B', 0), ('raw_temp', 'H', 0),
+                 ('raw_red', 'B', 0), ('raw_green', 'B', 0),
+                 ('raw_blue', 'B', 0), ('raw_alpha', 'B', 0))
+
 
 class DeviceSubType(Enum):
     """ device sub type
@@ -103,6 +207,34 @@ class DeviceType(Enum):
     SWITCH = 4
 
 
+class EventType(Enum):
+    """ type of a state change event
+        values of the light fields match LIGHT_FIELDS
+    """
+    ON = 'on'
+    LUM = 'lum'
+    TEMP = 'temp'
+    RGB = 'rgb'
+    REACHABLE = 'reachable'
+    NAME = 'name'
+    GROUPS = 'groups'
+    ADDED = 'added'
+    DELETED = 'deleted'
+
+
+class AckStatus(Enum):
+    """ state of a command sent without waiting for the response
+    """
+    PENDING = 1
+    SUCCESS = 2
+    FAILED = 3
+    TIMEOUT = 4
+
+
+# light fields reported by events
+EVENT_FIELDS = frozenset(event_type.value for event_type in EventType
+                         if event_type.value in LIGHT_FIELDS)
+
 DEVICE_TYPES = {
     1: {'type': DeviceType.LIGHT,
         'subtype': DeviceSubType.LIGHT_FIXED_WHITE,
@@ -151,6 +283,119 @@ DEVICE_TYPES = {
           }
 }
 
+# supported features by device sub type (all features for other sub types)
+SUBTYPE_FEATURES = {
+    DeviceSubType.SWITCH: 0,
+    DeviceSubType.CONTACT_SENSOR: 0,
+    DeviceSubType.MOTION_SENSOR: 0,
+    DeviceSubType.PLUG: FEATURE_ON,
+    DeviceSubType.LIGHT_FIXED_WHITE: FEATURE_ON | FEATURE_LUM,
+    DeviceSubType.LIGHT_TUNABLE_WHITE: FEATURE_ON | FEATURE_LUM | FEATURE_TEMP,
+    DeviceSubType.LIGHT_RGB: FEATURE_ON | FEATURE_LUM | FEATURE_RGB,
+}
+
+
+class DeviceProfile:
+    """ immutable capability profile of a device type, shared by all lights
+        of that type
+    """
+
+    __slots__ = ('__devicetype', '__devicesubtype', '__devicename',
+                 '__features', '__feature_names', '__min_temp', '__max_temp',
+                 '__initial_values')
+
+    def __init__(self, device_info, devicename=None):
+        """
+        :param device_info: device type information (see DEVICE_TYPES)
+        :param devicename: device name overriding the one of device_info
+        """
+        self.__devicetype = device_info['type']
+        self.__devicesubtype = device_info['subtype']
+        self.__devicename = devicename or device_info['name']
+        self.__features = SUBTYPE_FEATURES.get(self.__devicesubtype,
+                                               FEATURE_ALL)
+        self.__feature_names = frozenset(name for name, flag in FEATURES
+                                         if self.__features & flag)
+
+        if self.__devicesubtype == DeviceSubType.LIGHT_TUNABLE_WHITE:
+            self.__min_temp = device_info.get('min_temp',
+                                              MIN_TEMPERATURE_TUNABLE_WHITE)
+            self.__max_temp = device_info.get('max_temp',
+                                              MAX_TEMPERATURE_TUNABLE_WHITE)
+        elif self.__features & FEATURE_TEMP:
+            self.__min_temp = device_info.get('min_temp', MIN_TEMPERATURE_RGBW)
+            self.__max_temp = device_info.get('max_temp', MAX_TEMPERATURE_RGBW)
+        else:
+            self.__min_temp = None
+            self.__max_temp = None
+
+        # initial (lum, temp, red, green, blue) of a new light
+        if self.__features:
+            self.__initial_values = (MAX_LUMINANCE, DEFAULT_TEMPERATURE,
+                                     MAX_COLOUR, MAX_COLOUR, MAX_COLOUR)
+        else:
+            self.__initial_values = (0, 0, 0, 0, 0)
+
+    def devicetype(self):
+        """
+        :return: generalized device type (DeviceType object)
+        """
+        return self.__devicetype
+
+    def devicesubtype(self):
+        """
+        :return: device sub type (DeviceSubType object)
+        """
+        return self.__devicesubtype
+
+    def devicename(self):
+        """
+        :return: device name
+        """
+        return self.__devicename
+
+    def features(self):
+        """
+        :return: bitmask of supported features (FEATURE_* flags)
+        """
+        return self.__features
+
+    def supported_features(self):
+        """
+        :return: frozenset of supported features (on, lum, temp, rgb)
+        """
+        return self.__feature_names
+
+    def min_temp(self):
+        """
+        :return: minimum supported colour temperature in kelvin, None if the
+            colour temperature is not supported
+        """
+        return self.__min_temp
+
+    def max_temp(self):
+        """
+        :return: maximum supported colour temperature in kelvin, None if the
+            colour temperature is not supported
+        """
+        return self.__max_temp
+
+    def initial_values(self):
+        """
+        :return: tuple containing the values of a new light:
+            (lum, temp, red, green, blue)
+        """
+        return self.__initial_values
+
+    def __str__(self):
+        return '<device profile: %s, features: %s>' % (
+            self.__devicename, ', '.join(sorted(self.__feature_names)))
+
+
+# dict from device type id to shared DeviceProfile object
+DEVICE_PROFILES = dict((type_id, DeviceProfile(device_info))
+                       for type_id, device_info in DEVICE_TYPES.items())
+
 
 class Scene:
     """ representation of a scene
@@ -197,17 +442,19 @@ class Scene:
         """
         self.__deleted = True
 
-    def activate(self):
+    def activate(self, deadline=None):
         """ activate the scene
 
+        :param deadline: optional time (time.time()) by which the command
+            must be answered
         :return:
         """
         if self.__deleted:
             return
 
         command = self.__conn.build_command(COMMAND_ACTIVATE_SCENE, self.__idx,
-                                            '')
-        self.__conn.send(command)
+                                            b'')
+        self.__conn.send(command, deadline=deadline)
         self.__conn.set_lights_updated()
 
     def __str__(self):
@@ -215,10 +462,132 @@ class Scene:
                                               self.__group)
 
 
+class LightStore:
+    """ columnar storage of light states
+        every light occupies one slot, its values are kept in typed arrays
+        (one per column) indexed by the slot
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__columns = {}
+        for name, typecode, _ in LIGHT_COLUMNS:
+            self.__columns[name] = array.array(typecode)
+            setattr(self, name, self.__columns[name])
+
+        self.name = []
+        self.version = []
+        self.__free = []
+        # dict from group bitmask to tuple of group indices
+        self.__group_lists = {}
+
+    def allocate(self, addr, type_id):
+        """ allocate a slot for a light
+
+        :param addr: mac address of the light
+        :param type_id: original device type id as returned by gateway
+        :return: slot
+        """
+        with self.__lock:
+            if self.__free:
+                slot = self.__free.pop()
+                for name, _, default in LIGHT_COLUMNS:
+                    self.__columns[name][slot] = default
+                self.name[slot] = ''
+                self.version[slot] = ''
+            else:
+                slot = len(self.name)
+                for name, _, default in LIGHT_COLUMNS:
+                    self.__columns[name].append(default)
+                self.name.append('')
+                self.version.append('')
+
+            self.addr[slot] = addr
+            self.type_id[slot] = type_id
+            return slot
+
+    def free(self, slot):
+        """ release a slot, it may be reused by another light
+
+        :param slot: slot
+        :return:
+        """
+        with self.__lock:
+            self.__free.append(slot)
+
+    def detach(self, slot):
+        """ move a light's values to a store of its own and release the slot
+
+        :param slot: slot
+        :return: new LightStore object (the light's slot is 0)
+        """
+        store = LightStore()
+        new_slot = store.allocate(self.addr[slot], self.type_id[slot])
+        for name, _, _ in LIGHT_COLUMNS:
+            store.column(name)[new_slot] = self.__columns[name][slot]
+        store.name[new_slot] = self.name[slot]
+        store.version[new_slot] = self.version[slot]
+        self.free(slot)
+        return store
+
+    def column(self, name):
+        """
+        :param name: column name (see LIGHT_COLUMNS)
+        :return: array of the column, indexed by slot
+        """
+        return self.__columns[name]
+
+    def group_list(self, slot):
+        """
+        :param slot: slot
+        :return: tuple of the light's group indices, highest first
+        """
+        groups = self.groups[slot]
+        group_list = self.__group_lists.get(groups)
+        if group_list is None:
+            group_list = tuple(bit + 1 for bit in range(15, -1, -1)
+                               if groups >> bit & 1)
+            self.__group_lists[groups] = group_list
+
+        return group_list
+
+    def slots(self):
+        """
+        :return: list of allocated slots
+        """
+        with self.__lock:
+            free = set(self.__free)
+            return [slot for slot in range(len(self.name))
+                    if slot not in free]
+
+    def snapshot(self):
+        """
+        :return: dict from column name to a copy of the column (arrays for
+            numeric columns, lists for name and version), indexed by slot.
+            free slots contain stale values (see slots())
+        """
+        with self.__lock:
+            snapshot = dict((name, array.array(column.typecode, column))
+                            for name, column in self.__columns.items())
+            snapshot['name'] = list(self.name)
+            snapshot['version'] = list(self.version)
+            return snapshot
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.name) - len(self.__free)
+
+
 class Light:
     """ class for controlling a single light source
+        the light's state is kept in the connection's LightStore
     """
 
+    # '__weakref__' keeps Light objects usable in weak references (e.g. by
+    # subscribers and caches) as before the slots were added
+    __slots__ = ('__conn', '__store', '__slot', '__deleted', '__profile',
+                 '__weakref__')
+
     def __init__(self, conn, addr, type_id, type_id_assumed):
         """
         :param conn: Lightify object
@@ -228,205 +597,182 @@ class Light:
             unknown device)
         """
         self.__conn = conn
-        self.__addr = addr
-        self.__name = ''
-        self.__reachable = True
-        self.__last_seen = 0
-        self.__onoff = False
-        self.__groups = []
-        self.__version = ''
+        self.__store = conn.light_store()
+        self.__slot = self.__store.allocate(addr, type_id)
         self.__deleted = False
-        self.__type_id = type_id
-        self.__idx = 0
-        self.__raw_values = ()
+        self.__profile = conn.device_profile(type_id, type_id_assumed)
 
-        device_info = conn.device_types()[type_id_assumed]
-        self.__devicesubtype = device_info['subtype']
-        self.__devicetype = device_info['type']
-        self.__devicename = (device_info['name'] if type_id == type_id_assumed
-                             else UNKNOWN_DEVICENAME)
-
-        if self.__devicesubtype in (DeviceSubType.SWITCH,
-                                    DeviceSubType.CONTACT_SENSOR,
-                                    DeviceSubType.MOTION_SENSOR):
-            self.__lum = 0
-            self.__temp = 0
-            self.__red = 0
-            self.__green = 0
-            self.__blue = 0
-            self.__supported_features = set()
-            self.__min_temp = self.__temp
-            self.__max_temp = self.__temp
-        else:
-            self.__lum = MAX_LUMINANCE
-            self.__temp = DEFAULT_TEMPERATURE
-            self.__red = MAX_COLOUR
-            self.__green = MAX_COLOUR
-            self.__blue = MAX_COLOUR
-
-            if self.__devicesubtype == DeviceSubType.PLUG:
-                self.__supported_features = set(('on',))
-                self.__min_temp = self.__temp
-                self.__max_temp = self.__temp
-            elif self.__devicesubtype == DeviceSubType.LIGHT_FIXED_WHITE:
-                self.__supported_features = set(('on', 'lum'))
-                self.__min_temp = self.__temp
-                self.__max_temp = self.__temp
-            elif self.__devicesubtype == DeviceSubType.LIGHT_TUNABLE_WHITE:
-                self.__supported_features = set(('on', 'lum', 'temp'))
-                self.__min_temp = device_info.get(
-                    'min_temp', MIN_TEMPERATURE_TUNABLE_WHITE)
-                self.__max_temp = device_info.get(
-                    'max_temp', MAX_TEMPERATURE_TUNABLE_WHITE)
-            elif self.__devicesubtype == DeviceSubType.LIGHT_RGB:
-                self.__supported_features = set(('on', 'lum', 'rgb'))
-                self.__min_temp = self.__temp
-                self.__max_temp = self.__temp
-            else:
-                self.__supported_features = set(('on', 'lum', 'temp', 'rgb'))
-                self.__min_temp = device_info.get('min_temp',
-                                                  MIN_TEMPERATURE_RGBW)
-                self.__max_temp = device_info.get('max_temp',
-                                                  MAX_TEMPERATURE_RGBW)
+        store = self.__store
+        slot = self.__slot
+        (store.lum[slot], store.temp[slot], store.red[slot], store.green[slot],
+         store.blue[slot]) = self.__profile.initial_values()
 
     def name(self):
         """
         :return: name of the light
         """
-        return self.__name
+        return self.__store.name[self.__slot]
 
     def idx(self):
         """
         :return: index of the light provided by the gateway
         """
-        return self.__idx
+        return self.__store.idx[self.__slot]
 
     def addr(self):
         """
         :return: mac address of the light
         """
-        return self.__addr
+        return self.__store.addr[self.__slot]
+
+    def slot(self):
+        """
+        :return: slot of the light in the connection's LightStore
+        """
+        return self.__slot
 
     def reachable(self):
         """
         :return: true if the light is reachable
         """
-        return self.__reachable
+        return bool(self.__store.reachable[self.__slot])
 
     def last_seen(self):
         """
         :return: time since last seen by gateway in minutes
         """
-        return self.__last_seen
+        return self.__store.last_seen[self.__slot]
 
     def on(self):
         """
         :return: true if the status of the light is on
         """
-        return self.__onoff
+        return bool(self.__store.onoff[self.__slot])
 
     def lum(self):
         """
         :return: luminance (brightness)
         """
-        return self.__lum
+        return self.__store.lum[self.__slot]
 
     def temp(self):
         """
         :return: colour temperature in kelvin
         """
-        return self.__temp
+        return self.__store.temp[self.__slot]
 
     def min_temp(self):
         """
         :return: minimum supported colour temperature in kelvin
         """
-        if 'temp' in self.__supported_features:
-            return self.__min_temp
+        if self.__profile.features() & FEATURE_TEMP:
+            return self.__profile.min_temp()
 
-        return self.__temp
+        return self.temp()
 
     def max_temp(self):
         """
         :return: maximum supported colour temperature in kelvin
         """
-        if 'temp' in self.__supported_features:
-            return self.__max_temp
+        if self.__profile.features() & FEATURE_TEMP:
+            return self.__profile.max_temp()
 
-        return self.__temp
+        return self.temp()
 
     def red(self):
         """
         :return: amount of red
         """
-        return self.__red
+        return self.__store.red[self.__slot]
 
     def green(self):
         """
         :return: amount of green
         """
-        return self.__green
+        return self.__store.green[self.__slot]
 
     def blue(self):
         """
         :return: amount of blue
         """
-        return self.__blue
+        return self.__store.blue[self.__slot]
 
     def rgb(self):
         """
         :return: tuple containing (red, green, blue)
         """
-        return self.__red, self.__green, self.__blue
+        store = self.__store
+        slot = self.__slot
+        return store.red[slot], store.green[slot], store.blue[slot]
 
     def raw_values(self):
         """
         :return: tuple containing raw values as obtained from gateway:
             (onoff, lum, temp, red, green, blue, alpha)
         """
-        return self.__raw_values
+        store = self.__store
+        slot = self.__slot
+        if not store.raw[slot]:
+            return ()
+
+        return (store.raw_onoff[slot], store.raw_lum[slot],
+                store.raw_temp[slot], store.raw_red[slot],
+                store.raw_green[slot], store.raw_blue[slot],
+                store.raw_alpha[slot])
 
     def type_id(self):
         """
         :return: original device type id as returned by gateway
         """
-        return self.__type_id
+        return self.__store.type_id[self.__slot]
 
     def devicesubtype(self):
         """
         :return: device sub type (DeviceSubType object)
         """
-        return self.__devicesubtype
+        return self.__profile.devicesubtype()
 
     def devicetype(self):
         """
         :return: generalized device type (DeviceType object)
         """
-        return self.__devicetype
+        return self.__profile.devicetype()
 
     def devicename(self):
         """
         :return: device name
         """
-        return self.__devicename
+        return self.__profile.devicename()
 
     def groups(self):
         """
         :return: list of associated group indices
         """
-        return self.__groups
+        return list(self.__store.group_list(self.__slot))
 
     def version(self):
         """
         :return: firmware version
         """
-        return self.__version
+        return self.__store.version[self.__slot]
 
     def supported_features(self):
         """
-        :return: set of supported features (on, lum, temp, rgb)
+        :return: frozenset of supported features (on, lum, temp, rgb)
         """
-        return self.__supported_features
+        return self.__profile.supported_features()
+
+    def features(self):
+        """
+        :return: bitmask of supported features (FEATURE_* flags)
+        """
+        return self.__profile.features()
+
+    def profile(self):
+        """
+        :return: DeviceProfile object shared by the lights of the same type
+        """
+        return self.__profile
 
     def deleted(self):
         """
@@ -436,8 +782,14 @@ class Light:
 
     def mark_deleted(self):
         """ mark the light as deleted from gateway
+            the light's values are moved out of the connection's store
         """
+        if self.__deleted:
+            return
+
         self.__deleted = True
+        self.__store = self.__store.detach(self.__slot)
+        self.__slot = 0
 
     def update_status(self, reachable, last_seen, onoff, lum, temp, red, green,
                       blue, alpha, name, groups, version, idx):
@@ -454,108 +806,149 @@ class Light:
         :param blue: amount of blue
         :param alpha: alpha value (not used)
         :param name: name of the light
-        :param groups: list of associated group indices
+        :param groups: group bitmask or list of associated group indices
         :param version: firmware version
         :param idx: index of the light provided by the gateway
         :return:
         """
-        self.__reachable = bool(reachable)
-        self.__last_seen = last_seen * LAST_SEEN_DURATION_MINUTES
-        self.__name = name
-        self.__groups = groups
-        self.__version = version
-        self.__idx = idx
-        self.__raw_values = (onoff, lum, temp, red, green, blue, alpha)
-
-        if 'on' in self.__supported_features:
-            self.__onoff = bool(onoff)
-
-        if 'lum' in self.__supported_features:
-            self.__lum = lum
-
-        if 'temp' in self.__supported_features:
-            self.__temp = temp
-
-        if 'rgb' in self.__supported_features:
-            self.__red = red
-            self.__green = green
-            self.__blue = blue
-
-    def set_onoff(self, onoff, send=True):
+        store = self.__store
+        slot = self.__slot
+        if not isinstance(groups, int):
+            groups = sum(1 << (group - 1) for group in set(groups))
+
+        store.reachable[slot] = bool(reachable)
+        store.last_seen[slot] = last_seen * LAST_SEEN_DURATION_MINUTES
+        store.name[slot] = name
+        store.groups[slot] = groups
+        store.version[slot] = version
+        store.idx[slot] = idx
+        store.raw_onoff[slot] = onoff
+        store.raw_lum[slot] = lum
+        store.raw_temp[slot] = temp
+        store.raw_red[slot] = red
+        store.raw_green[slot] = green
+        store.raw_blue[slot] = blue
+        store.raw_alpha[slot] = alpha
+        store.raw[slot] = True
+
+        features = self.__profile.features()
+        if features & FEATURE_ON:
+            store.onoff[slot] = bool(onoff)
+
+        if features & FEATURE_LUM:
+            store.lum[slot] = lum
+
+        if features & FEATURE_TEMP:
+            store.temp[slot] = temp
+
+        if features & FEATURE_RGB:
+            store.red[slot] = red
+            store.green[slot] = green
+            store.blue[slot] = blue
+
+    def set_onoff(self, onoff, send=True, deadline=None):
         """ set on/off
 
         :param onoff: true/false
         :param send: whether to send a command to gateway
+        :param deadline: optional time (time.time()) by which the command
+            must be answered
         :return:
         """
         if self.__deleted:
             return
 
-        if 'on' not in self.__supported_features:
+        if not self.__profile.features() & FEATURE_ON:
             return
 
+        store = self.__store
+        slot = self.__slot
         onoff = bool(onoff)
-        self.__onoff = onoff
-        if onoff and self.__lum == 0:
-            self.__lum = DEFAULT_LUMINANCE
+        if (send and self.__conn.cache_fresh([self.addr()]) and
+                store.onoff[slot] == onoff):
+            self.__conn.elide()
+            return
+
+        with self.__conn.light_change(self):
+            store.onoff[slot] = onoff
+            if onoff and store.lum[slot] == 0:
+                store.lum[slot] = DEFAULT_LUMINANCE
 
         if send:
             command = self.__conn.build_onoff(self, onoff)
-            self.__conn.send(command)
-            self.__conn.set_lights_changed()
+            self.__conn.send(command, deadline=deadline)
+            self.__conn.set_lights_changed([self.addr()])
 
-    def set_luminance(self, lum, transition, send=True):
+    def set_luminance(self, lum, transition, send=True, deadline=None):
         """ set luminance (brightness)
 
         :param lum: luminance (brightness). if 0, the light is turned off.
         :param transition: transition time in 1/10 seconds, 0 to disable
         :param send: whether to send a command to gateway
+        :param deadline: optional time (time.time()) by which the command
+            must be answered
         :return:
         """
         if self.__deleted:
             return
 
-        if 'lum' not in self.__supported_features:
+        if not self.__profile.features() & FEATURE_LUM:
             return
 
+        store = self.__store
+        slot = self.__slot
         lum = min(int(lum), MAX_LUMINANCE)
-        self.__lum = lum
-        if lum > 0:
-            self.__lum = lum
-            self.__onoff = True
-        elif lum == 0:
-            self.__lum = DEFAULT_LUMINANCE
-            self.__onoff = False
+        if send and self.__conn.cache_fresh([self.addr()]) and (
+                store.onoff[slot] and store.lum[slot] == lum if lum > 0
+                else not store.onoff[slot]):
+            self.__conn.elide()
+            return
+
+        with self.__conn.light_change(self):
+            store.lum[slot] = lum
+            if lum > 0:
+                store.onoff[slot] = True
+            elif lum == 0:
+                store.lum[slot] = DEFAULT_LUMINANCE
+                store.onoff[slot] = False
 
         if send:
             command = self.__conn.build_luminance(self, lum, transition)
-            self.__conn.send(command)
-            self.__conn.set_lights_changed()
+            self.__conn.send(command, deadline=deadline)
+            self.__conn.set_lights_changed([self.addr()])
 
-    def set_temperature(self, temp, transition, send=True):
+    def set_temperature(self, temp, transition, send=True, deadline=None):
         """ set colour temperature
 
         :param temp: colour temperature in kelvin
         :param transition: transition time in 1/10 seconds, 0 to disable
         :param send: whether to send a command to gateway
+        :param deadline: optional time (time.time()) by which the command
+            must be answered
         :return:
         """
         if self.__deleted:
             return
 
-        if 'temp' not in self.__supported_features:
+        if not self.__profile.features() & FEATURE_TEMP:
             return
 
         temp = max(self.min_temp(), int(temp))
         temp = min(temp, self.max_temp())
-        self.__temp = temp
+        if (send and self.__conn.cache_fresh([self.addr()]) and
+                self.__store.temp[self.__slot] == temp):
+            self.__conn.elide()
+            return
+
+        with self.__conn.light_change(self):
+            self.__store.temp[self.__slot] = temp
 
         if send:
             command = self.__conn.build_temp(self, temp, transition)
-            self.__conn.send(command)
-            self.__conn.set_lights_changed()
+            self.__conn.send(command, deadline=deadline)
+            self.__conn.set_lights_changed([self.addr()])
 
-    def set_rgb(self, red, green, blue, transition, send=True):
+    def set_rgb(self, red, green, blue, transition, send=True, deadline=None):
         """ set RGB colour
 
         :param red: amount of red
@@ -563,26 +956,37 @@ class Light:
         :param blue: amount of blue
         :param transition: transition time in 1/10 seconds, 0 to disable
         :param send: whether to send a command to gateway
+        :param deadline: optional time (time.time()) by which the command
+            must be answered
         :return:
         """
         if self.__deleted:
             return
 
-        if 'rgb' not in self.__supported_features:
+        if not self.__profile.features() & FEATURE_RGB:
             return
 
+        store = self.__store
+        slot = self.__slot
         red = min(int(red), MAX_COLOUR)
         green = min(int(green), MAX_COLOUR)
         blue = min(int(blue), MAX_COLOUR)
-        self.__red = red
-        self.__green = green
-        self.__blue = blue
+        if send and self.__conn.cache_fresh([self.addr()]) and (
+                (store.red[slot], store.green[slot], store.blue[slot]) ==
+                (red, green, blue)):
+            self.__conn.elide()
+            return
+
+        with self.__conn.light_change(self):
+            store.red[slot] = red
+            store.green[slot] = green
+            store.blue[slot] = blue
 
         if send:
             command = self.__conn.build_colour(self, red, green, blue,
                                                transition)
-            self.__conn.send(command)
-            self.__conn.set_lights_changed()
+            self.__conn.send(command, deadline=deadline)
+            self.__conn.set_lights_changed([self.addr()])
 
     def build_command(self, command, data):
         """ build a light command
@@ -591,10 +995,10 @@ class Light:
         :param data: additional binary data
         :return: binary data to be sent to the gateway
         """
-        return self.__conn.build_light_command(command, self.__addr, data)
+        return self.__conn.build_light_command(command, self.addr(), data)
 
     def __str__(self):
-        return '<light %s: %s>' % (self.__addr, self.__name)
+        return '<light %s: %s>' % (self.addr(), self.name())
 
 
 class Group:
@@ -616,6 +1020,8 @@ class Group:
         self.__min_temp = 0
         self.__max_temp = 0
         self.__deleted = False
+        # cached aggregates of the group's lights, replaced on changes
+        self.__aggregates = {}
 
     def name(self):
         """
@@ -658,7 +1064,7 @@ class Group:
 
         features = [self.__conn.lights()[addr].supported_features()
                     for addr in self.__lights if addr in self.__conn.lights()]
-        self.__supported_features = set.union(*features)
+        self.__supported_features = set().union(*features)
         self.__min_temp = min(self.__conn.lights()[addr].min_temp()
                               for addr in self.__lights
                               if addr in self.__conn.lights())
@@ -686,19 +1092,42 @@ class Group:
         """
         return self.__max_temp
 
+    def mark_changed(self):
+        """ mark the state of the group's lights as changed
+            the aggregates are computed again on next access
+
+        :return:
+        """
+        self.__aggregates = {}
+
+    def _member_lights(self):
+        """
+        :return: list of the group's Light objects
+        """
+        lights = self.__conn.lights()
+        return [lights[addr] for addr in self.__lights if addr in lights]
+
     def on(self):
         """
         :return: true if any of the group's lights is on
         """
-        return any(self.__conn.lights()[addr].on()
-                   for addr in self.__lights if addr in self.__conn.lights())
+        aggregates = self.__aggregates
+        if 'on' not in aggregates:
+            aggregates['on'] = any(light.on()
+                                   for light in self._member_lights())
+
+        return aggregates['on']
 
     def reachable(self):
         """
         :return: true if any of the group's lights is reachable
         """
-        return any(self.__conn.lights()[addr].reachable()
-                   for addr in self.__lights if addr in self.__conn.lights())
+        aggregates = self.__aggregates
+        if 'reachable' not in aggregates:
+            aggregates['reachable'] = any(light.reachable()
+                                          for light in self._member_lights())
+
+        return aggregates['reachable']
 
     def _lights_attribute(self, attr, feature):
         """ do a best guess about the group's lights attribute
@@ -707,15 +1136,14 @@ class Group:
         :param feature: supported feature for ordering
         :return: guessed attribute value
         """
-        lights = [self.__conn.lights()[addr] for addr in self.__lights
-                  if addr in self.__conn.lights()]
-        if not lights:
-            return 0
+        aggregates = self.__aggregates
+        if attr not in aggregates:
+            lights = self._member_lights()
+            aggregates[attr] = max(
+                (feature in light.supported_features(), getattr(light, attr)())
+                for light in lights)[1] if lights else 0
 
-        lights = [(feature in light.supported_features(),
-                   getattr(light, attr)()) for light in lights]
-        lights.sort(key=lambda t: (t[0], t[1]), reverse=True)
-        return lights[0][1]
+        return aggregates[attr]
 
     def lum(self):
         """
@@ -761,6 +1189,7 @@ class Group:
         :return:
         """
         self.__lights = lights
+        self.__aggregates = {}
 
     def set_scenes(self, scenes):
         """ set group's scenes
@@ -781,52 +1210,76 @@ class Group:
         """
         self.__deleted = True
 
-    def set_onoff(self, onoff):
+    def set_onoff(self, onoff, send=True, deadline=None):
         """ set on/off for the group's lights
 
         :param onoff: true/false
+        :param send: whether to send a command to gateway
+        :param deadline: optional time (time.time()) by which the command
+            must be answered
         :return:
         """
         if self.__deleted:
             return
 
         onoff = bool(onoff)
-        command = self.__conn.build_onoff(self, onoff)
-        self.__conn.send(command)
+        if send and self._unchanged(FEATURE_ON, lambda light:
+                                    light.on() == onoff):
+            self.__conn.elide()
+            return
+
+        if send:
+            command = self.__conn.build_onoff(self, onoff)
+            self.__conn.send(command, deadline=deadline)
 
         for addr in self.__lights:
             if addr in self.__conn.lights():
                 light = self.__conn.lights()[addr]
                 light.set_onoff(onoff, send=False)
 
-        self.__conn.set_lights_changed()
+        if send:
+            self.__conn.set_lights_changed(self.__lights)
 
-    def set_luminance(self, lum, transition):
+    def set_luminance(self, lum, transition, send=True, deadline=None):
         """ set luminance (brightness) for the group's lights
 
         :param lum: luminance (brightness)
         :param transition: transition time in 1/10 seconds, 0 to disable
+        :param send: whether to send a command to gateway
+        :param deadline: optional time (time.time()) by which the command
+            must be answered
         :return:
         """
         if self.__deleted:
             return
 
         lum = min(int(lum), MAX_LUMINANCE)
-        command = self.__conn.build_luminance(self, lum, transition)
-        self.__conn.send(command)
+        if send and self._unchanged(FEATURE_LUM, lambda light: (
+                light.on() and light.lum() == lum if lum > 0
+                else not light.on())):
+            self.__conn.elide()
+            return
+
+        if send:
+            command = self.__conn.build_luminance(self, lum, transition)
+            self.__conn.send(command, deadline=deadline)
 
         for addr in self.__lights:
             if addr in self.__conn.lights():
                 light = self.__conn.lights()[addr]
                 light.set_luminance(lum, transition, send=False)
 
-        self.__conn.set_lights_changed()
+        if send:
+            self.__conn.set_lights_changed(self.__lights)
 
-    def set_temperature(self, temp, transition):
+    def set_temperature(self, temp, transition, send=True, deadline=None):
         """ set colour temperature for the group's lights
 
         :param temp: colour temperature in kelvin
         :param transition: transition time in 1/10 seconds, 0 to disable
+        :param send: whether to send a command to gateway
+        :param deadline: optional time (time.time()) by which the command
+            must be answered
         :return:
         """
         if self.__deleted:
@@ -834,23 +1287,34 @@ class Group:
 
         temp = max(self.min_temp(), int(temp))
         temp = min(temp, self.max_temp())
-        command = self.__conn.build_temp(self, temp, transition)
-        self.__conn.send(command)
+        if send and self._unchanged(FEATURE_TEMP, lambda light: (
+                light.temp() == max(light.min_temp(),
+                                    min(temp, light.max_temp())))):
+            self.__conn.elide()
+            return
+
+        if send:
+            command = self.__conn.build_temp(self, temp, transition)
+            self.__conn.send(command, deadline=deadline)
 
         for addr in self.__lights:
             if addr in self.__conn.lights():
                 light = self.__conn.lights()[addr]
                 light.set_temperature(temp, transition, send=False)
 
-        self.__conn.set_lights_changed()
+        if send:
+            self.__conn.set_lights_changed(self.__lights)
 
-    def set_rgb(self, red, green, blue, transition):
+    def set_rgb(self, red, green, blue, transition, send=True, deadline=None):
         """ set RGB colour for the group's lights
 
         :param red: amount of red
         :param green: amount of green
         :param blue: amount of blue
         :param transition: transition time in 1/10 seconds, 0 to disable
+        :param send: whether to send a command to gateway
+        :param deadline: optional time (time.time()) by which the command
+            must be answered
         :return:
         """
         if self.__deleted:
@@ -859,26 +1323,52 @@ class Group:
         red = min(int(red), MAX_COLOUR)
         green = min(int(green), MAX_COLOUR)
         blue = min(int(blue), MAX_COLOUR)
-        command = self.__conn.build_colour(self, red, green, blue, transition)
-        self.__conn.send(command)
+        if send and self._unchanged(FEATURE_RGB, lambda light:
+                                    light.rgb() == (red, green, blue)):
+            self.__conn.elide()
+            return
+
+        if send:
+            command = self.__conn.build_colour(self, red, green, blue,
+                                               transition)
+            self.__conn.send(command, deadline=deadline)
 
         for addr in self.__lights:
             if addr in self.__conn.lights():
                 light = self.__conn.lights()[addr]
                 light.set_rgb(red, green, blue, transition, send=False)
 
-        self.__conn.set_lights_changed()
+        if send:
+            self.__conn.set_lights_changed(self.__lights)
+
+    def _unchanged(self, feature, matches):
+        """ check whether a command can be skipped because the fresh cached
+            values of the group's lights already match
+
+        :param feature: feature flag (FEATURE_*) required by the command
+        :param matches: callable returning whether a light's value matches
+        :return: true if the command would not change any light
+        """
+        if not self.__conn.cache_fresh(self.__lights):
+            return False
+
+        lights = [self.__conn.lights()[addr] for addr in self.__lights
+                  if addr in self.__conn.lights()]
+        lights = [light for light in lights if light.features() & feature]
+        return bool(lights) and all(matches(light) for light in lights)
 
-    def activate_scene(self, name):
+    def activate_scene(self, name, deadline=None):
         """ activate a group's scene
 
         :param name: scene name
+        :param deadline: optional time (time.time()) by which the command
+            must be answered
         :return:
         """
         if name in self.__scenes:
             scene = self.__conn.scenes().get(name)
             if scene:
-                scene.activate()
+                scene.activate(deadline)
 
     def build_command(self, command, data):
         """ build a group command
@@ -899,628 +1389,3773 @@ class Group:
         return '<group %s: %s, lights: %s>' % (self.__idx, self.__name,
                                                ' '.join(lights))
 
-class Lightify:
-    class __Lightify:
-        """ main osram lightify class
+class LightsDiff:
+    """ difference applied to the lights by an all light status update
+    """
+
+    def __init__(self):
+        self.__added = {}
+        self.__removed = {}
+        self.__changed = {}
+
+    def added(self):
         """
-        def __init__(self, host, new_device_types=None, log_level=logging.INFO,
-                    loghandler=None):
-            """
-            :param host: lightify gateway host
-            :param new_device_types: dict of additional device types to merge with
-                default device types:
-                {<type_id>: {
-                    'type': <DeviceType instance>,
-                    'subtype': <DeviceSubType instance>,
-                    'name': <name of the device>,
-                    # only for LIGHT_TUNABLE_WHITE and LIGHT_RGBW:
-                    'min_temp': <minimum temperature>, # optional, default:
-                                                    # 2700 (LIGHT_TUNABLE_WHITE)
-                                                    # 1900 (LIGHT_RGBW)
-                    'max_temp': <maximum temperature>  # optional, default: 6500
-                },
-                ...
-                }
-                For example:
-                {128: {
-                    'type': DeviceType.LIGHT,
-                    'subtype': DeviceSubType.LIGHT_TUNABLE_WHITE,
-                    'name': 'tradfri tunable white',
-                    'min_temp': 2200,
-                    'max_temp': 4000
-                }
-                }
-            }}
-            :param log_level: logging.loglevel Enum
-            :param loghandler: logging.Handler object
-            """
-            self.__device_types = DEVICE_TYPES.copy()
-            self.__device_types.update(new_device_types or {})
+        :return: dict from light mac address to Light object of newly
+            discovered lights
+        """
+        return self.__added
 
-            self.__logger = logging.getLogger(MODULE)
-            self.__logger.setLevel(log_level)
-            self.__logger.addHandler(loghandler or logging.NullHandler())
-            self.__logger.info('Initializing %s, version=%s', MODULE, __version__)
+    def removed(self):
+        """
+        :return: dict from light mac address to Light object of lights
+            deleted from gateway
+        """
+        return self.__removed
 
-            # a sequence number used to number commands sent to the gateway
-            self.__seq = 0
+    def changed(self):
+        """
+        :return: dict from light mac address to set of changed fields
+            (see LIGHT_FIELDS) of already known lights
+        """
+        return self.__changed
 
-            self.__groups = {}
-            self.__scenes = {}
-            self.__lights = {}
-            self.__groups_updated = 0
-            self.__scenes_updated = 0
-            self.__lights_updated = 0
-            self.__lights_changed = 0
-            self.__lights_hash = ''
-            self.__lock = threading.RLock()
-            self.__host = host
-            self.__sock = None
-            self._connect()
+    def set_added(self, light):
+        """ record a newly discovered light
 
-        def __del__(self):
-            try:
-                self.__sock.shutdown(socket.SHUT_RDWR)
-            except OSError:
-                pass
+        :param light: Light object
+        :return:
+        """
+        self.__added[light.addr()] = light
 
-            self.__sock.close()
+    def set_removed(self, light):
+        """ record a light deleted from gateway
 
-        def _connect(self):
-            """ establish a connection with the lightify gateway
+        :param light: Light object
+        :return:
+        """
+        self.__removed[light.addr()] = light
 
-            :return:
-            """
-            with self.__lock:
-                self.__sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.__sock.settimeout(GATEWAY_TIMEOUT_SECONDS)
-                self.__sock.connect((self.__host, PORT))
+    def set_changed(self, light, fields):
+        """ record changed fields of a known light
 
-        def _next_seq(self):
-            """
+        :param light: Light object
+        :param fields: set of changed fields
+        :return:
+        """
+        self.__changed[light.addr()] = fields
+
+    def __len__(self):
+        return len(self.__added) + len(self.__removed) + len(self.__changed)
+
+    def __str__(self):
+        return '<lights diff: added: %s, removed: %s, changed: %s>' % (
+            len(self.__added), len(self.__removed), len(self.__changed))
+
+
+class LightsView(Mapping):
+    """ read-only dict from light mac address to Light object for the lights
+        found by a query
+    """
+
+    def __init__(self, lights, addrs):
+        """
+        :param lights: dict from light mac address to Light object
+        :param addrs: set of light mac addresses in the view
+        """
+        self.__lights = lights
+        self.__addrs = addrs
+
+    def __getitem__(self, addr):
+        if addr not in self.__addrs:
+            raise KeyError(addr)
+
+        return self.__lights[addr]
+
+    def __iter__(self):
+        return iter(self.__addrs)
+
+    def __len__(self):
+        return len(self.__addrs)
+
+    def __contains__(self, addr):
+        return addr in self.__addrs
+
+    def __str__(self):
+        return '<lights view: %s>' % ' '.join(str(light)
+                                              for light in self.values())
+
+
+class ReadOnlyDict(Mapping):
+    """ read-only view of a dict
+    """
+
+    def __init__(self, items):
+        """
+        :param items: dict
+        """
+        self.__items = items
+
+    def __getitem__(self, key):
+        return self.__items[key]
+
+    def __iter__(self):
+        return iter(self.__items)
+
+    def __len__(self):
+        return len(self.__items)
+
+    def __contains__(self, key):
+        return key in self.__items
+
+
+class LightState(collections.namedtuple('LightState',
+                                        ('addr',) + LIGHT_FIELDS)):
+    """ immutable values of a light: its mac address and LIGHT_FIELDS
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_light(cls, light):
+        """
+        :param light: Light object
+        :return: LightState object with the current values of the light
+        """
+        return cls(light.addr(), *[
+            tuple(value) if isinstance(value, list) else value
+            for value in (getattr(light, field)() for field in LIGHT_FIELDS)])
+
+
+class GroupState(collections.namedtuple('GroupState',
+                                        ('idx', 'name', 'lights', 'scenes'))):
+    """ immutable group: index, name and tuples of the light mac addresses
+        and scene names
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_group(cls, group):
+        """
+        :param group: Group object
+        :return: GroupState object
+        """
+        return cls(group.idx(), group.name(), tuple(group.lights()),
+                   tuple(group.scenes()))
+
+
+class SceneState(collections.namedtuple('SceneState',
+                                        ('idx', 'name', 'group'))):
+    """ immutable scene: index, name and associated group index
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_scene(cls, scene):
+        """
+        :param scene: Scene object
+        :return: SceneState object
+        """
+        return cls(scene.idx(), scene.name(), scene.group())
+
+
+class GatewayState:
+    """ immutable snapshot of the lights, groups and scenes of a connection
+        for consistent reads of several values, see Lightify.state()
+    """
+
+    def __init__(self, lights, groups, scenes, updated, version):
+        """
+        :param lights: dict from light mac address to LightState object
+        :param groups: dict from group name to GroupState object
+        :param scenes: dict from scene name to SceneState object
+        :param updated: dict from resource ('lights', 'groups', 'scenes') to
+            timestamp of its last update
+        :param version: version of the connection's state
+        """
+        self.__lights = ReadOnlyDict(lights)
+        self.__groups = ReadOnlyDict(groups)
+        self.__scenes = ReadOnlyDict(scenes)
+        self.__updated = ReadOnlyDict(updated)
+        self.__version = version
+
+    def lights(self):
+        """
+        :return: read-only dict from light mac address to LightState object
+        """
+        return self.__lights
+
+    def groups(self):
+        """
+        :return: read-only dict from group name to GroupState object
+        """
+        return self.__groups
+
+    def scenes(self):
+        """
+        :return: read-only dict from scene name to SceneState object
+        """
+        return self.__scenes
+
+    def group_lights(self, name):
+        """
+        :param name: group name
+        :return: list of LightState objects of the group's lights
+        """
+        group = self.__groups.get(name)
+        if group is None:
+            return []
+
+        return [self.__lights[addr] for addr in group.lights
+                if addr in self.__lights]
+
+    def updated(self):
+        """
+        :return: read-only dict from resource ('lights', 'groups', 'scenes')
+            to timestamp of its last update
+        """
+        return self.__updated
+
+    def version(self):
+        """
+        :return: version of the connection's state the snapshot was taken of
+        """
+        return self.__version
+
+    def __str__(self):
+        return '<gateway state: %d lights, %d groups, %d scenes>' % (
+            len(self.__lights), len(self.__groups), len(self.__scenes))
+
+
+class Event:
+    """ state change of a light, group or scene
+    """
+
+    def __init__(self, event_type, item, value=None):
+        """
+        :param event_type: EventType object
+        :param item: changed Light, Group or Scene object
+        :param value: new value of the changed field (None for ADDED and
+            DELETED)
+        """
+        self.__type = event_type
+        self.__item = item
+        self.__value = value
+
+    def type(self):
+        """
+        :return: event type (EventType object)
+        """
+        return self.__type
+
+    def item(self):
+        """
+        :return: changed Light, Group or Scene object
+        """
+        return self.__item
+
+    def value(self):
+        """
+        :return: new value of the changed field
+        """
+        return self.__value
+
+    def __str__(self):
+        return '<event %s: %s, value: %s>' % (self.__type.value, self.__item,
+                                              self.__value)
+
+
+class Subscription:
+    """ callback registered for state change events
+    """
+
+    def __init__(self, callback, addrs=None, groups=None, types=None):
+        """
+        :param callback: callable invoked with each matching Event object
+        :param addrs: optional list of light mac addresses to filter by
+        :param groups: optional list of group indices to filter by
+        :param types: optional list of EventType objects to filter by
+        """
+        self.__callback = callback
+        self.__addrs = frozenset(addrs) if addrs else None
+        self.__groups = frozenset(groups) if groups else None
+        self.__types = frozenset(types) if types else None
+
+    def callback(self):
+        """
+        :return: callable invoked with each matching Event object
+        """
+        return self.__callback
+
+    def matches(self, event):
+        """
+        :param event: Event object
+        :return: true if the event passes the filters of the subscription
+        """
+        if self.__types and event.type() not in self.__types:
+            return False
+
+        item = event.item()
+        if self.__addrs and not (isinstance(item, Light) and
+                                 item.addr() in self.__addrs):
+            return False
+
+        if self.__groups:
+            if isinstance(item, Light):
+                return not self.__groups.isdisjoint(item.groups())
+            if isinstance(item, Group):
+                return item.idx() in self.__groups
+
+            return item.group() in self.__groups
+
+        return True
+
+
+class ConnectionManager:
+    """ background thread keeping the connection of a Lightify object healthy.
+        a lightweight command is sent whenever the connection was idle for
+        the probe interval or a command failed. if it is not answered in
+        time, the connection is
+        re-established with exponential backoff and jitter, so commands do
+        not stall on a dead socket.
+    """
+
+    def __init__(self, conn, probe_interval=PROBE_INTERVAL,
+                 probe_timeout=PROBE_TIMEOUT, backoff=RECONNECT_BACKOFF):
+        """
+        :param conn: Lightify object
+        :param probe_interval: idle time in seconds before a probe is sent
+        :param probe_timeout: time in seconds to wait for the probe's response
+        :param backoff: (minimum, maximum) delay in seconds between two
+            reconnect attempts
+        """
+        self.__conn = conn
+        self.__probe_interval = probe_interval
+        self.__probe_timeout = probe_timeout
+        self.__backoff = backoff
+        self.__probes = 0
+        self.__failures = 0
+        self.__reconnects = 0
+        self.__logger = logging.getLogger(MODULE)
+        self.__stopped = threading.Event()
+        # set to probe right away
+        self.__check = threading.Event()
+        self.__thread = threading.Thread(target=self._run,
+                                         name='lightify-connection')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stats(self):
+        """
+        :return: dict with the number of probes sent, failed probes and
+            reconnects
+        """
+        return {'probes': self.__probes, 'failures': self.__failures,
+                'reconnects': self.__reconnects}
+
+    def check(self):
+        """ probe the connection now instead of after the probe interval,
+            e.g. after a command failed
+
+        :return:
+        """
+        self.__check.set()
+
+    def stop(self):
+        """ stop the background thread
+
+        :return:
+        """
+        self.__stopped.set()
+        self.__check.set()
+        if self.__thread is not threading.current_thread():
+            self.__thread.join()
+
+    def _recover(self):
+        """ reconnect until it succeeds or the thread is stopped
+
+        :return:
+        """
+        delay = self.__backoff[0]
+        while not self.__stopped.is_set():
+            try:
+                self.__conn.reconnect()
+                self.__reconnects += 1
+                return
+            except socket.error as err:
+                self.__logger.warning('Reconnecting failed: %s', err)
+
+            self.__stopped.wait(random.uniform(delay / 2, delay))
+            delay = min(delay * 2, self.__backoff[1])
+
+    def _run(self):
+        """ probe the connection while it is idle or when a check was
+            requested
+
+        :return:
+        """
+        while not self.__stopped.is_set():
+            idle = self.__conn.idle_time()
+            if idle < self.__probe_interval and not self.__check.is_set():
+                self.__check.wait(self.__probe_interval - idle)
+                continue
+
+            self.__check.clear()
+            self.__probes += 1
+            if not self.__conn.probe(self.__probe_timeout):
+                self.__failures += 1
+                self.__logger.warning('Lightify gateway did not answer the '
+                                      'probe, reconnecting')
+                self._recover()
+
+
+class CommandEncoder:
+    """ encodes command packets from cached templates of the header and the
+        target address, each packet is joined from the template split around
+        the sequence number and the payload
+    """
+
+    # sequence number -> its byte
+    SEQ_BYTES = tuple(bytes((seq,)) for seq in range(256))
+
+    def __init__(self):
+        # (flag, command id, target, payload size) -> header and address
+        # before and after the sequence number
+        self.__templates = {}
+
+    def _template(self, key, flag, command, addr, size):
+        """ build and cache the template of a packet
+
+        :param key: cache key
+        :param flag: packet type (1 byte)
+        :param command: command id (1 byte)
+        :param addr: binary target address (8 bytes) or empty bytes
+        :param size: payload size
+        :return: binary template before and after the sequence number
+        """
+        length = COMMAND_HEADER.size - 2 + len(addr) + size
+        header = COMMAND_HEADER.pack(length, flag, command, 0, 0, 0x07, 0)
+        template = (header[:SEQ_OFFSET], header[SEQ_OFFSET + 1:] + addr)
+        self.__templates[key] = template
+        return template
+
+    def encode(self, flag, command, addr, data, seq):
+        """
+        :param flag: packet type (1 byte)
+        :param command: command id (1 byte)
+        :param addr: binary target address (8 bytes) or empty bytes
+        :param data: binary payload
+        :param seq: sequence number
+        :return: binary packet
+        """
+        key = (flag, command, addr, len(data))
+        template = self.__templates.get(key)
+        if template is None:
+            template = self._template(key, flag, command, addr, len(data))
+
+        return self._fill(template, data, seq)
+
+    def light(self, command, addr, data, seq):
+        """
+        :param command: command id (1 byte)
+        :param addr: light mac address
+        :param data: binary payload
+        :param seq: sequence number
+        :return: binary packet of a light command
+        """
+        key = (FLAG_LIGHT, command, addr, len(data))
+        template = self.__templates.get(key)
+        if template is None:
+            template = self._template(key, FLAG_LIGHT, command,
+                                      LIGHT_ADDR.pack(addr), len(data))
+
+        return self._fill(template, data, seq)
+
+    def group(self, command, idx, data, seq):
+        """
+        :param command: command id (1 byte)
+        :param idx: group or scene index
+        :param data: binary payload
+        :param seq: sequence number
+        :return: binary packet of a group or scene command
+        """
+        key = (FLAG_GLOBAL, command, idx, len(data))
+        template = self.__templates.get(key)
+        if template is None:
+            template = self._template(key, FLAG_GLOBAL, command,
+                                      GROUP_ADDR.pack(idx), len(data))
+
+        return self._fill(template, data, seq)
+
+    def _fill(self, template, data, seq):
+        """ join a packet from its template
+
+        :param template: binary template before and after the sequence number
+        :param data: binary payload
+        :param seq: sequence number
+        :return: binary packet
+        """
+        return b''.join((template[0], self.SEQ_BYTES[seq], template[1], data))
+
+
+class Batch:
+    """ collects the light, group and scene commands sent through a connection
+        and sends them at once. only the last command per target and command
+        id is kept.
+        use as a context manager: the commands are sent on exit unless an
+        exception was raised
+    """
+
+    def __init__(self, conn):
+        """
+        :param conn: Lightify object
+        """
+        self.__conn = conn
+        # (flag and command id, target) -> command, in order of the last write
+        self.__commands = {}
+        self.__lock = threading.Lock()
+        self.__collected = 0
+        self.__previous = None
+
+    def add(self, data):
+        """ collect a command, replacing a pending command with the same
+            target and command id
+
+        :param data: binary command
+        :return:
+        """
+        key = (data[COMMAND_OFFSET - 1:COMMAND_OFFSET + 1],
+               data[ADDR_OFFSET:ADDR_OFFSET + 8])
+        with self.__lock:
+            self.__commands.pop(key, None)
+            self.__commands[key] = data
+            self.__collected += 1
+
+    def commands(self):
+        """
+        :return: list of pending binary commands
+        """
+        with self.__lock:
+            return list(self.__commands.values())
+
+    def collected(self):
+        """
+        :return: number of commands collected (including replaced ones)
+        """
+        return self.__collected
+
+    def flush(self):
+        """ send the pending commands
+
+        :return: list of received packets, in the order of the commands
+        """
+        with self.__lock:
+            packets = list(self.__commands.values())
+            self.__commands.clear()
+
+        return self.__conn.send_many(packets)
+
+    def __len__(self):
+        return len(self.__commands)
+
+    def __enter__(self):
+        self.__previous = self.__conn.set_batch(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.__conn.set_batch(self.__previous)
+        self.__previous = None
+        if exc_type is None:
+            self.flush()
+
+    def __str__(self):
+        return '<batch: %d commands, %d collected>' % (len(self),
+                                                         self.__collected)
+
+
+class Debouncer:
+    """ rate limits the commands per target and command id
+        a command is sent immediately if the previous one to the same target
+        was sent at least 'interval' seconds ago, otherwise it is held back
+        and sent by a background thread when the interval has passed. a held
+        back command is replaced by a newer one, so the latest value is
+        always sent. commands to the same target are sent in the order they
+        were given, a command flushes the held back commands to its target.
+    """
+
+    def __init__(self, conn, interval=DEBOUNCE_INTERVAL):
+        """
+        :param conn: Lightify object
+        :param interval: minimum time in seconds between two commands to the
+            same target
+        """
+        self.__conn = conn
+        self.__interval = interval
+        self.__logger = logging.getLogger(MODULE)
+        # (flag and command id, target) -> (order, held back command)
+        self.__pending = {}
+        self.__order = 0
+        # (flag and command id, target) -> time of the last command, entries
+        # older than the interval are pruned
+        self.__last_sent = {}
+        self.__pruned = 0
+        self.__dropped = 0
+        self.__cond = threading.Condition()
+        # taken before the held back commands are removed and released when
+        # they are sent, so commands leave in the order they were taken
+        self.__sending = threading.Lock()
+        self.__stopped = False
+        self.__thread = threading.Thread(target=self._run,
+                                         name='lightify-debouncer')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def interval(self):
+        """
+        :return: minimum time in seconds between two commands to the same
+            target
+        """
+        return self.__interval
+
+    def set_interval(self, interval):
+        """
+        :param interval: minimum time in seconds between two commands to the
+            same target
+        :return:
+        """
+        with self.__cond:
+            self.__interval = interval
+            self.__cond.notify()
+
+    def pending(self):
+        """
+        :return: number of held back commands
+        """
+        return len(self.__pending)
+
+    def dropped(self):
+        """
+        :return: number of commands replaced by a newer one before they were
+            sent
+        """
+        return self.__dropped
+
+    def send(self, data, deadline=None):
+        """ send a command now or hold it back
+
+        :param data: binary command
+        :param deadline: optional time (time.time()) by which a command sent
+            now must be answered
+        :return: received packet or None if the command was held back
+        """
+        key = (data[COMMAND_OFFSET - 1:COMMAND_OFFSET + 1],
+               data[ADDR_OFFSET:ADDR_OFFSET + 8])
+        with self.__cond:
+            now = time.time()
+            if now >= self.__pruned + self.__interval:
+                self._prune(now)
+
+            if (key in self.__pending or
+                    now < self.__last_sent.get(key, 0) + self.__interval):
+                if key in self.__pending:
+                    self.__dropped += 1
+
+                self.__order += 1
+                self.__pending[key] = (self.__order, data)
+                self.__cond.notify()
+                return None
+
+            self.__last_sent[key] = now
+            packets = self._take(set((key[1],)), now)
+            packets.append(data)
+            self.__sending.acquire()
+
+        try:
+            return self.__conn.send_many(packets, deadline=deadline)[-1]
+        finally:
+            self.__sending.release()
+
+    def stop(self, flush=True):
+        """ stop the background thread
+
+        :param flush: whether to send the held back commands
+        :return:
+        """
+        with self.__cond:
+            self.__stopped = True
+            pending = [data for _, data in sorted(self.__pending.values())
+                       ] if flush else []
+            self.__pending.clear()
+            self.__cond.notify()
+
+        if self.__thread is not threading.current_thread():
+            self.__thread.join()
+
+        if pending:
+            with self.__sending:
+                self.__conn.send_many(pending)
+
+    def _take(self, targets, now):
+        """ remove the held back commands to the given targets.
+            must be called with the condition held
+
+        :param targets: set of target addresses
+        :param now: current time
+        :return: list of binary commands in the order they were given
+        """
+        taken = sorted((entry, key) for key, entry in self.__pending.items()
+                       if key[1] in targets)
+        for _, key in taken:
+            del self.__pending[key]
+            self.__last_sent[key] = now
+
+        return [data for (_, data), _ in taken]
+
+    def _prune(self, now):
+        """ forget the commands sent longer than the interval ago.
+            must be called with the condition held
+
+        :param now: current time
+        :return:
+        """
+        self.__last_sent = dict(
+            (key, sent) for key, sent in self.__last_sent.items()
+            if sent + self.__interval > now or key in self.__pending)
+        self.__pruned = now
+
+    def _run(self):
+        """ send the held back commands when they are due
+
+        :return:
+        """
+        while True:
+            with self.__cond:
+                due = None
+                while not self.__stopped:
+                    now = time.time()
+                    due = [(self.__last_sent.get(key, 0) + self.__interval,
+                            key) for key in self.__pending]
+                    ready = [key for deadline, key in due if deadline <= now]
+                    if ready:
+                        break
+
+                    self.__cond.wait(min(due)[0] - now if due else None)
+
+                if self.__stopped:
+                    return
+
+                packets = self._take(set(key[1] for key in ready), now)
+                self.__sending.acquire()
+
+            try:
+                self.__conn.send_many(packets)
+            except (socket.error, struct.error) as err:
+                self.__logger.warning('Sending debounced commands failed: %s',
+                                      err)
+            finally:
+                self.__sending.release()
+
+
+class Ack:
+    """ acknowledgement of a command sent without waiting for the response
+    """
+
+    def __init__(self, data, callback=None):
+        """
+        :param data: binary command
+        :param callback: optional callable invoked with the Ack object when
+            the response arrived or the command failed
+        """
+        self.__data = data
+        self.__callback = callback
+        self.__status = AckStatus.PENDING
+        self.__response = None
+        self.__error = None
+        self.__event = threading.Event()
+        self.__logger = logging.getLogger(MODULE)
+
+    def command(self):
+        """
+        :return: binary command
+        """
+        return self.__data
+
+    def status(self):
+        """
+        :return: AckStatus object
+        """
+        return self.__status
+
+    def done(self):
+        """
+        :return: true if the command is no longer pending
+        """
+        return self.__status != AckStatus.PENDING
+
+    def response(self):
+        """
+        :return: received packet or None
+        """
+        return self.__response
+
+    def error(self):
+        """
+        :return: exception the command failed with or None
+        """
+        return self.__error
+
+    def wait(self, timeout=None):
+        """ wait for the response
+
+        :param timeout: maximum time in seconds to wait
+        :return: AckStatus object
+        """
+        self.__event.wait(timeout)
+        return self.__status
+
+    def complete(self, future):
+        """ record the outcome of the command
+
+        :param future: concurrent.futures.Future object of the command
+        :return:
+        """
+        try:
+            error = future.exception() if not future.cancelled() else None
+            if future.cancelled():
+                self.__status = AckStatus.FAILED
+            elif isinstance(error, socket.timeout):
+                self.__error = error
+                self.__status = AckStatus.TIMEOUT
+            elif error is not None:
+                self.__error = error
+                self.__status = AckStatus.FAILED
+            else:
+                self.__response = future.result()
+                (status,) = struct.unpack_from('<B', self.__response,
+                                               RESPONSE_STATUS_OFFSET)
+                self.__status = (AckStatus.FAILED if status
+                                 else AckStatus.SUCCESS)
+        except struct.error as err:
+            # short or garbled response
+            self.__error = err
+            self.__status = AckStatus.FAILED
+        finally:
+            # waiters and the pending count must never hang. waiters wake up
+            # after the callback, e.g. with the counters of the connection
+            # updated
+            if self.__status == AckStatus.PENDING:
+                self.__status = AckStatus.FAILED
+            if self.__callback:
+                try:
+                    self.__callback(self)
+                except Exception:  # pylint: disable=broad-except
+                    self.__logger.exception('Acknowledgement callback '
+                                            'failed')
+            self.__event.set()
+
+    def __str__(self):
+        (seq,) = struct.unpack_from('<B', self.__data, SEQ_OFFSET)
+        return '<ack %d: %s>' % (seq, self.__status.name.lower())
+
+
+class Instrumentation:
+    """ base class of instrumentation hooks, see Lightify.set_instrumentation()
+        all hooks do nothing, subclasses override the ones they need
+    """
+
+    def command_started(self, command, size):
+        """ a command is sent
+
+        :param command: command id
+        :param size: number of bytes sent
+        :return:
+        """
+
+    def command_finished(self, command, duration, size, error):
+        """ the response to a command arrived or the command failed
+
+        :param command: command id
+        :param duration: time in seconds since the command was sent
+        :param size: number of bytes received (0 if failed)
+        :param error: exception the command failed with or None
+        :return:
+        """
+
+    def reconnected(self):
+        """ the connection to the gateway was established again
+
+        :return:
+        """
+
+    def parsed(self, resource, duration):
+        """ a response was parsed
+
+        :param resource: 'lights', 'groups' or 'scenes'
+        :param duration: parse time in seconds
+        :return:
+        """
+
+    def lock_waited(self, duration):
+        """ the connection lock was acquired
+
+        :param duration: time in seconds spent waiting for the lock
+        :return:
+        """
+
+
+class TimedLock:
+    """ context manager acquiring a lock and reporting the wait time to an
+        Instrumentation object
+    """
+
+    def __init__(self, lock, hook):
+        """
+        :param lock: lock to acquire
+        :param hook: Instrumentation object
+        """
+        self.__lock = lock
+        self.__hook = hook
+
+    def __enter__(self):
+        start = time.time()
+        self.__lock.acquire()
+        self.__hook.lock_waited(time.time() - start)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.__lock.release()
+
+
+class Metrics(Instrumentation):
+    """ instrumentation hooks recording latency histograms per command id,
+        commands in flight, bytes sent and received, reconnects, timeouts,
+        parse times and lock wait times
+    """
+
+    def __init__(self, host=None, buckets=LATENCY_BUCKETS):
+        """
+        :param host: optional gateway host added as label to the metrics
+        :param buckets: upper bounds in seconds of the latency histogram
+            buckets
+        """
+        self.__host = host
+        self.__buckets = tuple(sorted(buckets))
+        self.__lock = threading.Lock()
+        # command id -> [bucket counts..., +Inf count, sum of latencies]
+        self.__latencies = {}
+        self.__in_flight = 0
+        self.__bytes_sent = 0
+        self.__bytes_received = 0
+        self.__reconnects = 0
+        self.__timeouts = 0
+        self.__errors = 0
+        # resource -> [count, sum of parse times]
+        self.__parse_times = {}
+        self.__lock_waits = [0, 0.0]
+
+    def command_started(self, command, size):
+        with self.__lock:
+            self.__in_flight += 1
+            self.__bytes_sent += size
+
+    def command_finished(self, command, duration, size, error):
+        with self.__lock:
+            self.__in_flight -= 1
+            self.__bytes_received += size
+            if isinstance(error, socket.timeout):
+                self.__timeouts += 1
+            elif error is not None:
+                self.__errors += 1
+
+            latencies = self.__latencies.get(command)
+            if latencies is None:
+                latencies = [0] * (len(self.__buckets) + 1) + [0.0]
+                self.__latencies[command] = latencies
+
+            for pos, bound in enumerate(self.__buckets):
+                if duration <= bound:
+                    latencies[pos] += 1
+                    break
+            else:
+                latencies[len(self.__buckets)] += 1
+
+            latencies[-1] += duration
+
+    def reconnected(self):
+        with self.__lock:
+            self.__reconnects += 1
+
+    def parsed(self, resource, duration):
+        with self.__lock:
+            parse_times = self.__parse_times.setdefault(resource, [0, 0.0])
+            parse_times[0] += 1
+            parse_times[1] += duration
+
+    def lock_waited(self, duration):
+        with self.__lock:
+            self.__lock_waits[0] += 1
+            self.__lock_waits[1] += duration
+
+    def snapshot(self):
+        """
+        :return: dict with the current values of the metrics, latencies as
+            dict from command id to dict with the cumulative 'buckets' (list
+            of (upper bound, count) tuples), 'count' and 'sum'
+        """
+        with self.__lock:
+            latencies = {}
+            for command, values in self.__latencies.items():
+                counts = []
+                total = 0
+                for bound, count in zip(self.__buckets + (float('inf'),),
+                                        values[:-1]):
+                    total += count
+                    counts.append((bound, total))
+
+                latencies[command] = {'buckets': counts, 'count': total,
+                                      'sum': values[-1]}
+
+            return {
+                'latency': latencies,
+                'in_flight': self.__in_flight,
+                'bytes_sent': self.__bytes_sent,
+                'bytes_received': self.__bytes_received,
+                'reconnects': self.__reconnects,
+                'timeouts': self.__timeouts,
+                'errors': self.__errors,
+                'parse': dict((resource, {'count': values[0],
+                                          'sum': values[1]})
+                              for resource, values
+                              in self.__parse_times.items()),
+                'lock_wait': {'count': self.__lock_waits[0],
+                              'sum': self.__lock_waits[1]},
+            }
+
+    def prometheus(self, prefix='lightify'):
+        """
+        :param prefix: prefix of the metric names
+        :return: metrics in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        host = ('host="%s"' % self.__host) if self.__host else ''
+
+        def labels(*pairs):
+            pairs = ((host,) if host else ()) + pairs
+            return '{%s}' % ','.join(pairs) if pairs else ''
+
+        lines = ['# TYPE %s_command_latency_seconds histogram' % prefix]
+        for command, values in sorted(snapshot['latency'].items()):
+            command = 'command="0x%02x"' % command
+            for bound, count in values['buckets']:
+                bound = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('%s_command_latency_seconds_bucket%s %d' % (
+                    prefix, labels(command, 'le="%s"' % bound), count))
+
+            lines.append('%s_command_latency_seconds_sum%s %r' % (
+                prefix, labels(command), values['sum']))
+            lines.append('%s_command_latency_seconds_count%s %d' % (
+                prefix, labels(command), values['count']))
+
+        for name, kind in (('in_flight', 'gauge'),
+                           ('bytes_sent', 'counter'),
+                           ('bytes_received', 'counter'),
+                           ('reconnects', 'counter'),
+                           ('timeouts', 'counter'),
+                           ('errors', 'counter')):
+            metric = '%s_%s%s' % (prefix, name,
+                                  '_total' if kind == 'counter' else '')
+            lines.append('# TYPE %s %s' % (metric, kind))
+            lines.append('%s%s %d' % (metric, labels(), snapshot[name]))
+
+        lines.append('# TYPE %s_parse_seconds summary' % prefix)
+        for resource, values in sorted(snapshot['parse'].items()):
+            resource = 'resource="%s"' % resource
+            lines.append('%s_parse_seconds_sum%s %r' % (
+                prefix, labels(resource), values['sum']))
+            lines.append('%s_parse_seconds_count%s %d' % (
+                prefix, labels(resource), values['count']))
+
+        lines.append('# TYPE %s_lock_wait_seconds summary' % prefix)
+        for suffix in ('sum', 'count'):
+            value = snapshot['lock_wait'][suffix]
+            lines.append('%s_lock_wait_seconds_%s%s %r' % (
+                prefix, suffix, labels(), value))
+
+        return '\n'.join(lines) + '\n'
+
+
+class CommandTimeouts:
+    """ adaptive timeouts per command id, derived from the round trip times
+        of the last commands: a small on/off command fails much sooner than
+        the all light status command with its large reply
+    """
+
+    def __init__(self, percentile=TIMEOUT_PERCENTILE, factor=TIMEOUT_FACTOR,
+                 bounds=TIMEOUT_BOUNDS, window=RTT_WINDOW,
+                 min_samples=RTT_MIN_SAMPLES):
+        """
+        :param percentile: percentile of the round trip times (0-100)
+        :param factor: multiple of the percentile used as timeout
+        :param bounds: (minimum, maximum) timeout in seconds
+        :param window: number of round trip times kept per command id
+        :param min_samples: number of round trip times needed before the
+            timeout is adapted, the maximum applies until then
+        """
+        self.__percentile = percentile
+        self.__factor = factor
+        self.__bounds = bounds
+        self.__window = window
+        self.__min_samples = min_samples
+        # command id -> deque of round trip times and computed timeout
+        self.__samples = {}
+        self.__timeouts = {}
+        self.__lock = threading.Lock()
+
+    def record(self, command, rtt):
+        """ add a measured round trip time
+
+        :param command: command id
+        :param rtt: round trip time in seconds
+        :return:
+        """
+        with self.__lock:
+            samples = self.__samples.get(command)
+            if samples is None:
+                samples = collections.deque(maxlen=self.__window)
+                self.__samples[command] = samples
+
+            samples.append(rtt)
+            self.__timeouts.pop(command, None)
+
+    def timed_out(self, command):
+        """ back off the timeout of a command that was not answered in time
+            until the next round trip time is measured. the timeout is not
+            recorded as a round trip time, it would inflate the percentile.
+
+        :param command: command id
+        :return:
+        """
+        timeout = self.timeout(command)
+        with self.__lock:
+            self.__timeouts[command] = min(timeout * TIMEOUT_BACKOFF,
+                                           self.__bounds[1])
+
+    def rtt(self, command, percentile=None):
+        """
+        :param command: command id
+        :param percentile: percentile (0-100), defaults to the one the
+            timeouts are derived from
+        :return: percentile of the round trip times in seconds or None if
+            none were measured
+        """
+        with self.__lock:
+            samples = sorted(self.__samples.get(command, ()))
+
+        if not samples:
+            return None
+
+        if percentile is None:
+            percentile = self.__percentile
+
+        pos = int(round(percentile / 100.0 * (len(samples) - 1)))
+        return samples[pos]
+
+    def timeout(self, command):
+        """
+        :param command: command id
+        :return: timeout in seconds
+        """
+        timeout = self.__timeouts.get(command)
+        if timeout is not None:
+            return timeout
+
+        minimum, maximum = self.__bounds
+        if len(self.__samples.get(command, ())) < self.__min_samples:
+            timeout = maximum
+        else:
+            timeout = min(max(self.rtt(command) * self.__factor, minimum),
+                          maximum)
+
+        self.__timeouts[command] = timeout
+        return timeout
+
+    def stats(self):
+        """
+        :return: dict from command id to dict with the number of measured
+            round trip times, their median and percentile and the timeout
+        """
+        return dict((command, {'samples': len(self.__samples[command]),
+                               'median': self.rtt(command, 50),
+                               'percentile': self.rtt(command),
+                               'timeout': self.timeout(command)})
+                    for command in list(self.__samples))
+
+
+class Lightify:
+    class __Lightify:
+        """ main osram lightify class
+        """
+        # class of the background poller, see start_polling()
+        poller_class = Poller
+        # class of the background health checks, see enable_health_checks()
+        connection_manager_class = ConnectionManager
+        # whether lights(), groups() and scenes() fetch the models from the
+        # gateway if they were not updated yet
+        load_on_demand = True
+
+        def __init__(self, host, new_device_types=None, log_level=logging.INFO,
+                    loghandler=None):
+            """
+            :param host: lightify gateway host
+            :param new_device_types: dict of additional device types to merge with
+                default device types:
+                {<type_id>: {
+                    'type': <DeviceType instance>,
+                    'subtype': <DeviceSubType instance>,
+                    'name': <name of the device>,
+                    # only for LIGHT_TUNABLE_WHITE and LIGHT_RGBW:
+                    'min_temp': <minimum temperature>, # optional, default:
+                                                    # 2700 (LIGHT_TUNABLE_WHITE)
+                                                    # 1900 (LIGHT_RGBW)
+                    'max_temp': <maximum temperature>  # optional, default: 6500
+                },
+                ...
+                }
+                For example:
+                {128: {
+                    'type': DeviceType.LIGHT,
+                    'subtype': DeviceSubType.LIGHT_TUNABLE_WHITE,
+                    'name': 'tradfri tunable white',
+                    'min_temp': 2200,
+                    'max_temp': 4000
+                }
+                }
+            }}
+            :param log_level: logging.loglevel Enum
+            :param loghandler: logging.Handler object
+            """
+            self.__device_types = DEVICE_TYPES.copy()
+            self.__device_types.update(new_device_types or {})
+            # type id -> DeviceProfile object, shared by lights of that type
+            self.__device_profiles = DEVICE_PROFILES.copy()
+            self.__device_profiles.update(
+                (type_id, DeviceProfile(device_info))
+                for type_id, device_info in (new_device_types or {}).items())
+            # assumed type id -> DeviceProfile object of unknown devices
+            self.__unknown_profiles = {}
+
+            self.__logger = logging.getLogger(MODULE)
+            self.__logger.setLevel(log_level)
+            self.__logger.addHandler(loghandler or logging.NullHandler())
+            self.__logger.info('Initializing %s, version=%s', MODULE, __version__)
+
+            # a sequence number used to number commands sent to the gateway
+            self.__seq = 0
+            # per-thread state: active Batch object, last Ack object
+            self.__local = threading.local()
+            self.__debouncer = None
+            self.__elision_max_age = None
+            self.__elided = 0
+            self.__elided_lock = threading.Lock()
+            # mac addresses of the lights whose local values were not
+            # confirmed by the gateway because a command failed, they are
+            # not elided until the next light status update
+            self.__unconfirmed = set()
+            # fire-and-forget mode: None if disabled, else the callback
+            # (possibly None) and the outcome counters
+            self.__ack_callback = None
+            self.__ack_stats = None
+            self.__ack_lock = threading.Lock()
+            # whether enable_fire_and_forget() enabled pipelining
+            self.__ack_pipelining = False
+            # Instrumentation object or None
+            self.__hook = None
+            # snapshot file and the last received list packets by resource
+            # ('lights', 'groups', 'scenes') if snapshots are enabled
+            self.__snapshot_path = None
+            self.__packets = None
+            # whether a background save of the snapshot is due, the file is
+            # written by one thread at a time
+            self.__save_due = False
+            self.__save_lock = threading.Lock()
+
+            self.__groups = {}
+            self.__scenes = {}
+            self.__lights = {}
+            # columnar storage of the lights' values
+            self.__light_store = LightStore()
+            self.__groups_updated = 0
+            self.__scenes_updated = 0
+            self.__lights_updated = 0
+            self.__lights_changed = 0
+            # light mac address -> (idx, raw all light status record)
+            self.__light_records = {}
+            self.__lights_diff = LightsDiff()
+            # group membership index: light mac address -> (idx, group
+            # bitmask), light mac addresses by idx and group idx -> bitmask
+            # of the idx of the group's lights
+            self.__light_slots = {}
+            self.__lights_byidx = []
+            self.__group_members = {}
+            # group idx -> list of scene names
+            self.__group_scenes = {}
+            # group idx -> Group object
+            self.__groups_byidx = {}
+            # light lookup indexes: name -> list of light mac addresses,
+            # DeviceType, DeviceSubType or feature -> set of mac addresses
+            # and the sets of reachable and switched on lights
+            self.__light_names = {}
+            self.__lights_byname = {}
+            self.__lights_bytype = {}
+            self.__reachable_lights = set()
+            self.__on_lights = set()
+            self.__subscriptions = []
+            self.__poller = None
+            self.__connection_manager = None
+            # time of the last command, for the health checks while idle
+            self.__last_activity = time.time()
+            # CommandTimeouts object or None if the timeouts are fixed
+            self.__timeouts = None
+            # the state lock guards the models, the I/O lock the connection.
+            # a refresh holds the I/O lock while waiting for the gateway and
+            # the state lock only while applying the response
+            self.__lock = threading.RLock()
+            self.__io_lock = threading.RLock()
+            self.__seq_lock = threading.Lock()
+            # last published GatewayState object (None until requested) and
+            # version of the models, changed by every update
+            self.__state = None
+            self.__state_version = 0
+            self.__host = host
+            # connected on the first command, see connect()
+            self.__sock = None
+            self.__frames = None
+            self.__encoder = CommandEncoder()
+            self.__pipeline = None
+
+        def __del__(self):
+            if self.__pipeline is not None:
+                self.__pipeline.close()
+                return
+
+            if self.__sock is None:
+                return
+
+            try:
+                self.__sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+            self.__sock.close()
+
+        def connect(self):
+            """ establish the connection with the lightify gateway now
+                instead of on the first command
+
+            :return:
+            """
+            with self.__io_lock:
+                if self.__sock is None:
+                    self._connect()
+
+        def _connect(self, deadline=None):
+            """ establish a connection with the lightify gateway
+
+            :param deadline: optional time (time.time()) by which the
+                connection must be established
+            :return:
+            """
+            timeout = GATEWAY_TIMEOUT_SECONDS
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.time())
+                if timeout <= 0:
+                    raise socket.timeout('Deadline expired')
+
+            with self.__io_lock:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                try:
+                    sock.settimeout(timeout)
+                    self._configure_socket(sock)
+                    sock.connect((self.__host, PORT))
+                    sock.settimeout(GATEWAY_TIMEOUT_SECONDS)
+                except socket.error:
+                    sock.close()
+                    raise
+
+                old_sock = self.__sock
+                if old_sock is not None and self.__hook is not None:
+                    self.__hook.reconnected()
+
+                self.__sock = sock
+                self.__last_activity = time.time()
+                if old_sock is not None and self.__pipeline is None:
+                    old_sock.close()
+                self.__frames = FrameReader(self.__sock)
+
+                if self.__pipeline is not None:
+                    self.__pipeline.close()
+                    self.__pipeline = Pipeline(self.__sock,
+                                               self.__pipeline.window(),
+                                               logger=self.__logger)
+
+        @staticmethod
+        def _configure_socket(sock):
+            """ send small commands immediately and let the operating system
+                detect dead connections
+
+            :param sock: socket object
+            :return:
+            """
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            for option, value in KEEPALIVE_OPTIONS:
+                if hasattr(socket, option):
+                    sock.setsockopt(socket.IPPROTO_TCP,
+                                    getattr(socket, option), value)
+
+        def reconnect(self):
+            """ replace the connection with a new one, e.g. after a failed
+                probe
+
+            :return:
+            """
+            with self.__io_lock:
+                self._connect()
+
+        def idle_time(self):
+            """
+            :return: time in seconds since the last command was sent
+            """
+            return time.time() - self.__last_activity
+
+        def probe(self, timeout=PROBE_TIMEOUT):
+            """ check the connection with the command of build_probe(). a
+                connection busy with another command is considered healthy.
+
+            :param timeout: time in seconds to wait for the response
+            :return: true if the gateway answered in time
+            """
+            data = self.build_probe()
+            try:
+                pipeline = self.__pipeline
+                if pipeline is not None:
+                    if pipeline.error() is not None:
+                        return False
+
+                    pipeline.submit(data).result(timeout)
+                    self.__last_activity = time.time()
+                    return True
+
+                if not self.__io_lock.acquire(False):
+                    return True
+
+                try:
+                    if self.__sock is None:
+                        return True
+
+                    self.__sock.settimeout(timeout)
+                    try:
+                        self.__sock.sendall(data)
+                        self.__frames.read()
+                    finally:
+                        self.__sock.settimeout(GATEWAY_TIMEOUT_SECONDS)
+                finally:
+                    self.__io_lock.release()
+            except (socket.error, futures.TimeoutError) as err:
+                self.__logger.warning('Probe failed: %s', err)
+                return False
+
+            self.__last_activity = time.time()
+            return True
+
+        def enable_adaptive_timeouts(self, percentile=TIMEOUT_PERCENTILE,
+                                     factor=TIMEOUT_FACTOR,
+                                     bounds=TIMEOUT_BOUNDS):
+            """ derive the timeout of each command id from the round trip
+                times of the last commands instead of waiting
+                GATEWAY_TIMEOUT_SECONDS for every response
+
+            :param percentile: percentile of the round trip times (0-100)
+            :param factor: multiple of the percentile used as timeout
+            :param bounds: (minimum, maximum) timeout in seconds
+            :return: CommandTimeouts object
+            """
+            with self.__lock:
+                if self.__timeouts is None:
+                    self.__timeouts = CommandTimeouts(percentile, factor,
+                                                      bounds)
+
+                return self.__timeouts
+
+        def disable_adaptive_timeouts(self):
+            """ go back to the fixed timeout
+
+            :return:
+            """
+            self.__timeouts = None
+
+        def command_timeouts(self):
+            """
+            :return: CommandTimeouts object or None if the timeouts are fixed
+            """
+            return self.__timeouts
+
+        def command_timeout(self, command, deadline=None, adaptive=True):
+            """
+            :param command: command id
+            :param deadline: optional time (time.time()) by which the command
+                must be answered
+            :param adaptive: whether to use the adaptive timeout if enabled.
+                if false, GATEWAY_TIMEOUT_SECONDS applies
+            :return: time in seconds to wait for the response
+            :raises socket.timeout: if the deadline has expired
+            """
+            timeouts = self.__timeouts
+            if adaptive and timeouts is not None:
+                timeout = timeouts.timeout(command)
+            else:
+                timeout = GATEWAY_TIMEOUT_SECONDS
+
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise socket.timeout('Deadline expired')
+
+                timeout = min(timeout, remaining)
+
+            return timeout
+
+        def _measured(self, command, rtt):
+            """ record the round trip time of a command for the adaptive
+                timeouts
+
+            :param command: command id
+            :param rtt: round trip time in seconds
+            :return:
+            """
+            timeouts = self.__timeouts
+            if timeouts is not None:
+                timeouts.record(command, rtt)
+
+        def _timed_out(self, commands):
+            """ back off the adaptive timeouts of commands that were not
+                answered in time
+
+            :param commands: iterable of command ids
+            :return:
+            """
+            timeouts = self.__timeouts
+            if timeouts is not None:
+                for command in set(commands):
+                    timeouts.timed_out(command)
+
+        def enable_health_checks(self, probe_interval=PROBE_INTERVAL,
+                                 probe_timeout=PROBE_TIMEOUT,
+                                 backoff=RECONNECT_BACKOFF):
+            """ probe the connection while it is idle and reconnect in the
+                background when the gateway does not answer
+
+            :param probe_interval: idle time in seconds before a probe is sent
+            :param probe_timeout: time in seconds to wait for the response
+            :param backoff: (minimum, maximum) delay in seconds between two
+                reconnect attempts
+            :return: ConnectionManager object
+            """
+            self.disable_health_checks()
+            manager = self.connection_manager_class(self, probe_interval,
+                                                    probe_timeout, backoff)
+            with self.__lock:
+                self.__connection_manager = manager
+
+            return manager
+
+        def disable_health_checks(self):
+            """ stop the background health checks
+
+            :return:
+            """
+            with self.__lock:
+                manager = self.__connection_manager
+                self.__connection_manager = None
+
+            if manager is not None:
+                manager.stop()
+
+        def connection_manager(self):
+            """
+            :return: ConnectionManager object or None if the health checks
+                are disabled
+            """
+            return self.__connection_manager
+
+        def enable_pipelining(self, window=DEFAULT_PIPELINE_WINDOW):
+            """ keep up to 'window' commands in flight instead of waiting for
+                the response to each command before sending the next one
+
+            :param window: maximum number of commands in flight (1-255)
+            :return:
+            """
+            with self.__io_lock:
+                if self.__pipeline is None:
+                    if self.__sock is None:
+                        self._connect()
+
+                    # the reader thread expects the default socket timeout
+                    self.__sock.settimeout(GATEWAY_TIMEOUT_SECONDS)
+                    self.__pipeline = Pipeline(self.__sock, window,
+                                               logger=self.__logger)
+
+        def disable_pipelining(self):
+            """ go back to one command at a time
+
+            :return:
+            """
+            with self.__io_lock:
+                if self.__pipeline is not None:
+                    pipeline = self.__pipeline
+                    self.__pipeline = None
+                    pipeline.close()
+                    self._connect()
+
+        def pipeline(self):
+            """
+            :return: Pipeline object or None if pipelining is disabled
+            """
+            return self.__pipeline
+
+        def _healthy_pipeline(self, deadline=None):
+            """ reconnect if the pipeline broke down
+
+            :param deadline: optional time (time.time()) by which the
+                connection must be established
+            :return: Pipeline object or None if pipelining is disabled
+            """
+            pipeline = self.__pipeline
+            if pipeline is not None and pipeline.error() is not None:
+                with self.__io_lock:
+                    if self.__pipeline is pipeline:
+                        self.__logger.warning('Trying to reconnect')
+                        self._connect(deadline)
+                    pipeline = self.__pipeline
+
+            return pipeline
+
+        def _next_seq(self):
+            """
             :return: next sequence number
             """
+            with self.__seq_lock:
+                self.__seq = (self.__seq + 1) % 256
+                return self.__seq
+
+        def set_loglevel(self, log_level):
+            """ set the log level
+
+            :param log_level: logging.loglevel Enum
+            """
+            self.__logger.setLevel(log_level)
+            self.__logger.info('set log level to %s',
+                            logging.getLevelName(log_level))
+
+        def set_lights_updated(self):
+            """ update lights updated timestamp
+
+            :return:
+            """
+            self.__lights_updated = OUTDATED_TIMESTAMP
+            if self.__poller is not None:
+                self.__poller.hurry('lights')
+
+        def start_polling(self, lights_interval=POLL_LIGHTS_INTERVAL,
+                          scenes_interval=POLL_SCENES_INTERVAL,
+                          groups_interval=POLL_GROUPS_INTERVAL):
+            """ refresh lights, scenes and groups in a background thread
+                each resource is polled at its minimum interval after changes
+                or local commands and backs off to its maximum interval while
+                idle
+
+            :param lights_interval: (minimum, maximum) interval in seconds or
+                None to not poll the lights
+            :param scenes_interval: (minimum, maximum) interval in seconds or
+                None to not poll the scenes
+            :param groups_interval: (minimum, maximum) interval in seconds or
+                None to not poll the groups
+            :return: Poller object
+            """
+            intervals = {'lights': lights_interval,
+                         'scenes': scenes_interval,
+                         'groups': groups_interval}
+            schedules = dict((resource, PollSchedule(*interval))
+                             for resource, interval in intervals.items()
+                             if interval)
+            self.stop_polling()
+            if not schedules:
+                return None
+
+            poller = self.poller_class(self, schedules)
+            with self.__lock:
+                self.__poller = poller
+
+            return poller
+
+        def stop_polling(self):
+            """ stop the background polling thread
+
+            :return:
+            """
+            with self.__lock:
+                poller = self.__poller
+                self.__poller = None
+
+            if poller is not None:
+                poller.stop()
+
+        def poller(self):
+            """
+            :return: Poller object or None if not polling
+            """
+            return self.__poller
+
+        def set_lights_changed(self, addrs=None):
+            """ update lights changed timestamp and make the next update
+                decode the status of the changed lights again
+
+            :param addrs: list of mac addresses of the changed lights (all
+                lights if None)
+            :return:
+            """
+            if addrs is None:
+                self.__light_records = {}
+            else:
+                for addr in addrs:
+                    self.__light_records.pop(addr, None)
+
+            self.__lights_changed = time.time()
+            if self.__poller is not None:
+                self.__poller.hurry('lights')
+
+        def subscribe(self, callback, addrs=None, groups=None, types=None):
+            """ register a callback for state changes of lights, groups and
+                scenes caused by updates or local commands. the callback is
+                invoked from the thread causing the change and should not
+                block.
+
+            :param callback: callable invoked with each matching Event object
+            :param addrs: optional list of light mac addresses to filter by
+            :param groups: optional list of group indices to filter by
+            :param types: optional list of EventType objects to filter by
+            :return: Subscription object
+            """
+            subscription = Subscription(callback, addrs, groups, types)
+            with self.__lock:
+                self.__subscriptions = self.__subscriptions + [subscription]
+
+            return subscription
+
+        def unsubscribe(self, subscription):
+            """ unregister a callback
+
+            :param subscription: Subscription object returned by subscribe()
+            :return:
+            """
+            with self.__lock:
+                self.__subscriptions = [item for item in self.__subscriptions
+                                        if item is not subscription]
+
+        @contextlib.contextmanager
+        def _deferred_events(self):
+            """ hold back the events emitted by the current thread until the
+                outermost block is left, so the callbacks run without the
+                locks taken inside the block
+
+            :return:
+            """
+            local = self.__local
+            outermost = getattr(local, 'events', None) is None
+            if outermost:
+                local.events = []
+            try:
+                yield
+            finally:
+                if outermost:
+                    events = local.events
+                    local.events = None
+                    self._dispatch(events)
+
+        def _emit(self, events):
+            """ invoke the callbacks of the subscriptions matching the events,
+                after the current _deferred_events() block if there is one
+
+            :param events: list of Event objects
+            :return:
+            """
+            deferred = getattr(self.__local, 'events', None)
+            if deferred is not None:
+                deferred.extend(events)
+            else:
+                self._dispatch(events)
+
+        def _dispatch(self, events):
+            """ invoke the callbacks of the subscriptions matching the events
+
+            :param events: list of Event objects
+            :return:
+            """
+            for subscription in self.__subscriptions:
+                for event in events:
+                    if not subscription.matches(event):
+                        continue
+
+                    try:
+                        subscription.callback()(event)
+                    except Exception:  # pylint: disable=broad-except
+                        self.__logger.exception('Event callback failed')
+
+        def light_values(self, light):
+            """ get the values of a light before a local change
+
+            :param light: Light object
+            :return: list of values of LIGHT_FIELDS or None if nobody is
+                subscribed to events
+            """
+            if not self.__subscriptions:
+                return None
+
+            return [getattr(light, field)() for field in LIGHT_FIELDS]
+
+        @contextlib.contextmanager
+        def light_change(self, light):
+            """ change the values of a light locally. the new values, the
+                lookup indexes and the state version are updated under the
+                state lock, so state() never sees some of the values. events
+                for the changed fields are emitted afterwards.
+
+                with conn.light_change(light):
+                    <write the values to the light store>
+
+            :param light: Light object
+            :return:
+            """
+            with self.__lock:
+                old_values = self.light_values(light)
+                yield
+                self._mark_groups_changed(light.groups())
+                self._index_light(light)
+                self._state_changed(publish=False)
+
+            if old_values is None:
+                return
+
+            self._emit(self._light_events(light, [
+                field for field, value in zip(LIGHT_FIELDS, old_values)
+                if getattr(light, field)() != value]))
+
+        def _mark_groups_changed(self, group_indices):
+            """ drop the cached aggregates of groups
+
+            :param group_indices: list of group indices
+            :return:
+            """
+            for idx in group_indices:
+                group = self.__groups_byidx.get(idx)
+                if group is not None:
+                    group.mark_changed()
+
+        @staticmethod
+        def _light_events(light, fields):
+            """
+            :param light: Light object
+            :param fields: changed fields
+            :return: list of Event objects for the changed fields
+            """
+            return [Event(EventType(field), light, getattr(light, field)())
+                    for field in LIGHT_FIELDS
+                    if field in fields and field in EVENT_FIELDS]
+
+        def _emit_diff(self, diff):
+            """ emit events for a light status update
+
+            :param diff: LightsDiff object
+            :return:
+            """
+            events = [Event(EventType.ADDED, light)
+                      for light in diff.added().values()]
+            events.extend(Event(EventType.DELETED, light)
+                          for light in diff.removed().values())
+            for addr, fields in diff.changed().items():
+                events.extend(self._light_events(self.__lights[addr], fields))
+
+            self._emit(events)
+
+        def groups_updated(self):
+            """
+            :return: timestamp when the groups were updated last time
+            """
+            return self.__groups_updated
+
+        def scenes_updated(self):
+            """
+            :return: timestamp when the scenes were updated last time
+            """
+            return self.__scenes_updated
+
+        def lights_updated(self):
+            """
+            :return: timestamp when the lights were updated last time
+            """
+            return self.__lights_updated
+
+        def lights_changed(self):
+            """
+            :return: timestamp when the lights values were changed last time
+            """
+            return self.__lights_changed
+
+        def lights_diff(self):
+            """
+            :return: LightsDiff object describing what the last light status
+                update changed
+            """
+            return self.__lights_diff
+
+        def light_store(self):
+            """
+            :return: LightStore object holding the values of all lights
+            """
+            return self.__light_store
+
+        def groups(self):
+            """
+            :return: dict from group name to Group object
+            """
+            if not self.load_on_demand:
+                return self.__groups
+
+            if not (self.__lights_updated or self.__scenes_updated or
+                    self.__groups_updated):
+                self.refresh_all()
+
+            if not self.__lights_updated:
+                self.update_all_light_status()
+
+            if not self.__scenes_updated:
+                self.update_scene_list()
+
+            if not self.__groups_updated:
+                self.update_group_list()
+
+            return self.__groups
+
+        def state(self):
+            """ get an immutable snapshot of the lights, groups and scenes for
+                consistent reads of several values. it does not wait for
+                commands or refreshes in progress and is empty until the
+                models were loaded
+
+            :return: GatewayState object
+            """
+            state = self.__state
+            if state is not None and state.version() == self.__state_version:
+                return state
+
+            return self._publish_state()
+
+        def _state_changed(self, publish=True):
+            """ invalidate the published GatewayState object after an update
+
+            :param publish: whether to publish a new GatewayState object right
+                away if one was requested before
+            :return:
+            """
+            with self.__lock:
+                self.__state_version += 1
+
+            if publish and self.__state is not None:
+                self._publish_state()
+
+        def _publish_state(self):
+            """ build a new GatewayState object and publish it unless the
+                models changed in the meantime
+
+            :return: GatewayState object
+            """
+            with self.__lock:
+                version = self.__state_version
+                state = GatewayState(
+                    dict((addr, LightState.from_light(light))
+                         for addr, light in self.__lights.items()),
+                    dict((name, GroupState.from_group(group))
+                         for name, group in self.__groups.items()),
+                    dict((name, SceneState.from_scene(scene))
+                         for name, scene in self.__scenes.items()),
+                    {'lights': self.__lights_updated,
+                     'groups': self.__groups_updated,
+                     'scenes': self.__scenes_updated},
+                    version)
+                if version == self.__state_version:
+                    self.__state = state
+
+            return state
+
+        def device_types(self):
+            """
+            :return: dict with device types information
+            """
+            return self.__device_types
+
+        def device_profile(self, type_id, type_id_assumed=None):
+            """
+            :param type_id: original device type id as returned by gateway
+            :param type_id_assumed: assumed device type id (if type belongs to
+                an unknown device)
+            :return: shared DeviceProfile object of the device type
+            """
+            if type_id_assumed is None or type_id_assumed == type_id:
+                return self.__device_profiles[type_id]
+
+            profile = self.__unknown_profiles.get(type_id_assumed)
+            if profile is None:
+                profile = DeviceProfile(self.__device_types[type_id_assumed],
+                                        UNKNOWN_DEVICENAME)
+                self.__unknown_profiles[type_id_assumed] = profile
+
+            return profile
+
+        def scenes(self):
+            """
+            :return: dict from scene name to Scene object
+            """
+            if not self.__scenes_updated and self.load_on_demand:
+                self.update_scene_list()
+
+            return self.__scenes
+
+        def lights(self):
+            """
+            :return: dict from light mac address to Light object
+            """
+            if not self.__lights_updated and self.load_on_demand:
+                self.update_all_light_status()
+
+            return self.__lights
+
+        def light_byname(self, name):
+            """
+            :param name: name of the light
+            :return: Light object (the first one in lights() if several
+                lights have the same name) or None
+            """
+            lights = self.lights_byname(name)
+            return lights[0] if lights else None
+
+        def lights_byname(self, name):
+            """
+            :param name: name of the lights
+            :return: list of Light objects with the given name, in the order
+                of lights()
+            """
+            lights = self.lights()
+            with self.__lock:
+                addrs = tuple(self.__lights_byname.get(name, ()))
+            if len(addrs) > 1:
+                # the index is in the order the names were set
+                addrs = set(addrs)
+                return [light for addr, light in lights.items()
+                        if addr in addrs]
+
+            return [lights[addr] for addr in addrs if addr in lights]
+
+        def query_lights(self, devicetype=None, devicesubtype=None,
+                         feature=None, reachable=None, on=None, group=None,
+                         name=None):
+            """ find lights using the lookup indexes
+                all given criteria must match
+
+            :param devicetype: DeviceType object
+            :param devicesubtype: DeviceSubType object
+            :param feature: supported feature (on, lum, temp, rgb)
+            :param reachable: true/false to find (un)reachable lights
+            :param on: true/false to find lights switched on/off
+            :param group: group index
+            :param name: name of the lights
+            :return: LightsView object
+            """
+            lights = self.lights()
+            # the indexes change with local commands of other threads
+            with self.__lock:
+                included = []
+                excluded = []
+                for key in (devicetype, devicesubtype, feature):
+                    if key is not None:
+                        included.append(self.__lights_bytype.get(key,
+                                                                 frozenset()))
+
+                for wanted, addrs in ((reachable, self.__reachable_lights),
+                                      (on, self.__on_lights)):
+                    if wanted is not None:
+                        (included if wanted else excluded).append(addrs)
+
+                if group is not None:
+                    included.append(self._group_lights(group))
+
+                if name is not None:
+                    included.append(self.__lights_byname.get(name, ()))
+
+                included.sort(key=len)
+                result = set(included[0] if included else lights)
+                for addrs in included[1:]:
+                    result.intersection_update(addrs)
+
+                for addrs in excluded:
+                    result.difference_update(addrs)
+
+            return LightsView(lights, frozenset(addr for addr in result
+                                                if addr in lights))
+
+        def reconcile(self, desired, transition=0, execute=True):
+            """ bring the lights to the desired state with as few commands as
+                possible. values matching the cached state are skipped and a
+                value shared by all lights of a group (that support the
+                feature) is set with a single group command. if a light
+                should be switched off, its other values are ignored.
+
+            :param desired: dict from light mac address to dict with the
+                desired values: {'on': true/false, 'lum': <luminance>,
+                'temp': <colour temperature>, 'rgb': (red, green, blue)}, each
+                of them optional
+            :param transition: transition time in 1/10 seconds, 0 to disable
+            :param execute: whether to send the commands or only plan them
+            :return: list of (Light or Group object, feature, value) tuples
+                in the order the commands are sent
+            """
+            lights = self.lights()
+            targets = {}
+            changes = {}
+            for addr, state in desired.items():
+                light = lights.get(addr)
+                if light is None or light.deleted():
+                    continue
+
+                target = self._reconcile_target(light, state)
+                targets[addr] = target
+                changes[addr] = set(
+                    feature for feature, value in target.items()
+                    if self._reconcile_value(light, feature) != value)
+
+            plan = []
+            groups = sorted((group for group in self.groups().values()
+                             if not group.deleted()),
+                            key=lambda group: len(group.lights()),
+                            reverse=True)
+            for group in groups:
+                for feature, flag in FEATURES:
+                    members = [addr for addr in group.lights()
+                               if addr in lights and
+                               lights[addr].features() & flag]
+                    pending = [addr for addr in members
+                               if feature in changes.get(addr, ())]
+                    if len(pending) < 2:
+                        continue
+
+                    values = set(targets.get(addr, {}).get(feature)
+                                 for addr in members)
+                    if len(values) != 1 or None in values:
+                        continue
+
+                    plan.append((group, feature, values.pop()))
+                    for addr in pending:
+                        changes[addr].discard(feature)
+
+            for addr, target in targets.items():
+                for feature, _ in FEATURES:
+                    if feature in changes[addr]:
+                        plan.append((lights[addr], feature, target[feature]))
+
+            if execute:
+                with self.batch():
+                    for item, feature, value in plan:
+                        if feature == 'on':
+                            item.set_onoff(value)
+                        elif feature == 'lum':
+                            item.set_luminance(value, transition)
+                        elif feature == 'temp':
+                            item.set_temperature(value, transition)
+                        else:
+                            item.set_rgb(value[0], value[1], value[2],
+                                         transition)
+
+            return plan
+
+        @staticmethod
+        def _reconcile_target(light, state):
+            """
+            :param light: Light object
+            :param state: dict with the desired values (see reconcile())
+            :return: dict from feature to the desired value as the light would
+                store it, unsupported features left out
+            """
+            features = light.features()
+            target = {}
+            if state.get('on') is not None and features & FEATURE_ON:
+                target['on'] = bool(state['on'])
+
+            if state.get('on') is False:
+                return target
+
+            if state.get('lum') is not None and features & FEATURE_LUM:
+                lum = min(int(state['lum']), MAX_LUMINANCE)
+                if lum > 0:
+                    target['lum'] = lum
+                elif features & FEATURE_ON:
+                    # a luminance of 0 switches the light off
+                    target['on'] = False
+                    return target
+
+            if state.get('temp') is not None and features & FEATURE_TEMP:
+                temp = max(light.min_temp(), int(state['temp']))
+                target['temp'] = min(temp, light.max_temp())
+
+            if state.get('rgb') is not None and features & FEATURE_RGB:
+                target['rgb'] = tuple(min(int(value), MAX_COLOUR)
+                                      for value in state['rgb'])
+
+            return target
+
+        @staticmethod
+        def _reconcile_value(light, feature):
+            """
+            :param light: Light object
+            :param feature: on, lum, temp or rgb
+            :return: cached value of the light
+            """
+            if feature == 'on':
+                return light.on()
+
+            if feature == 'lum':
+                return light.lum()
+
+            if feature == 'temp':
+                return light.temp()
+
+            return light.rgb()
+
+        def _index_light(self, light):
+            """ add a light to the lookup indexes or update its entries
+
+            :param light: Light object
+            :return:
+            """
+            addr = light.addr()
+            name = light.name()
+            if addr not in self.__light_names:
+                for key in ((light.devicetype(), light.devicesubtype()) +
+                            tuple(light.supported_features())):
+                    self.__lights_bytype.setdefault(key, set()).add(addr)
+
+            old_name = self.__light_names.get(addr)
+            if old_name != name:
+                self._unindex_name(addr, old_name)
+                self.__lights_byname.setdefault(name, []).append(addr)
+                self.__light_names[addr] = name
+
+            for wanted, addrs in ((light.reachable(), self.__reachable_lights),
+                                  (light.on(), self.__on_lights)):
+                if wanted:
+                    addrs.add(addr)
+                else:
+                    addrs.discard(addr)
+
+        def _unindex_name(self, addr, name):
+            """ remove a light from the name index
+
+            :param addr: light mac address
+            :param name: indexed name of the light
+            :return:
+            """
+            addrs = self.__lights_byname.get(name)
+            if addrs and addr in addrs:
+                addrs.remove(addr)
+                if not addrs:
+                    del self.__lights_byname[name]
+
+        def _unindex_light(self, light):
+            """ remove a light from the lookup indexes
+
+            :param light: Light object
+            :return:
+            """
+            addr = light.addr()
+            self._unindex_name(addr, self.__light_names.pop(addr, None))
+            for addrs in self.__lights_bytype.values():
+                addrs.discard(addr)
+
+            self.__reachable_lights.discard(addr)
+            self.__on_lights.discard(addr)
+
+        def build_global_command(self, command, data):
+            """ build a global command
+
+            :param command: command id (1 byte)
+            :param data: additional binary data
+            :return: binary data to be sent to the gateway
+            """
+            return self.build_basic_command(
+                FLAG_GLOBAL,
+                command,
+                b'',
+                data
+            )
+
+        def build_basic_command(self, flag, command, addr, data):
+            """ build a basic command
+
+            :param flag: packet type (1 byte)
+            :param command: command id (1 byte)
+            :param addr: binary device mac address (8 bytes) or empty string
+            :param data: additional binary data
+            :return: binary data to be sent to the gateway
+            """
+            if isinstance(addr, str):
+                # keep compatibiity with Python 2.7
+                try:
+                    addr = addr.encode('cp437')
+                except UnicodeDecodeError:
+                    pass
+
+            if isinstance(data, str):
+                # keep compatibiity with Python 2.7
+                try:
+                    data = data.encode('cp437')
+                except UnicodeDecodeError:
+                    pass
+
+            return self.__encoder.encode(flag, command, addr, data,
+                                         self._next_seq())
+
+        def build_command(self, command, idx, data):
+            """ build a group or scene command
+
+            :param command: command id (1 byte)
+            :param idx: device index
+            :param data: additional binary data
+            :return: binary data to be sent to the gateway
+            """
+            # for backward compatibiity
+            if isinstance(idx, Group):
+                idx = idx.idx()
+
+            if isinstance(data, str):
+                return self.build_basic_command(FLAG_GLOBAL, command,
+                                                GROUP_ADDR.pack(idx), data)
+
+            return self.__encoder.group(command, idx, data, self._next_seq())
+
+        def build_light_command(self, command, addr, data):
+            """ build a light command
+
+            :param command: command id (1 byte)
+            :param addr: light mac address
+            :param data: additional binary data
+            :return: binary data to be sent to the gateway
+            """
+            # for backward compatibiity
+            if isinstance(addr, Light):
+                addr = addr.addr()
+
+            if isinstance(data, str):
+                return self.build_basic_command(FLAG_LIGHT, command,
+                                                LIGHT_ADDR.pack(addr), data)
+
+            return self.__encoder.light(command, addr, data, self._next_seq())
+
+        @staticmethod
+        def build_onoff(item, onoff):
+            """
+            :param item: Light or Group object
+            :param onoff: true/false
+            :return: binary command to set on/off for the light/group
+            """
+            return item.build_command(
+                COMMAND_ONOFF,
+                PAYLOAD_ONOFF.pack(onoff)
+            )
+
+        @staticmethod
+        def build_temp(item, temp, transition):
+            """
+            :param item: Light or Group object
+            :param temp: colour temperature in kelvin
+            :param transition: transition time in 1/10 seconds, 0 to disable
+            :return: binary command to set the light/group colour temperature
+            """
+            return item.build_command(
+                COMMAND_TEMP,
+                PAYLOAD_TEMP.pack(temp, transition)
+            )
+
+        @staticmethod
+        def build_luminance(item, lum, transition):
+            """
+            :param item: Light or Group object
+            :param lum: luminance (brightness)
+            :param transition: transition time in 1/10 seconds, 0 to disable
+            :return: binary command to set the light/group luminance (brightness)
+            """
+            return item.build_command(
+                COMMAND_LUMINANCE,
+                PAYLOAD_LUMINANCE.pack(lum, transition)
+            )
+
+        @staticmethod
+        def build_colour(item, red, green, blue, transition):
+            """
+            :param item: Light or Group object
+            :param red: amount of red
+            :param green: amount of green
+            :param blue: amount of blue
+            :param transition: transition time in 1/10 seconds, 0 to disable
+            :return: binary command to set the light/group RGB colour
+            """
+            return item.build_command(
+                COMMAND_COLOUR,
+                PAYLOAD_COLOUR.pack(red, green, blue, DEFAULT_ALPHA,
+                                    transition)
+            )
+
+        def build_all_light_status(self, flag=0x01):
+            """
+            :param flag: additional flag (0x01 to return all available data)
+            :return: binary command to get the status of all lights
+            """
+            return self.build_global_command(
+                COMMAND_ALL_LIGHT_STATUS,
+                struct.pack('<B', flag)
+            )
+
+        @staticmethod
+        def build_light_status(light):
+            """
+            :param light: Light object
+            :return: binary command to get the status of the given light
+                (only subset of values returned by build_all_light_status)
+            """
+            return light.build_command(
+                COMMAND_LIGHT_STATUS,
+                b''
+            )
+
+        def build_probe(self):
+            """
+            :return: binary command with a short response for probing the
+                connection: the status of a known light or the group list if
+                no light is known yet
+            """
             with self.__lock:
-                self.__seq = (self.__seq + 1) % 256
-                return self.__seq
+                light = next(iter(self.__lights.values()), None)
+
+            if light is None:
+                return self.build_group_list()
+
+            return self.build_light_status(light)
+
+        def build_group_list(self):
+            """
+            :return: binary command to get the list of groups
+            """
+            return self.build_global_command(
+                COMMAND_GROUP_LIST,
+                b''
+            )
+
+        def build_scene_list(self):
+            """
+            :return: binary command to get the list of scenes
+            """
+            return self.build_global_command(
+                COMMAND_SCENE_LIST,
+                b''
+            )
+
+        def group_list(self):
+            """ get the dict of group indices and names
+                deprecated, for backward compatibility only!
+
+            :return: dict of groups (key is group index and value is group name)
+            """
+            self.update_group_list()
+            groups = {}
+            for name in self.__groups:
+                groups[self.__groups[name].idx()] = name
+
+            return groups
+
+        def update_group_list(self, throttling_interval=None, deadline=None):
+            """ update all groups
+
+            :param throttling_interval: optional throttling interval (skip call to
+                gateway if last call finished less than throttling interval seconds
+                ago)
+            :param deadline: optional time (time.time()) by which the gateway
+                must have answered
+            :return: dict from group name to Group object of newly
+                    discovered groups
+            """
+            if (throttling_interval and
+                    time.time() < self.__groups_updated + throttling_interval):
+                return {}
+
+            with self._deferred_events(), self._locked():
+                if (throttling_interval and
+                        time.time() < self.__groups_updated + throttling_interval):
+                    return {}
+
+                command = self.build_group_list()
+                data = self._send_packet(command, deadline=deadline)
+                return self._parse('groups', self._apply_group_list, data)
+
+        def _apply_group_list(self, data):
+            """ update all groups from a received group list packet
+
+            :param data: received packet
+            :return: dict from group name to Group object of newly
+                    discovered groups
+            """
+            with self.__lock:
+                try:
+                    (num,) = struct.unpack('<H', data[7:9])
+                    self.__logger.debug('Number of groups: %d', num)
+                    if len(data) < 8 + num * 18:
+                        raise struct.error('Incorrect data length for {} records:'
+                                        ' {}'.format(num, len(data)))
+
+                    new_groups = {}
+                    for i in range(0, num):
+                        pos = 9 + i * 18
+                        payload = data[pos:pos + 18]
+                        self.__logger.debug('Group payload: %d', i)
+
+                        (idx, name) = struct.unpack('<H16s', payload)
+                        name = name.decode('utf-8').replace('\0', '')
+
+                        if (name in self.__groups and
+                                self.__groups[name].idx() == idx):
+                            group = self.__groups[name]
+                            self.__logger.debug('Old group %d: %s', idx, name)
+                        else:
+                            group = Group(self, idx, name)
+                            self.__logger.debug('New group %d: %s', idx, name)
+
+                        new_groups[name] = group
+
+                except (struct.error, UnicodeDecodeError) as err:
+                    self.__logger.error('Couldn\'t parse group status: %s', err)
+                    self.__logger.error('Data: %s', binascii.hexlify(data))
+                    return {}
+
+                events = []
+                for name in list(self.__groups):
+                    if (name not in new_groups or
+                            self.__groups[name].idx() != new_groups[name].idx()):
+                        self.__groups[name].mark_deleted()
+                        events.append(Event(EventType.DELETED,
+                                            self.__groups.pop(name)))
+                    else:
+                        del new_groups[name]
+
+                for name in new_groups:
+                    self.__groups[name] = new_groups[name]
+                    events.append(Event(EventType.ADDED, new_groups[name]))
+
+                self.__groups_byidx = dict((group.idx(), group)
+                                           for group in self.__groups.values())
+
+                self.update_group_lights()
+                self.update_group_scenes()
+                self.__groups_updated = time.time()
+                if self.__subscriptions:
+                    self._emit(events)
+
+                return new_groups
+
+        @staticmethod
+        def _decode_groups(groups):
+            """
+            :param groups: group bitmask as returned by gateway
+            :return: list of group indices, highest first
+            """
+            return [bit + 1 for bit in range(15, -1, -1) if groups >> bit & 1]
+
+        def _lights_sorted_byidx(self):
+            """ get the lights sorted by light idx
+                needed to keep lists of group lights backward compatible with
+                the previous version of the library in order not to break existing
+                integrations
+
+            :return: list of light mac addresses sorted by light idx
+            """
+            return [i[0] for i in sorted(
+                [(light.addr(), light.idx())
+                for light in self.__lights.values()], key=lambda i: i[1])]
+
+        def _group_lights(self, idx):
+            """
+            :param idx: group index
+            :return: list of the group's light mac addresses sorted by light idx
+            """
+            members = self.__group_members.get(idx, 0)
+            lights = []
+            while members:
+                lowest = members & -members
+                lights.append(self.__lights_byidx[lowest.bit_length() - 1])
+                members ^= lowest
+
+            return lights
+
+        def _update_group_index(self, slots, lights_byidx):
+            """ update the group membership index with new light positions
+                and group bitmasks
+
+            :param slots: dict from light mac address to (idx, group bitmask)
+                of all current lights
+            :param lights_byidx: list of light mac addresses by light idx
+            :return: set of indices of the groups whose lights changed
+            """
+            old_slots = self.__light_slots
+            changed = [(old_slots.get(addr), slot)
+                       for addr, slot in slots.items()
+                       if old_slots.get(addr) != slot]
+            changed.extend((slot, None) for addr, slot in old_slots.items()
+                           if addr not in slots)
+
+            # clear all old bits before setting the new ones, a light idx may
+            # be taken over by another light
+            members = self.__group_members
+            groups = set()
+            for old_slot, _ in changed:
+                if old_slot is not None:
+                    for group_idx in self._decode_groups(old_slot[1]):
+                        members[group_idx] &= ~(1 << old_slot[0])
+                        groups.add(group_idx)
+
+            for _, slot in changed:
+                if slot is not None:
+                    for group_idx in self._decode_groups(slot[1]):
+                        members[group_idx] = (members.get(group_idx, 0) |
+                                              1 << slot[0])
+                        groups.add(group_idx)
+
+            self.__light_slots = slots
+            self.__lights_byidx = lights_byidx
+            return groups
+
+        def update_group_lights(self, group_indices=None):
+            """ update the list of group's light mac addresses
+
+            :param group_indices: optional set of group indices to update (all
+                groups if None)
+            :return:
+            """
+            for group in self.__groups.values():
+                if group_indices is None or group.idx() in group_indices:
+                    group.set_lights(self._group_lights(group.idx()))
+                    group.update_status()
+
+        def update_group_scenes(self):
+            """ update the list of group's scenes for all groups
+
+            :return:
+            """
+            for group in self.__groups.values():
+                group.set_scenes(self.__group_scenes.get(group.idx(), []))
+
+        def group_info(self, group):
+            """ get the list of group's light mac addresses
+                deprecated, for backward compatibility only!
+
+            :param group: Group object
+            :return: list of group's light mac addresses
+            """
+            self.update_all_light_status()
+            return group.lights()
+
+        def update_scene_list(self, throttling_interval=None, deadline=None):
+            """ update all scenes
+
+            :param throttling_interval: optional throttling interval (skip call to
+                gateway if last call finished less than throttling interval seconds
+                ago)
+            :param deadline: optional time (time.time()) by which the gateway
+                must have answered
+            :return: dict from scene name to Scene object of newly
+                    discovered scenes
+            """
+            if (throttling_interval and
+                    time.time() < self.__scenes_updated + throttling_interval):
+                return {}
+
+            with self._deferred_events(), self._locked():
+                if (throttling_interval and
+                        time.time() < self.__scenes_updated + throttling_interval):
+                    return {}
+
+                command = self.build_scene_list()
+                data = self._send_packet(command, deadline=deadline)
+                return self._parse('scenes', self._apply_scene_list, data)
+
+        def _apply_scene_list(self, data):
+            """ update all scenes from a received scene list packet
+
+            :param data: received packet
+            :return: dict from scene name to Scene object of newly
+                    discovered scenes
+            """
+            with self.__lock:
+                try:
+                    (num,) = struct.unpack('<H', data[7:9])
+                    self.__logger.debug('Number of scenes: %d', num)
+                    if len(data) < 8 + num * 20:
+                        raise struct.error('Incorrect data length for {} records:'
+                                        ' {}'.format(num, len(data)))
+
+                    new_scenes = {}
+                    for i in range(0, num):
+                        pos = 9 + i * 20
+                        payload = data[pos:pos + 20]
+                        self.__logger.debug('Scene payload: %d', i)
+
+                        (idx, name, group) = struct.unpack('<Bx16sH', payload)
+                        name = name.decode('utf-8').replace('\0', '')
+                        group = 16 - format(group, '016b').index('1')
+
+                        if (name in self.__scenes and
+                                self.__scenes[name].idx() == idx and
+                                self.__scenes[name].group() == group):
+                            scene = self.__scenes[name]
+                            self.__logger.debug('Old scene %d: %s, group: %d', idx,
+                                                name, group)
+                        else:
+                            scene = Scene(self, idx, name, group)
+                            self.__logger.debug('New scene %d: %s, group: %d', idx,
+                                                name, group)
+
+                        new_scenes[name] = scene
+
+                except (struct.error, UnicodeDecodeError, ValueError) as err:
+                    self.__logger.error('Couldn\'t parse scene status: %s', err)
+                    self.__logger.error('Data: %s', binascii.hexlify(data))
+                    return {}
+
+                events = []
+                for name in list(self.__scenes):
+                    if (name not in new_scenes or
+                            self.__scenes[name].idx() != new_scenes[name].idx() or
+                            self.__scenes[name].group() !=
+                            new_scenes[name].group()):
+                        self.__scenes[name].mark_deleted()
+                        events.append(Event(EventType.DELETED,
+                                            self.__scenes.pop(name)))
+                    else:
+                        del new_scenes[name]
+
+                for name in new_scenes:
+                    self.__scenes[name] = new_scenes[name]
+                    events.append(Event(EventType.ADDED, new_scenes[name]))
+
+                self.__group_scenes = {}
+                for name, scene in self.__scenes.items():
+                    self.__group_scenes.setdefault(scene.group(), []).append(name)
+
+                self.update_group_scenes()
+                self.__scenes_updated = time.time()
+                if self.__subscriptions:
+                    self._emit(events)
+
+                return new_scenes
+
+        def submit(self, data, callback=None):
+            """ send the packet 'data' to the gateway without waiting for the
+                response if pipelining is enabled
+
+            :param data: binary command to send
+            :param callback: optional callable invoked with the future when the
+                command is done
+            :return: concurrent.futures.Future resolving to the received packet
+            """
+            future = futures.Future()
+            try:
+                pipeline = self._healthy_pipeline()
+                if pipeline is not None:
+                    done = self._observe(data)
+                    future = pipeline.submit(data, callback)
+                    if done is not None:
+                        future.add_done_callback(self._future_observed(done))
+                    return future
+
+                future.set_result(self.send_many([data])[0])
+            except socket.error as err:
+                future.set_exception(err)
+
+            if callback:
+                future.add_done_callback(callback)
+
+            return future
+
+        def send(self, data, reconnect=True, deadline=None):
+            """ send the packet 'data' to the gateway and return the received packet
+
+            :param data: binary command to send
+            :param reconnect: if true, will try to reconnect once. if false,
+                            will raise a socket.error.
+            :param deadline: optional time (time.time()) by which the command
+                must be answered, socket.timeout is raised when it expires
+            :return: received packet. for light, group and scene commands an
+                Ack object in fire-and-forget mode, None if a batch collected
+                the command or the debouncer held it back
+            """
+            try:
+                received = self._send_packet(data, reconnect, deadline)
+            except socket.error:
+                self._unconfirm([data])
+                raise
+
+            if isinstance(received, memoryview):
+                return received.tobytes()
+
+            return received
+
+        def _send_packet(self, data, reconnect=True, deadline=None):
+            """ send the packet 'data' to the gateway and return the received
+                packet without copying it
+
+            :param data: binary command to send
+            :param reconnect: if true, will try to reconnect once. if false,
+                            will raise a socket.error.
+            :param deadline: optional time (time.time()) by which the command
+                must be answered
+            :return: received packet, bytes with pipelining. otherwise a
+                memoryview that is only valid until the next command is sent,
+                i.e. while the caller holds the I/O lock
+            """
+            batch = getattr(self.__local, 'batch', None)
+            if batch is not None:
+                (command,) = struct.unpack_from('<B', data, COMMAND_OFFSET)
+                if command in BATCH_COMMANDS:
+                    batch.add(data)
+                    return None
+
+            debouncer = self.__debouncer
+            if debouncer is not None:
+                (command,) = struct.unpack_from('<B', data, COMMAND_OFFSET)
+                if command in DEBOUNCE_COMMANDS:
+                    return debouncer.send(data, deadline)
+
+            self.__last_activity = time.time()
+            if self.__ack_stats is not None:
+                (command,) = struct.unpack_from('<B', data, COMMAND_OFFSET)
+                if command in BATCH_COMMANDS:
+                    return self._send_unacknowledged(data)
+
+            if self.__pipeline is not None:
+                return self._send_pipelined(data, reconnect, deadline)
+
+            (command,) = struct.unpack_from('<B', data, COMMAND_OFFSET)
+            with self._locked():
+                # the retry waits for the timeout backed off after a timeout
+                timeout = self.command_timeout(command, deadline)
+                done = None
+                try:
+                    if self.__sock is None:
+                        self._connect(deadline)
+
+                    if self.__sock.gettimeout() != timeout:
+                        self.__sock.settimeout(timeout)
+                    if self.__logger.isEnabledFor(logging.DEBUG):
+                        self.__logger.debug('Sending "%s"',
+                                            binascii.hexlify(data))
+                    done = self._observe(data)
+                    start = time.time()
+                    self.__sock.sendall(data)
+                    total_received_data = self.__frames.read(start + timeout)
+                    if done is not None:
+                        done(total_received_data)
+                    if self.__logger.isEnabledFor(logging.DEBUG):
+                        self.__logger.debug(
+                            'Received "%s"',
+                            binascii.hexlify(total_received_data))
+                except socket.error as err:
+                    if done is not None:
+                        done(error=err)
+                    self._send_failed(err)
+                    if isinstance(err, socket.timeout):
+                        self._timed_out([command])
+                    if reconnect and (deadline is None or
+                                      time.time() < deadline):
+                        self.__logger.warning('Trying to reconnect')
+                        self._reconnect(deadline)
+                        return self._send_packet(data, False, deadline)
 
-        def set_loglevel(self, log_level):
-            """ set the log level
+                    if isinstance(err, socket.timeout):
+                        # a late response would be taken for the next
+                        # command's
+                        self._disconnect()
+                    raise err
 
-            :param log_level: logging.loglevel Enum
-            """
-            self.__logger.setLevel(log_level)
-            self.__logger.info('set log level to %s',
-                            logging.getLevelName(log_level))
+                return total_received_data
 
-        def set_lights_updated(self):
-            """ update lights updated timestamp
+        def _reconnect(self, deadline=None):
+            """ replace the connection after an error. if that fails, the
+                broken connection is dropped and the next command reconnects
 
+            :param deadline: optional time (time.time()) by which the
+                connection must be established
             :return:
             """
-            self.__lights_updated = OUTDATED_TIMESTAMP
+            try:
+                self._connect(deadline)
+            except socket.error:
+                self._disconnect()
+                raise
 
-        def set_lights_changed(self):
-            """ update lights hash and changed timestamp
+        def disconnect(self):
+            """ close the connection to the gateway (and the pipeline's), the
+                next command reconnects
 
             :return:
             """
-            self.__lights_hash = ''
-            self.__lights_changed = time.time()
+            with self.__io_lock:
+                if self.__pipeline is not None:
+                    self.__pipeline.close()
+                self._disconnect()
 
-        def groups_updated(self):
-            """
-            :return: timestamp when the groups were updated last time
-            """
-            return self.__groups_updated
+        def close(self):
+            """ stop the background polling, health checks and debouncing
+                and close the connection to the gateway. the held back
+                commands are sent first.
 
-        def scenes_updated(self):
-            """
-            :return: timestamp when the scenes were updated last time
+            :return:
             """
-            return self.__scenes_updated
+            self.stop_polling()
+            self.disable_health_checks()
+            try:
+                self.disable_debouncing()
+            except socket.error as err:
+                self.__logger.warning('Sending the held back commands '
+                                      'failed: %s', err)
 
-        def lights_updated(self):
-            """
-            :return: timestamp when the lights were updated last time
-            """
-            return self.__lights_updated
+            self.disconnect()
 
-        def lights_changed(self):
-            """
-            :return: timestamp when the lights values were changed last time
-            """
-            return self.__lights_changed
+        def _send_failed(self, err):
+            """ log a failed command and let the health checks probe the
+                connection, after the outermost _locked() block if there is
+                one. a probe finding the connection lock taken would consider
+                the connection healthy.
 
-        def groups(self):
-            """
-            :return: dict from group name to Group object
+            :param err: exception the command failed with
+            :return:
             """
-            if not self.__lights_updated:
-                self.update_all_light_status()
-
-            if not self.__scenes_updated:
-                self.update_scene_list()
+            self.__logger.warning('Lost connection to lightify gateway:')
+            self.__logger.warning('socketError: %s', err)
+            if getattr(self.__local, 'locked', False):
+                self.__local.check = True
+                return
 
-            if not self.__groups_updated:
-                self.update_group_list()
+            manager = self.__connection_manager
+            if manager is not None:
+                manager.check()
 
-            return self.__groups
+        def _disconnect(self):
+            """ drop the connection, the next command reconnects
 
-        def device_types(self):
+            :return:
             """
-            :return: dict with device types information
+            with self.__io_lock:
+                sock = self.__sock
+                self.__sock = None
+                if sock is not None and self.__pipeline is None:
+                    sock.close()
+
+        def send_many(self, packets, reconnect=True, deadline=None):
+            """ send several packets to the gateway with a single write and
+                wait for all received packets
+
+            :param packets: list of binary commands to send
+            :param reconnect: if true, will try to reconnect once. if false,
+                            will raise a socket.error.
+            :param deadline: optional time (time.time()) by which the commands
+                must be answered, socket.timeout is raised when it expires
+            :return: list of received packets, in the order of 'packets'
             """
-            return self.__device_types
+            if not packets:
+                return []
+
+            self.__last_activity = time.time()
+            commands = [struct.unpack_from('<B', data, COMMAND_OFFSET)[0]
+                        for data in packets]
+            timeout = max(self.command_timeout(command, deadline)
+                          for command in set(commands))
+            pipeline = None
+            try:
+                pipeline = self._healthy_pipeline(deadline)
+                if pipeline is not None:
+                    dones = [self._observe(data) for data in packets]
+                    start = time.time()
+                    result = pipeline.submit_many(packets, timeout=timeout)
+                    for done, future in zip(dones, result):
+                        if done is not None:
+                            future.add_done_callback(
+                                self._future_observed(done))
+
+                    pending = futures.wait(
+                        result, max(start + timeout - time.time(), 0))[1]
+                    if pending:
+                        # the retry may reuse the sequence numbers
+                        pipeline.discard(pending)
+                    return [future.result() for future in result]
+            except socket.error as err:
+                self._send_failed(err)
+                if isinstance(err, socket.timeout):
+                    self._timed_out(commands)
+                if reconnect and (deadline is None or
+                                  time.time() < deadline):
+                    return self.send_many(packets, False, deadline)
+
+                self._unconfirm(packets)
+                raise err
+
+            result = []
+            with self._locked():
+                try:
+                    if self.__sock is None:
+                        self._connect(deadline)
+
+                    if self.__sock.gettimeout() != timeout:
+                        self.__sock.settimeout(timeout)
+                    for chunk in self._chunks(packets):
+                        data = b''.join(chunk)
+                        if self.__logger.isEnabledFor(logging.DEBUG):
+                            self.__logger.debug('Sending "%s"',
+                                                binascii.hexlify(data))
+                        dones = dict(
+                            (struct.unpack_from('<B', packet, SEQ_OFFSET)[0],
+                             self._observe(packet)) for packet in chunk)
+                        end = time.time() + timeout
+                        if deadline is not None:
+                            end = min(end, deadline)
+                        received = {}
+                        error = socket.error('No response received')
+                        try:
+                            self.__sock.sendall(data)
+                            for _ in chunk:
+                                packet = self.__frames.read(end).tobytes()
+                                (seq,) = struct.unpack_from(
+                                    '<B', packet, RESPONSE_SEQ_OFFSET)
+                                received[seq] = packet
+                                done = dones.pop(seq, None)
+                                if done is not None:
+                                    done(packet)
+                        except socket.error as err:
+                            error = err
+                            raise err
+                        finally:
+                            for done in dones.values():
+                                if done is not None:
+                                    done(error=error)
+
+                        result.extend(
+                            received.get(struct.unpack_from(
+                                '<B', data, SEQ_OFFSET)[0])
+                            for data in chunk)
+                except socket.error as err:
+                    self._send_failed(err)
+                    if isinstance(err, socket.timeout):
+                        self._timed_out(commands)
+                    if reconnect and (deadline is None or
+                                      time.time() < deadline):
+                        self.__logger.warning('Trying to reconnect')
+                        self._reconnect(deadline)
+                        return self.send_many(packets, False, deadline)
+
+                    if isinstance(err, socket.timeout):
+                        # late responses would be taken for the next
+                        # commands'
+                        self._disconnect()
+                    self._unconfirm(packets)
+                    raise err
 
-        def scenes(self):
+            return result
+
+        @staticmethod
+        def _chunks(packets, size=MAX_PIPELINE_WINDOW):
+            """ split packets into chunks with unique sequence numbers, so
+                the received packets can be matched by sequence number
+
+            :param packets: list of binary commands
+            :param size: maximum number of packets per chunk
+            :return: iterator over lists of binary commands
             """
-            :return: dict from scene name to Scene object
+            chunk = []
+            seqs = set()
+            for data in packets:
+                (seq,) = struct.unpack_from('<B', data, SEQ_OFFSET)
+                if len(chunk) >= size or seq in seqs:
+                    yield chunk
+                    chunk = []
+                    seqs.clear()
+
+                chunk.append(data)
+                seqs.add(seq)
+
+            if chunk:
+                yield chunk
+
+        def enable_debouncing(self, interval=DEBOUNCE_INTERVAL):
+            """ rate limit the light and group commands per target and
+                command id, e.g. for commands driven by a slider. held back
+                commands are replaced by newer ones, the local state is
+                updated immediately.
+
+            :param interval: minimum time in seconds between two commands to
+                the same target
+            :return: Debouncer object
             """
-            if not self.__scenes_updated:
-                self.update_scene_list()
+            with self.__lock:
+                if self.__debouncer is None:
+                    self.__debouncer = Debouncer(self, interval)
+                elif self.__debouncer.interval() != interval:
+                    self.__debouncer.set_interval(interval)
 
-            return self.__scenes
+                return self.__debouncer
 
-        def lights(self):
-            """
-            :return: dict from light mac address to Light object
+        def disable_debouncing(self, flush=True):
+            """ go back to sending every command immediately
+
+            :param flush: whether to send the held back commands
+            :return:
             """
-            if not self.__lights_updated:
-                self.update_all_light_status()
+            with self.__lock:
+                debouncer = self.__debouncer
+                self.__debouncer = None
 
-            return self.__lights
+            if debouncer is not None:
+                debouncer.stop(flush)
 
-        def light_byname(self, name):
+        def debouncer(self):
             """
-            :param name: name of the light
-            :return: Light object
+            :return: Debouncer object or None if debouncing is disabled
             """
-            if not self.__lights_updated:
-                self.update_all_light_status()
-
-            for light in self.__lights.values():
-                if light.name() == name:
-                    return light
+            return self.__debouncer
 
-            return None
+        def set_instrumentation(self, hook):
+            """ install instrumentation hooks
 
-        def build_global_command(self, command, data):
-            """ build a global command
+            :param hook: Instrumentation object or None to disable
+            :return:
+            """
+            self.__hook = hook
 
-            :param command: command id (1 byte)
-            :param data: additional binary data
-            :return: binary data to be sent to the gateway
+        def instrumentation(self):
             """
-            return self.build_basic_command(
-                FLAG_GLOBAL,
-                command,
-                '',
-                data
-            )
+            :return: Instrumentation object or None
+            """
+            return self.__hook
 
-        def build_basic_command(self, flag, command, addr, data):
-            """ build a basic command
+        def enable_metrics(self, buckets=LATENCY_BUCKETS):
+            """ record metrics of the connection, see Metrics
 
-            :param flag: packet type (1 byte)
-            :param command: command id (1 byte)
-            :param addr: binary device mac address (8 bytes) or empty string
-            :param data: additional binary data
-            :return: binary data to be sent to the gateway
+            :param buckets: upper bounds in seconds of the latency histogram
+                buckets
+            :return: Metrics object
             """
-            length = 6 + len(addr) + len(data)
-            if isinstance(addr, str):
-                # keep compatibiity with Python 2.7
-                try:
-                    addr = addr.encode('cp437')
-                except UnicodeDecodeError:
-                    pass
+            if not isinstance(self.__hook, Metrics):
+                self.__hook = Metrics(self.__host, buckets)
 
-            if isinstance(data, str):
-                # keep compatibiity with Python 2.7
-                try:
-                    data = data.encode('cp437')
-                except UnicodeDecodeError:
-                    pass
+            return self.__hook
 
-            result = struct.pack(
-                '<H6B',
-                length,
-                flag,
-                command,
-                0,
-                0,
-                0x07,
-                self._next_seq()
-            ) + addr + data
+        @contextlib.contextmanager
+        def _locked(self):
+            """ acquire the connection lock. the health checks requested by
+                failed commands probe the connection when the outermost
+                block is left
 
-            return result
+            :return:
+            """
+            local = self.__local
+            outermost = not getattr(local, 'locked', False)
+            lock = self.__io_lock
+            if self.__hook is not None:
+                lock = TimedLock(lock, self.__hook)
+            try:
+                with lock:
+                    local.locked = True
+                    try:
+                        yield
+                    finally:
+                        if outermost:
+                            local.locked = False
+            finally:
+                if outermost and getattr(local, 'check', False):
+                    local.check = False
+                    manager = self.__connection_manager
+                    if manager is not None:
+                        manager.check()
+
+        def _track(self, data):
+            """ report a command to the instrumentation hooks
+
+            :param data: binary command
+            :return: tracking state for _tracked() or None if there are no
+                hooks
+            """
+            hook = self.__hook
+            if hook is None:
+                return None
 
-        def build_command(self, command, idx, data):
-            """ build a group or scene command
+            (command,) = struct.unpack_from('<B', data, COMMAND_OFFSET)
+            hook.command_started(command, len(data))
+            return hook, command, time.time()
 
-            :param command: command id (1 byte)
-            :param idx: device index
-            :param data: additional binary data
-            :return: binary data to be sent to the gateway
+        @staticmethod
+        def _tracked(track, response=None, error=None):
+            """ report the outcome of a command to the instrumentation hooks
+
+            :param track: return value of _track()
+            :param response: received packet
+            :param error: exception the command failed with
+            :return:
             """
-            # for backward compatibiity
-            if isinstance(idx, Group):
-                idx = idx.idx()
+            if track is None:
+                return
 
-            return self.build_basic_command(
-                FLAG_GLOBAL,
-                command,
-                struct.pack('<8B', idx, 0, 0, 0, 0, 0, 0, 0),
-                data
-            )
+            hook, command, start = track
+            size = (len(response) + FRAME_HEADER.size
+                    if response is not None and error is None else 0)
+            hook.command_finished(command, time.time() - start, size, error)
 
-        def build_light_command(self, command, addr, data):
-            """ build a light command
+        def _observe(self, data):
+            """ report a command to the instrumentation hooks and record its
+                round trip time for the adaptive timeouts when it is done
 
-            :param command: command id (1 byte)
-            :param addr: light mac address
-            :param data: additional binary data
-            :return: binary data to be sent to the gateway
+            :param data: binary command, sent right after this call
+            :return: callable invoked with the received packet or the error
+                when the command is done, or None if nobody observes commands
             """
-            # for backward compatibiity
-            if isinstance(addr, Light):
-                addr = addr.addr()
+            track = self._track(data)
+            if track is None and self.__timeouts is None:
+                return None
 
-            return self.build_basic_command(
-                FLAG_LIGHT,
-                command,
-                struct.pack('<Q', addr),
-                data
-            )
+            (command,) = struct.unpack_from('<B', data, COMMAND_OFFSET)
+            start = time.time()
 
-        @staticmethod
-        def build_onoff(item, onoff):
-            """
-            :param item: Light or Group object
-            :param onoff: true/false
-            :return: binary command to set on/off for the light/group
-            """
-            return item.build_command(
-                COMMAND_ONOFF,
-                struct.pack('<B', onoff)
-            )
+            def _done(response=None, error=None):
+                self._tracked(track, response, error)
+                if error is None:
+                    self._measured(command, time.time() - start)
 
-        @staticmethod
-        def build_temp(item, temp, transition):
-            """
-            :param item: Light or Group object
-            :param temp: colour temperature in kelvin
-            :param transition: transition time in 1/10 seconds, 0 to disable
-            :return: binary command to set the light/group colour temperature
-            """
-            return item.build_command(
-                COMMAND_TEMP,
-                struct.pack('<HH', temp, transition)
-            )
+            return _done
 
         @staticmethod
-        def build_luminance(item, lum, transition):
-            """
-            :param item: Light or Group object
-            :param lum: luminance (brightness)
-            :param transition: transition time in 1/10 seconds, 0 to disable
-            :return: binary command to set the light/group luminance (brightness)
+        def _future_observed(done):
             """
-            return item.build_command(
-                COMMAND_LUMINANCE,
-                struct.pack('<BH', lum, transition)
-            )
-
-        @staticmethod
-        def build_colour(item, red, green, blue, transition):
+            :param done: return value of _observe()
+            :return: done callback of a future reporting its outcome
             """
-            :param item: Light or Group object
-            :param red: amount of red
-            :param green: amount of green
-            :param blue: amount of blue
-            :param transition: transition time in 1/10 seconds, 0 to disable
-            :return: binary command to set the light/group RGB colour
+            def _observed(future):
+                if future.cancelled():
+                    done(error=futures.CancelledError())
+                elif future.exception() is not None:
+                    done(error=future.exception())
+                else:
+                    done(future.result())
+
+            return _observed
+
+        def _parse(self, resource, apply, data, publish=True):
+            """ apply a received packet and report the parse time
+
+            :param resource: 'lights', 'groups' or 'scenes'
+            :param apply: method applying the packet
+            :param data: received packet
+            :param publish: whether to publish a new GatewayState object
+            :return: return value of 'apply'
             """
-            return item.build_command(
-                COMMAND_COLOUR,
-                struct.pack('<BBBBH', red, green, blue, DEFAULT_ALPHA, transition)
-            )
+            hook = self.__hook
+            with self._deferred_events():
+                if hook is None:
+                    result = apply(data)
+                else:
+                    start = time.time()
+                    try:
+                        result = apply(data)
+                    finally:
+                        hook.parsed(resource, time.time() - start)
+
+            self._state_changed(publish)
+
+            packets = self.__packets
+            if packets is not None and packets.get(resource) != data:
+                old = packets.get(resource)
+                packets[resource] = bytes(data)
+                # the last seen times change on almost every poll, only
+                # changes of anything else are worth a write
+                if self.__snapshot_path and (
+                        old is None or
+                        self._snapshot_content(resource, old) !=
+                        self._snapshot_content(resource, data)):
+                    self._save_snapshot_later()
 
-        def build_all_light_status(self, flag=0x01):
-            """
-            :param flag: additional flag (0x01 to return all available data)
-            :return: binary command to get the status of all lights
-            """
-            return self.build_global_command(
-                COMMAND_ALL_LIGHT_STATUS,
-                struct.pack('<B', flag)
-            )
+            return result
 
-        @staticmethod
-        def build_light_status(light):
-            """
-            :param light: Light object
-            :return: binary command to get the status of the given light
-                (only subset of values returned by build_all_light_status)
-            """
-            return light.build_command(
-                COMMAND_LIGHT_STATUS,
-                ''
-            )
+        def enable_snapshot(self, path, refresh=True):
+            """ keep the lights, groups and scenes in a snapshot file. the
+                snapshot is loaded if it exists, so the models can be read
+                right away, and saved whenever a refresh receives new data
 
-        def build_group_list(self):
+            :param path: snapshot file
+            :param refresh: whether to refresh the models from the gateway
+                in a background thread
+            :return: true if a snapshot was loaded
             """
-            :return: binary command to get the list of groups
-            """
-            return self.build_global_command(
-                COMMAND_GROUP_LIST,
-                ''
-            )
+            with self.__lock:
+                if self.__packets is None:
+                    self.__packets = {}
 
-        def build_scene_list(self):
-            """
-            :return: binary command to get the list of scenes
-            """
-            return self.build_global_command(
-                COMMAND_SCENE_LIST,
-                ''
-            )
+            loaded = os.path.exists(path) and self.load_snapshot(path)
+            self.__snapshot_path = path
 
-        def group_list(self):
-            """ get the dict of group indices and names
-                deprecated, for backward compatibility only!
+            if refresh:
+                thread = threading.Thread(target=self._refresh_snapshot,
+                                          name='lightify-warm-start')
+                thread.daemon = True
+                thread.start()
 
-            :return: dict of groups (key is group index and value is group name)
-            """
-            self.update_group_list()
-            groups = {}
-            for name in self.__groups:
-                groups[self.__groups[name].idx()] = name
+            return loaded
 
-            return groups
+        def disable_snapshot(self):
+            """ stop saving the snapshot file
 
-        def update_group_list(self, throttling_interval=None):
-            """ update all groups
+            :return:
+            """
+            with self.__lock:
+                self.__snapshot_path = None
+                self.__packets = None
 
-            :param throttling_interval: optional throttling interval (skip call to
-                gateway if last call finished less than throttling interval seconds
-                ago)
-            :return: dict from group name to Group object of newly
-                    discovered groups
+        def _refresh_snapshot(self):
+            """ refresh the models loaded from a snapshot
+
+            :return:
             """
-            if (throttling_interval and
-                    time.time() < self.__groups_updated + throttling_interval):
-                return {}
+            try:
+                self.refresh_all()
+            except (socket.error, struct.error) as err:
+                self.__logger.warning('Refreshing the snapshot failed: %s', err)
+
+        @staticmethod
+        def _snapshot_content(resource, data):
+            """
+            :param resource: 'lights', 'groups' or 'scenes'
+            :param data: received packet
+            :return: the packet without its sequence number and the last
+                seen times of the lights
+            """
+            content = bytearray(data)
+            if len(content) > RESPONSE_SEQ_OFFSET:
+                content[RESPONSE_SEQ_OFFSET] = 0
+            if resource != 'lights' or len(content) < 9:
+                return content
 
-            with self.__lock:
-                if (throttling_interval and
-                        time.time() < self.__groups_updated + throttling_interval):
-                    return {}
+            (num,) = struct.unpack_from('<H', content, 7)
+            end = min(9 + num * LIGHT_RECORD.size, len(content))
+            for pos in range(9 + LIGHT_RECORD_LAST_SEEN, end - 3,
+                             LIGHT_RECORD.size):
+                content[pos:pos + 4] = bytes(4)
 
-                command = self.build_group_list()
-                data = self.send(command)
+            return content
 
-                try:
-                    (num,) = struct.unpack('<H', data[7:9])
-                    self.__logger.debug('Number of groups: %d', num)
-                    if len(data) < 8 + num * 18:
-                        raise struct.error('Incorrect data length for {} records:'
-                                        ' {}'.format(num, len(data)))
+        def _save_snapshot_later(self):
+            """ save the snapshot in a background thread, so the disk I/O
+                doesn't delay the commands
 
-                    new_groups = {}
-                    for i in range(0, num):
-                        pos = 9 + i * 18
-                        payload = data[pos:pos + 18]
-                        self.__logger.debug('Group payload: %d', i)
+            :return:
+            """
+            with self.__lock:
+                if self.__save_due:
+                    return
 
-                        (idx, name) = struct.unpack('<H16s', payload)
-                        name = name.decode('utf-8').replace('\0', '')
+                self.__save_due = True
 
-                        if (name in self.__groups and
-                                self.__groups[name].idx() == idx):
-                            group = self.__groups[name]
-                            self.__logger.debug('Old group %d: %s', idx, name)
-                        else:
-                            group = Group(self, idx, name)
-                            self.__logger.debug('New group %d: %s', idx, name)
+            thread = threading.Thread(target=self._save_due_snapshot,
+                                      name='lightify-snapshot-writer')
+            thread.daemon = True
+            thread.start()
 
-                        new_groups[name] = group
+        def _save_due_snapshot(self):
+            """ save the snapshot scheduled by _save_snapshot_later()
 
-                except (struct.error, UnicodeDecodeError) as err:
-                    self.__logger.error('Couldn\'t parse group status: %s', err)
-                    self.__logger.error('Data: %s', binascii.hexlify(data))
-                    return {}
+            :return:
+            """
+            with self.__lock:
+                self.__save_due = False
 
-                for name in self.__groups:
-                    if (name not in new_groups or
-                            self.__groups[name].idx() != new_groups[name].idx()):
-                        self.__groups[name].mark_deleted()
-                        del self.__groups[name]
+            if self.__snapshot_path:
+                self.save_snapshot()
+
+        def save_snapshot(self, path=None):
+            """ write the last received light status, group and scene lists
+                to a snapshot file (JSON)
+
+            :param path: snapshot file, default: the file of enable_snapshot()
+            :return:
+            """
+            path = path or self.__snapshot_path
+            # collect and write under the save lock, so an older snapshot
+            # never replaces a newer one
+            with self.__save_lock:
+                with self.__lock:
+                    packets = dict(self.__packets or {})
+                    updated = {'lights': self.__lights_updated,
+                               'groups': self.__groups_updated,
+                               'scenes': self.__scenes_updated}
+
+                snapshot = {'format': SNAPSHOT_FORMAT, 'host': self.__host,
+                            'saved': time.time()}
+                for resource, packet in packets.items():
+                    snapshot[resource] = {
+                        'updated': updated[resource],
+                        'hash': hashlib.sha256(packet).hexdigest(),
+                        'packet': base64.b64encode(packet).decode('ascii'),
+                    }
+
+                temp_path = '%s.%d.tmp' % (path, os.getpid())
+                try:
+                    with open(temp_path, 'w') as snapshot_file:
+                        json.dump(snapshot, snapshot_file,
+                                  separators=(',', ':'))
+                    os.replace(temp_path, path)
+                except (IOError, OSError) as err:
+                    self.__logger.warning('Couldn\'t save snapshot %s: %s',
+                                          path, err)
+
+        def load_snapshot(self, path):
+            """ load lights, groups and scenes from a snapshot file
+                the loaded data counts as outdated, so it is refreshed by the
+                next update and never used to elide commands
+
+            :param path: snapshot file
+            :return: true if the snapshot was loaded
+            """
+            try:
+                with open(path) as snapshot_file:
+                    snapshot = json.load(snapshot_file)
+
+                if snapshot.get('format') != SNAPSHOT_FORMAT:
+                    raise ValueError('Unsupported format: {}'.format(
+                        snapshot.get('format')))
+
+                packets = {}
+                for resource in SNAPSHOT_RESOURCES:
+                    if resource not in snapshot:
+                        continue
+
+                    packet = base64.b64decode(snapshot[resource]['packet'])
+                    if (hashlib.sha256(packet).hexdigest() !=
+                            snapshot[resource]['hash']):
+                        raise ValueError('Hash mismatch: {}'.format(resource))
+
+                    packets[resource] = packet
+            except (IOError, OSError, ValueError, KeyError, TypeError) as err:
+                self.__logger.warning('Couldn\'t load snapshot %s: %s', path,
+                                      err)
+                return False
+
+            apply = {'lights': self._apply_all_light_status,
+                     'groups': self._apply_group_list,
+                     'scenes': self._apply_scene_list}
+            # same lock order as a refresh
+            with self._deferred_events(), self.__io_lock, self.__lock:
+                for resource, packet in packets.items():
+                    apply[resource](packet)
+                    if resource == 'lights':
+                        self.__lights_updated = OUTDATED_TIMESTAMP
+                    elif resource == 'groups':
+                        self.__groups_updated = OUTDATED_TIMESTAMP
                     else:
-                        del new_groups[name]
+                        self.__scenes_updated = OUTDATED_TIMESTAMP
 
-                for name in new_groups:
-                    self.__groups[name] = new_groups[name]
+                if self.__packets is not None:
+                    self.__packets.update(packets)
 
-                self.update_group_lights()
-                self.update_group_scenes()
-                self.__groups_updated = time.time()
-                return new_groups
+                self._state_changed()
+            return True
 
-        def _lights_sorted_byidx(self):
-            """ get the lights sorted by light idx
-                needed to keep lists of group lights backward compatible with
-                the previous version of the library in order not to break existing
-                integrations
+        def enable_fire_and_forget(self, callback=None):
+            """ return from light, group and scene commands right after
+                sending them instead of waiting for the response. the responses
+                are read by the pipeline's reader thread (pipelining is
+                enabled if needed, until disable_fire_and_forget()). the
+                outcome of each command is recorded in an Ack object, see
+                last_ack() and ack_stats(). a failed command marks the lights
+                as outdated, so the next update corrects the cached status
 
-            :return: list of light mac addresses sorted by light idx
+            :param callback: optional callable invoked with the Ack object
+                when a command is done
+            :return:
             """
-            return [i[0] for i in sorted(
-                [(light.addr(), light.idx())
-                for light in self.__lights.values()], key=lambda i: i[1])]
+            with self.__io_lock:
+                if self.__pipeline is None:
+                    self.enable_pipelining()
+                    self.__ack_pipelining = True
+
+            with self.__ack_lock:
+                self.__ack_callback = callback
+                self.__ack_stats = dict((status, 0) for status in AckStatus)
 
-        def update_group_lights(self):
-            """ update the list of group's light mac addresses for all groups
+        def disable_fire_and_forget(self):
+            """ wait for the response of every command again, pipelining is
+                disabled if enable_fire_and_forget() enabled it
 
             :return:
             """
-            for group in self.__groups.values():
-                lights = [addr for addr in self._lights_sorted_byidx()
-                        if group.idx() in self.__lights[addr].groups()]
-                group.set_lights(lights)
-                group.update_status()
+            with self.__ack_lock:
+                self.__ack_stats = None
+                self.__ack_callback = None
 
-        def update_group_scenes(self):
-            """ update the list of group's scenes for all groups
+            with self.__io_lock:
+                if self.__ack_pipelining:
+                    self.__ack_pipelining = False
+                    self.disable_pipelining()
 
-            :return:
+        def last_ack(self):
             """
-            for group in self.__groups.values():
-                scenes = [name for name in self.__scenes
-                        if group.idx() == self.__scenes[name].group()]
-                group.set_scenes(scenes)
+            :return: Ack object of the last command sent by the current
+                thread in fire-and-forget mode or None
+            """
+            return getattr(self.__local, 'ack', None)
 
-        def group_info(self, group):
-            """ get the list of group's light mac addresses
-                deprecated, for backward compatibility only!
+        def ack_stats(self):
+            """
+            :return: dict from AckStatus object to number of commands sent in
+                fire-and-forget mode (empty if disabled)
+            """
+            return dict(self.__ack_stats or {})
 
-            :param group: Group object
-            :return: list of group's light mac addresses
+        def _send_unacknowledged(self, data):
+            """ send the packet 'data' without waiting for the response
+
+            :param data: binary command to send
+            :return: Ack object
             """
-            self.update_all_light_status()
-            return group.lights()
+            stats = self.__ack_stats
+            callback = self.__ack_callback
 
-        def update_scene_list(self, throttling_interval=None):
-            """ update all scenes
+            def _count(ack):
+                with self.__ack_lock:
+                    stats[AckStatus.PENDING] -= 1
+                    stats[ack.status()] += 1
 
-            :param throttling_interval: optional throttling interval (skip call to
-                gateway if last call finished less than throttling interval seconds
-                ago)
-            :return: dict from scene name to Scene object of newly
-                    discovered scenes
+                if ack.status() != AckStatus.SUCCESS:
+                    self._unconfirm([data])
+                    # the cached status was set before the command was sent
+                    self.set_lights_updated()
+
+                if callback:
+                    callback(ack)
+
+            ack = Ack(data, _count)
+            self.__local.ack = ack
+            with self.__ack_lock:
+                stats[AckStatus.PENDING] += 1
+
+            if self.__logger.isEnabledFor(logging.DEBUG):
+                self.__logger.debug('Sending "%s"', binascii.hexlify(data))
+            try:
+                pipeline = self._healthy_pipeline()
+                if pipeline is not None:
+                    done = self._observe(data)
+                    future = pipeline.submit(data, ack.complete)
+                    if done is not None:
+                        future.add_done_callback(self._future_observed(done))
+                    return ack
+
+                future = futures.Future()
+                future.set_result(self.send_many([data])[0])
+            except socket.error as err:
+                future = futures.Future()
+                future.set_exception(err)
+
+            ack.complete(future)
+            return ack
+
+        def enable_elision(self, max_age=ELISION_MAX_AGE):
+            """ skip sending light and group commands that would not change
+                the cached status if it was updated at most 'max_age' seconds
+                ago
+
+            :param max_age: maximum age in seconds of the light status
+            :return:
             """
-            if (throttling_interval and
-                    time.time() < self.__scenes_updated + throttling_interval):
-                return {}
+            self.__elision_max_age = max_age
 
-            with self.__lock:
-                if (throttling_interval and
-                        time.time() < self.__scenes_updated + throttling_interval):
-                    return {}
+        def disable_elision(self):
+            """ send every light and group command again
 
-                command = self.build_scene_list()
-                data = self.send(command)
+            :return:
+            """
+            self.__elision_max_age = None
 
-                try:
-                    (num,) = struct.unpack('<H', data[7:9])
-                    self.__logger.debug('Number of scenes: %d', num)
-                    if len(data) < 8 + num * 20:
-                        raise struct.error('Incorrect data length for {} records:'
-                                        ' {}'.format(num, len(data)))
+        def cache_fresh(self, addrs=()):
+            """
+            :param addrs: mac addresses of the lights a command would change
+            :return: true if elision is enabled and the light status of the
+                lights is fresh enough to skip commands
+            """
+            max_age = self.__elision_max_age
+            return (max_age is not None and
+                    time.time() <= self.__lights_updated + max_age and
+                    not self.__unconfirmed.intersection(addrs))
 
-                    new_scenes = {}
-                    for i in range(0, num):
-                        pos = 9 + i * 20
-                        payload = data[pos:pos + 20]
-                        self.__logger.debug('Scene payload: %d', i)
+        def elide(self):
+            """ count a skipped command
 
-                        (idx, name, group) = struct.unpack('<Bx16sH', payload)
-                        name = name.decode('utf-8').replace('\0', '')
-                        group = 16 - format(group, '016b').index('1')
+            :return:
+            """
+            with self.__elided_lock:
+                self.__elided += 1
 
-                        if (name in self.__scenes and
-                                self.__scenes[name].idx() == idx and
-                                self.__scenes[name].group() == group):
-                            scene = self.__scenes[name]
-                            self.__logger.debug('Old scene %d: %s, group: %d', idx,
-                                                name, group)
-                        else:
-                            scene = Scene(self, idx, name, group)
-                            self.__logger.debug('New scene %d: %s, group: %d', idx,
-                                                name, group)
+        def _unconfirm(self, packets):
+            """ don't skip commands to the targets of failed light and group
+                commands until the next light status update, their local
+                values were changed but maybe not the lights
 
-                        new_scenes[name] = scene
+            :param packets: list of binary commands
+            :return:
+            """
+            for data in packets:
+                (flag, command) = struct.unpack_from('<2B', data,
+                                                     COMMAND_OFFSET - 1)
+                if command not in DEBOUNCE_COMMANDS:
+                    continue
+
+                if flag == 0:
+                    self.__unconfirmed.add(
+                        LIGHT_ADDR.unpack_from(data, ADDR_OFFSET)[0])
+                else:
+                    group = self.__groups_byidx.get(data[ADDR_OFFSET])
+                    if group is not None:
+                        self.__unconfirmed.update(group.lights())
+
+        def elided(self):
+            """
+            :return: number of commands skipped because of elision
+            """
+            return self.__elided
 
-                except (struct.error, UnicodeDecodeError, ValueError) as err:
-                    self.__logger.error('Couldn\'t parse scene status: %s', err)
-                    self.__logger.error('Data: %s', binascii.hexlify(data))
-                    return {}
+        def batch(self):
+            """ collect the light, group and scene commands sent by the
+                current thread and send them at once, e.g.
 
-                for name in self.__scenes:
-                    if (name not in new_scenes or
-                            self.__scenes[name].idx() != new_scenes[name].idx() or
-                            self.__scenes[name].group() !=
-                            new_scenes[name].group()):
-                        self.__scenes[name].mark_deleted()
-                        del self.__scenes[name]
-                    else:
-                        del new_scenes[name]
+                with conn.batch():
+                    light.set_onoff(True)
+                    group.set_luminance(50, 0)
 
-                for name in new_scenes:
-                    self.__scenes[name] = new_scenes[name]
+            :return: Batch object (context manager)
+            """
+            return Batch(self)
 
-                self.__scenes_updated = time.time()
-                return new_scenes
+        def set_batch(self, batch):
+            """ set the active batch of the current thread
 
-        def send(self, data, reconnect=True):
-            """ send the packet 'data' to the gateway and return the received packet
+            :param batch: Batch object or None
+            :return: previously active Batch object or None
+            """
+            previous = getattr(self.__local, 'batch', None)
+            self.__local.batch = batch
+            return previous
+
+        def _send_pipelined(self, data, reconnect, deadline=None):
+            """ send the packet 'data' through the pipeline and wait for the
+                received packet
 
             :param data: binary command to send
             :param reconnect: if true, will try to reconnect once. if false,
                             will raise a socket.error.
+            :param deadline: optional time (time.time()) by which the command
+                must be answered
             :return: received packet
             """
-            with self.__lock:
-                try:
+            (command,) = struct.unpack_from('<B', data, COMMAND_OFFSET)
+            timeout = self.command_timeout(command, deadline)
+            try:
+                if self.__logger.isEnabledFor(logging.DEBUG):
                     self.__logger.debug('Sending "%s"', binascii.hexlify(data))
-                    self.__sock.sendall(data)
-
-                    lengthsize = 2
-                    received_data = self.__sock.recv(lengthsize)
-                    (length,) = struct.unpack('<H', received_data[:lengthsize])
-                    self.__logger.debug(
-                        'Received "%d %s"',
-                        len(received_data),
-                        binascii.hexlify(received_data)
-                    )
-
-                    expected = length + 2 - len(received_data)
-                    self.__logger.debug('Length:   %d', length)
-                    self.__logger.debug('Expected: %d', expected)
-                    total_received_data = b''
-                    while expected > 0:
-                        received_data = self.__sock.recv(expected)
-                        self.__logger.debug(
-                            'Received "%d %s"',
-                            len(received_data),
-                            binascii.hexlify(received_data)
-                        )
-                        total_received_data += received_data
-                        expected -= len(received_data)
-                    self.__logger.debug('Received: %s', repr(total_received_data))
-                except socket.error as err:
-                    self.__logger.warning('Lost connection to lightify gateway:')
-                    self.__logger.warning('socketError: %s', err)
-                    if reconnect:
-                        self.__logger.warning('Trying to reconnect')
-                        self._connect()
-                        return self.send(data, reconnect=False)
-
-                    raise err
-
-                return total_received_data
-
-        def update_light_status(self, light):
+                pipeline = self._healthy_pipeline(deadline)
+                if pipeline is None:
+                    return self._send_packet(data, reconnect, deadline)
+
+                done = self._observe(data)
+                start = time.time()
+                future = pipeline.submit(
+                    data, done and self._future_observed(done), timeout)
+                try:
+                    return future.result(
+                        max(start + timeout - time.time(), 0))
+                except futures.TimeoutError:
+                    # the retry may reuse the sequence number
+                    pipeline.discard([future])
+                    raise socket.timeout('timed out')
+            except socket.error as err:
+                self._send_failed(err)
+                if isinstance(err, socket.timeout):
+                    self._timed_out([command])
+                if reconnect and (deadline is None or
+                                  time.time() < deadline):
+                    return self._send_packet(data, False, deadline)
+
+                raise err
+
+        def refresh_all(self, deadline=None):
+            """ update the lights, scenes and groups. the three commands are
+                sent together and the replies are parsed when all of them
+                arrived, so the groups' lights and scenes are set up once
+
+            :param deadline: optional time (time.time()) by which the gateway
+                must have answered
+            :return:
+            """
+            with self._deferred_events(), self._locked():
+                data = self.send_many([self.build_all_light_status(),
+                                       self.build_scene_list(),
+                                       self.build_group_list()],
+                                      deadline=deadline)
+                self._apply_all(data)
+
+        def _apply_all(self, data):
+            """ apply the replies of refresh_all()
+
+            :param data: list of received light status, scene list and group
+                list packets (None if missing)
+            :return:
+            """
+            for resource, apply, packet in zip(
+                    ('lights', 'scenes', 'groups'),
+                    (self._apply_all_light_status, self._apply_scene_list,
+                     self._apply_group_list), data):
+                if packet is None:
+                    self.__logger.warning('No reply to %s list', resource)
+                else:
+                    self._parse(resource, apply, packet, publish=False)
+
+            self._state_changed()
+
+        def update_light_status(self, light, deadline=None):
             """ get the status of the given light (only subset of values)
                 deprecated, for backward compatibility only!
 
             :param light: Light object
+            :param deadline: optional time (time.time()) by which the gateway
+                must have answered
             :return: tuple containing (onoff, lum, temp, red, green, blue)
             """
-            with self.__lock:
+            with self.__io_lock:
                 command = self.build_light_status(light)
-                data = self.send(command)
+                data = self._send_packet(command, deadline=deadline)
 
                 unreachable_data_len = 18
                 if len(data) == unreachable_data_len:
@@ -1539,12 +5174,15 @@ class Lightify:
 
                 return onoff, lum, temp, red, green, blue
 
-        def update_all_light_status(self, throttling_interval=None):
+        def update_all_light_status(self, throttling_interval=None,
+                                    deadline=None):
             """ update the status of all lights
 
             :param throttling_interval: optional throttling interval (skip call to
                 gateway if last call finished less than throttling interval seconds
                 ago)
+            :param deadline: optional time (time.time()) by which the gateway
+                must have answered
             :return: dict from light mac address to Light object of newly
                     discovered lights
             """
@@ -1552,49 +5190,69 @@ class Lightify:
                     time.time() < self.__lights_updated + throttling_interval):
                 return {}
 
-            with self.__lock:
+            with self._deferred_events(), self._locked():
                 if (throttling_interval and
                         time.time() < self.__lights_updated + throttling_interval):
                     return {}
 
                 command = self.build_all_light_status()
-                data = self.send(command)
+                data = self._send_packet(command, deadline=deadline)
+                return self._parse('lights', self._apply_all_light_status, data)
 
-                old_hash = self.__lights_hash
-                self.__lights_hash = hashlib.md5(data[7:]).hexdigest()
-                if old_hash == self.__lights_hash:
-                    self.__lights_updated = time.time()
-                    return {}
+        def _apply_all_light_status(self, data):
+            """ update the status of all lights from a received all light
+                status packet
 
+            :param data: received packet
+            :return: dict from light mac address to Light object of newly
+                    discovered lights
+            """
+            with self.__lock:
+                self.__unconfirmed.clear()
+                diff = LightsDiff()
+                records = {}
+                slots = {}
+                lights_byidx = []
+                new_lights = {}
                 try:
                     (num,) = struct.unpack('<H', data[7:9])
                     self.__logger.debug('Number of lights: %d', num)
-                    if len(data) < 8 + num * 50:
+                    size = LIGHT_RECORD.size
+                    if len(data) < 9 + num * size:
                         raise struct.error('Incorrect data length for {} records:'
                                         ' {}'.format(num, len(data)))
 
-                    new_lights = {}
-                    for i in range(0, num):
-                        pos = 9 + i * 50
-                        payload = data[pos:pos + 50]
-                        self.__logger.debug('Light payload: %d', i)
-
-                        (addr, stat, name, last_seen) = struct.unpack(
-                            '<2xQ16s16sI4x', payload)
-                        (type_id, version, reachable, groups,
-                        onoff, lum, temp, red,
-                        green, blue, alpha) = struct.unpack('<B4sBH2BH4B', stat)
+                    debug = self.__logger.isEnabledFor(logging.DEBUG)
+                    view = memoryview(data)
+                    for i in range(num):
+                        pos = 9 + i * size
+                        payload = view[pos:pos + size]
+                        (addr,) = LIGHT_RECORD_ADDR.unpack_from(payload)
+                        lights_byidx.append(addr)
+
+                        # skip decoding records that did not change
+                        old_record = self.__light_records.get(addr)
+                        if (old_record is not None and old_record[0] == i and
+                                old_record[1] == payload and
+                                addr in self.__lights):
+                            records[addr] = old_record
+                            slots[addr] = self.__light_slots[addr]
+                            continue
+
+                        records[addr] = (i, payload.tobytes())
+                        (addr, type_id, version1, version2, version3, version4,
+                         reachable, group_mask, onoff, lum, temp, red, green,
+                         blue, alpha, name,
+                         last_seen) = LIGHT_RECORD.unpack(payload)
+                        slots[addr] = (i, group_mask)
                         name = name.decode('utf-8').replace('\0', '')
-                        groups = [16 - j for j, val
-                                in enumerate(format(groups, '016b'))
-                                if val == '1']
-                        version = format(struct.unpack('>I', version)[0], '032b')
-                        version = ''.join('{0:01X}'.format(
-                            int(version[i * 4:(i + 1) * 4], 2)) for i in range(8))
+                        version = '%02X%02X%02X%02X' % (version1, version2,
+                                                        version3, version4)
 
                         if addr in self.__lights:
                             light = self.__lights[addr]
-                            self.__logger.debug('Old light: %x', addr)
+                            old_values = [getattr(light, field)()
+                                          for field in LIGHT_FIELDS]
                         else:
                             if type_id not in self.__device_types:
                                 self.__logger.warning(
@@ -1609,51 +5267,311 @@ class Lightify:
                                 type_id_assumed = type_id
 
                             light = Light(self, addr, type_id, type_id_assumed)
-                            self.__logger.debug('New light: %x', addr)
-
-                        self.__logger.debug('name:      %s', name)
-                        self.__logger.debug('reachable: %d', reachable)
-                        self.__logger.debug('last seen: %d', last_seen)
-                        self.__logger.debug('onoff:     %d', onoff)
-                        self.__logger.debug('lum:       %d', lum)
-                        self.__logger.debug('temp:      %d', temp)
-                        self.__logger.debug('red:       %d', red)
-                        self.__logger.debug('green:     %d', green)
-                        self.__logger.debug('blue:      %d', blue)
-                        self.__logger.debug('alpha:     %d', alpha)
-                        self.__logger.debug('type id:   %d', type_id)
-                        self.__logger.debug('groups:    %s', groups)
-                        self.__logger.debug('version:   %s', version)
-                        self.__logger.debug('idx:   %s', i)
+                            old_values = None
+                            new_lights[addr] = light
+                            diff.set_added(light)
+                            if debug:
+                                self.__logger.debug('New light: %x', addr)
+
+                        if debug:
+                            self.__logger.debug(
+                                'Light %d: %x, name: %s, reachable: %d, '
+                                'last seen: %d, onoff: %d, lum: %d, temp: %d, '
+                                'rgba: %d %d %d %d, type id: %d, groups: %s, '
+                                'version: %s', i, addr, name, reachable,
+                                last_seen, onoff, lum, temp, red, green, blue,
+                                alpha, type_id, self._decode_groups(group_mask),
+                                version)
 
                         light.update_status(reachable, last_seen, onoff, lum, temp,
-                                            red, green, blue, alpha, name, groups,
-                                            version, i)
-                        new_lights[addr] = light
+                                            red, green, blue, alpha, name,
+                                            group_mask, version, i)
+
+                        if old_values is not None:
+                            fields = set(
+                                field for field, value
+                                in zip(LIGHT_FIELDS, old_values)
+                                if getattr(light, field)() != value)
+                            if fields:
+                                diff.set_changed(light, fields)
 
                 except (struct.error, UnicodeDecodeError) as err:
                     self.__logger.error('Couldn\'t parse light status: %s', err)
                     self.__logger.error('Data: %s', binascii.hexlify(data))
+                    # the previous diff must not be taken for this update's
+                    self.__lights_diff = LightsDiff()
                     return {}
 
-                for addr in self.__lights:
-                    if addr not in new_lights:
-                        self.__lights[addr].mark_deleted()
-                        del self.__lights[addr]
-                    else:
-                        del new_lights[addr]
+                for addr in list(self.__lights):
+                    if addr not in records:
+                        light = self.__lights.pop(addr)
+                        light.mark_deleted()
+                        diff.set_removed(light)
+
+                self.__lights.update(new_lights)
+                self.__light_records = records
+                changed_groups = self._update_group_index(slots, lights_byidx)
+                if changed_groups:
+                    self.update_group_lights(changed_groups)
+
+                for light in diff.removed().values():
+                    self._unindex_light(light)
+
+                for light in diff.added().values():
+                    self._index_light(light)
 
-                for addr in new_lights:
-                    self.__lights[addr] = new_lights[addr]
+                for addr, fields in diff.changed().items():
+                    self._mark_groups_changed(self.__lights[addr].groups())
+                    if not INDEXED_FIELDS.isdisjoint(fields):
+                        self._index_light(self.__lights[addr])
 
+                self.__lights_diff = diff
                 self.__lights_updated = time.time()
-                self.__lights_changed = self.__lights_updated
+                if diff:
+                    self.__lights_changed = self.__lights_updated
+                    if self.__subscriptions:
+                        self._emit_diff(diff)
                 return new_lights
+    # connection of the first gateway, kept for backward compatibility
     instance = None
-    def __init__(self, arg):
-        if not Lightify.instance:
-            Lightify.instance = Lightify.__Lightify(arg)
-        else:
-            Lightify.instance.val = arg
+    # dict from gateway host to connection
+    instances = {}
+    # dict from gateway host to the arguments the connection was established
+    # with, including the defaults
+    instance_arguments = {}
+    instances_lock = threading.Lock()
+    # connection class, e.g. for subclassing
+    connection_class = __Lightify
+
+    def __init__(self, host, *args, **kwargs):
+        """ get the connection to the gateway 'host', one per host and
+            process. arguments after the host are passed to the connection
+            when it is established for the first time. later calls may leave
+            them out or must pass the same ones, ValueError is raised
+            otherwise.
+
+        :param host: lightify gateway host
+        """
+        bound = inspect.signature(Lightify.__Lightify.__init__).bind(
+            None, host, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        del arguments['self']
+
+        with Lightify.instances_lock:
+            if host not in Lightify.instances:
+                Lightify.instances[host] = Lightify.__Lightify(host, *args,
+                                                               **kwargs)
+                Lightify.instance_arguments[host] = arguments
+            elif (args or kwargs) and arguments != (
+                    Lightify.instance_arguments.get(host, arguments)):
+                raise ValueError('The connection to {} was established with '
+                                 'other arguments'.format(host))
+
+            if not Lightify.instance:
+                Lightify.instance = Lightify.instances[host]
+
+        self.instance = Lightify.instances[host]
+
     def __getattr__(self, name):
-        return getattr(self.instance, name)
\ No newline at end of file
+        return getattr(self.instance, name)
+
+
+class GatewayManager:
+    """ manages the connections to several lightify gateways
+        gateways are polled in parallel and their lights, groups and scenes
+        are merged into dicts keyed by (host, addr) or (host, idx)
+    """
+
+    def __init__(self, hosts, new_device_types=None, log_level=logging.INFO,
+                 loghandler=None, max_workers=None):
+        """
+        :param hosts: list of lightify gateway hosts
+        :param new_device_types: dict of additional device types to merge with
+            default device types (see Lightify)
+        :param log_level: logging.loglevel Enum
+        :param loghandler: logging.Handler object
+        :param max_workers: maximum number of gateways polled at the same
+            time (default: number of hosts)
+        """
+        self.__logger = logging.getLogger(MODULE)
+        self.__conn_args = (new_device_types, log_level, loghandler)
+        self.__executor = futures.ThreadPoolExecutor(
+            max_workers=max_workers or max(len(hosts), 1))
+        self.__gateways = {}
+        self.__lock = threading.Lock()
+
+        connections = self._map(self._open, hosts)
+        for host in hosts:
+            if host in connections:
+                self.__gateways[host] = connections[host]
+
+    def _open(self, host):
+        """
+        :param host: lightify gateway host
+        :return: connection to the gateway
+        """
+        conn = Lightify(host, *self.__conn_args).instance
+        conn.connect()
+        return conn
+
+    def _map(self, func, hosts):
+        """ call func(host) for every host in parallel
+            failing gateways are logged and left out of the result
+
+        :param func: callable taking the gateway host
+        :param hosts: list of lightify gateway hosts
+        :return: dict from gateway host to return value
+        """
+        pending = dict((host, self.__executor.submit(func, host))
+                       for host in hosts)
+        results = {}
+        for host, future in pending.items():
+            try:
+                results[host] = future.result()
+            except (socket.error, struct.error) as err:
+                self.__logger.warning('Gateway %s failed: %s', host, err)
+
+        return results
+
+    def _map_gateways(self, func):
+        """ call func(conn) for every gateway connection in parallel
+
+        :param func: callable taking the gateway connection
+        :return: dict from gateway host to return value
+        """
+        gateways = self.gateways()
+        return self._map(lambda host: func(gateways[host]), list(gateways))
+
+    def add_gateway(self, host):
+        """ connect to an additional gateway
+
+        :param host: lightify gateway host
+        :return: connection to the gateway
+        """
+        conn = self._open(host)
+        with self.__lock:
+            self.__gateways[host] = conn
+
+        return conn
+
+    def remove_gateway(self, host):
+        """ stop managing a gateway
+
+        :param host: lightify gateway host
+        :return:
+        """
+        with self.__lock:
+            conn = self.__gateways.pop(host, None)
+
+        if conn is not None:
+            conn.close()
+
+    def gateways(self):
+        """
+        :return: dict from gateway host to connection
+        """
+        with self.__lock:
+            return dict(self.__gateways)
+
+    def gateway(self, host):
+        """
+        :param host: lightify gateway host
+        :return: connection to the gateway
+        """
+        return self.gateways()[host]
+
+    def update_all_light_status(self, throttling_interval=None):
+        """ update the status of all lights of all gateways in parallel
+
+        :param throttling_interval: optional throttling interval (see
+            Lightify.update_all_light_status)
+        :return: dict from (host, light mac address) to Light object of newly
+                discovered lights
+        """
+        return self._merge(self._map_gateways(
+            lambda conn: conn.update_all_light_status(throttling_interval)),
+            lambda light: light.addr())
+
+    def update_group_list(self, throttling_interval=None):
+        """ update all groups of all gateways in parallel
+
+        :param throttling_interval: optional throttling interval (see
+            Lightify.update_group_list)
+        :return: dict from (host, group idx) to Group object of newly
+                discovered groups
+        """
+        return self._merge(self._map_gateways(
+            lambda conn: conn.update_group_list(throttling_interval)),
+            lambda group: group.idx())
+
+    def update_scene_list(self, throttling_interval=None):
+        """ update all scenes of all gateways in parallel
+
+        :param throttling_interval: optional throttling interval (see
+            Lightify.update_scene_list)
+        :return: dict from (host, scene idx) to Scene object of newly
+                discovered scenes
+        """
+        return self._merge(self._map_gateways(
+            lambda conn: conn.update_scene_list(throttling_interval)),
+            lambda scene: scene.idx())
+
+    def update_all(self, throttling_interval=None):
+        """ update lights, scenes and groups of all gateways in parallel
+            (one task per gateway)
+
+        :param throttling_interval: optional throttling interval
+        :return:
+        """
+        def update(conn):
+            conn.update_all_light_status(throttling_interval)
+            conn.update_scene_list(throttling_interval)
+            conn.update_group_list(throttling_interval)
+
+        self._map_gateways(update)
+
+    @staticmethod
+    def _merge(results, key):
+        """ merge per gateway dicts of lights, groups or scenes
+
+        :param results: dict from gateway host to dict of objects
+        :param key: callable returning the per gateway key of an object
+        :return: dict from (host, key) to object
+        """
+        merged = {}
+        for host, items in results.items():
+            for item in items.values():
+                merged[(host, key(item))] = item
+
+        return merged
+
+    def lights(self):
+        """
+        :return: dict from (host, light mac address) to Light object
+        """
+        return self._merge(self._map_gateways(lambda conn: conn.lights()),
+                           lambda light: light.addr())
+
+    def groups(self):
+        """
+        :return: dict from (host, group idx) to Group object
+        """
+        return self._merge(self._map_gateways(lambda conn: conn.groups()),
+                           lambda group: group.idx())
+
+    def scenes(self):
+        """
+        :return: dict from (host, scene idx) to Scene object
+        """
+        return self._merge(self._map_gateways(lambda conn: conn.scenes()),
+                           lambda scene: scene.idx())
+
+    def close(self):
+        """ stop the polling threads and close the gateway connections
+
+        :return:
+        """
+        self.__executor.shutdown(wait=True)
+        for conn in self.gateways().values():
+            conn.close()
\ No newline at end of file
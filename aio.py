@@ -0,0 +1,794 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# asyncio client for the Osram lightify gateway
+# Shares the object model (Light, Group, Scene), the packet builders and the
+# parsers with the blocking Lightify class
+#
+
+import asyncio
+import binascii
+import logging
+import socket
+import struct
+import time
+
+from . import (COMMAND_ACTIVATE_SCENE, COMMAND_OFFSET, DEBOUNCE_INTERVAL,
+               DEFAULT_PIPELINE_WINDOW, GATEWAY_TIMEOUT_SECONDS, MAX_COLOUR,
+               MAX_LUMINANCE, MAX_PIPELINE_WINDOW, MODULE, POLL_RESOURCES,
+               PORT, PROBE_INTERVAL, PROBE_TIMEOUT, RECONNECT_BACKOFF,
+               RESPONSE_SEQ_OFFSET, SEQ_OFFSET, Light, Lightify, Poller)
+
+
+class EventStream:
+    """ async iterator over the state change events of a connection
+        (Lightify or AsyncLightify). must be created from the event loop.
+
+        usage:
+            async for event in EventStream(conn, types=[EventType.ON]):
+                ...
+    """
+
+    def __init__(self, conn, addrs=None, groups=None, types=None):
+        """
+        :param conn: Lightify or AsyncLightify object
+        :param addrs: optional list of light mac addresses to filter by
+        :param groups: optional list of group indices to filter by
+        :param types: optional list of EventType objects to filter by
+        """
+        self.__conn = conn
+        self.__loop = asyncio.get_running_loop()
+        self.__queue = asyncio.Queue()
+        self.__subscription = conn.subscribe(self._put, addrs, groups, types)
+
+    def _put(self, event):
+        """ queue an event, possibly from another thread
+
+        :param event: Event object or None to stop the iteration
+        :return:
+        """
+        self.__loop.call_soon_threadsafe(self.__queue.put_nowait, event)
+
+    def close(self):
+        """ unsubscribe and stop the iteration
+
+        :return:
+        """
+        self.__conn.unsubscribe(self.__subscription)
+        self._put(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self.__queue.get()
+        if event is None:
+            raise StopAsyncIteration
+
+        return event
+
+
+class AsyncPoller:
+    """ background task refreshing the lights, scenes and groups of an
+        AsyncLightify connection on independent adaptive schedules
+    """
+
+    def __init__(self, conn, schedules):
+        """
+        :param conn: AsyncLightify object
+        :param schedules: dict from resource ('lights', 'scenes', 'groups') to
+            PollSchedule object
+        """
+        self.__conn = conn
+        self.__schedules = schedules
+        self.__logger = logging.getLogger(MODULE)
+        self.__wakeup = asyncio.Event()
+        self.__task = asyncio.ensure_future(self._run())
+
+    def schedules(self):
+        """
+        :return: dict from resource to PollSchedule object
+        """
+        return self.__schedules
+
+    def hurry(self, resource):
+        """ poll a resource soon
+
+        :param resource: 'lights', 'scenes' or 'groups'
+        :return:
+        """
+        if resource in self.__schedules:
+            self.__schedules[resource].hurry()
+            self.__wakeup.set()
+
+    def stop(self):
+        """ cancel the polling task
+
+        :return:
+        """
+        self.__task.cancel()
+
+    async def poll(self, resource):
+        """ refresh a resource
+
+        :param resource: 'lights', 'scenes' or 'groups'
+        :return: true if the refresh found any changes
+        """
+        if resource == 'lights':
+            await self.__conn.update_all_light_status()
+            diff = self.__conn.lights_diff()
+            if diff.added() or diff.removed() or any(
+                    'groups' in fields for fields in diff.changed().values()):
+                self.hurry('groups')
+
+            return Poller.lights_active(diff)
+
+        if resource == 'scenes':
+            scenes = list(self.__conn.scenes().values())
+            await self.__conn.update_scene_list()
+            return Poller.items_changed(scenes, self.__conn.scenes())
+
+        groups = list(self.__conn.groups().values())
+        await self.__conn.update_group_list()
+        return Poller.items_changed(groups, self.__conn.groups())
+
+    async def _run(self):
+        """ poll the resources when they are due
+
+        :return:
+        """
+        while True:
+            for resource in POLL_RESOURCES:
+                schedule = self.__schedules.get(resource)
+                if schedule is None or schedule.due() > time.time():
+                    continue
+
+                try:
+                    active = await self.poll(resource)
+                except (socket.error, struct.error) as err:
+                    self.__logger.warning('Polling %s failed: %s', resource,
+                                          err)
+                    active = False
+
+                schedule.polled(active)
+
+            self.__wakeup.clear()
+            due = min(schedule.due() for schedule in self.__schedules.values())
+            try:
+                await asyncio.wait_for(self.__wakeup.wait(),
+                                       max(due - time.time(), 0))
+            except asyncio.TimeoutError:
+                pass
+
+
+class AsyncLightify(Lightify.connection_class):
+    """ asyncio osram lightify class
+        all commands are pipelined on a single connection and matched to the
+        received packets by their sequence number
+
+        lights(), groups(), scenes() and the lookups built on them return
+        the models of the last update and never fetch them: await connect(),
+        refresh_all() or the update methods first.
+
+        batches, debouncing, fire-and-forget mode and health checks belong
+        to the blocking transport and raise NotImplementedError.
+
+        usage:
+            async with AsyncLightify(host) as conn:
+                for light in conn.lights().values():
+                    await conn.set_onoff(light, True)
+    """
+    # background polling runs as a task of the event loop
+    poller_class = AsyncPoller
+    # the update methods are coroutines: lights(), groups() and scenes()
+    # return the models of the last update, see connect()
+    load_on_demand = False
+
+    def __init__(self, host, new_device_types=None, log_level=logging.INFO,
+                 loghandler=None, window=DEFAULT_PIPELINE_WINDOW):
+        """
+        :param host: lightify gateway host
+        :param new_device_types: dict of additional device types to merge with
+            default device types (see Lightify)
+        :param log_level: logging.loglevel Enum
+        :param loghandler: logging.Handler object
+        :param window: maximum number of commands in flight (1-255)
+        """
+        if not 0 < window <= MAX_PIPELINE_WINDOW:
+            raise ValueError('Pipeline window must be between 1 and {}'
+                             .format(MAX_PIPELINE_WINDOW))
+
+        self.__host = host
+        self.__writer = None
+        self.__pending = {}
+        self.__slots = asyncio.Semaphore(window)
+        self.__connect_lock = asyncio.Lock()
+        super().__init__(host, new_device_types, log_level, loghandler)
+        self.__logger = logging.getLogger(MODULE)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+
+    def events(self, addrs=None, groups=None, types=None):
+        """ subscribe to state change events
+
+        :param addrs: optional list of light mac addresses to filter by
+        :param groups: optional list of group indices to filter by
+        :param types: optional list of EventType objects to filter by
+        :return: EventStream object (async iterator over Event objects)
+        """
+        return EventStream(self, addrs, groups, types)
+
+    def _connect(self, deadline=None):
+        """ the connection is established by connect()
+
+        :param deadline: ignored
+        :return:
+        """
+
+    def enable_pipelining(self, window=DEFAULT_PIPELINE_WINDOW):
+        """ asyncio connections are always pipelined, the window is set by
+            the constructor
+
+        :param window: maximum number of commands in flight
+        :return:
+        """
+        raise NotImplementedError('AsyncLightify is always pipelined, pass '
+                                  'the window to the constructor')
+
+    def disable_pipelining(self):
+        """ asyncio connections are always pipelined
+
+        :return:
+        """
+        raise NotImplementedError('AsyncLightify is always pipelined, pass '
+                                  'window=1 to the constructor')
+
+    def enable_health_checks(self, probe_interval=PROBE_INTERVAL,
+                             probe_timeout=PROBE_TIMEOUT,
+                             backoff=RECONNECT_BACKOFF):
+        """ not supported, a failed command reconnects on the next one
+
+        :return:
+        """
+        raise NotImplementedError('AsyncLightify does not support health '
+                                  'checks')
+
+    def enable_debouncing(self, interval=DEBOUNCE_INTERVAL):
+        """ not supported, the commands are sent as tasks of the event loop
+
+        :return:
+        """
+        raise NotImplementedError('AsyncLightify does not support '
+                                  'debouncing')
+
+    def enable_fire_and_forget(self, callback=None):
+        """ not supported, send() returns a task that need not be awaited
+
+        :return:
+        """
+        raise NotImplementedError('AsyncLightify does not support '
+                                  'fire-and-forget mode, send() returns a '
+                                  'task')
+
+    def batch(self):
+        """ not supported, see send_many()
+
+        :return:
+        """
+        raise NotImplementedError('AsyncLightify does not support batches, '
+                                  'use send_many()')
+
+    def enable_snapshot(self, path, refresh=True):
+        """ keep the lights, groups and scenes in a snapshot file, see
+            Lightify.enable_snapshot(). must be called from the event loop.
+
+        :param path: snapshot file
+        :param refresh: whether to refresh the models from the gateway in a
+            task of the event loop
+        :return: true if a snapshot was loaded
+        """
+        loaded = super().enable_snapshot(path, refresh=False)
+        if refresh:
+            asyncio.ensure_future(self._refresh_snapshot())
+
+        return loaded
+
+    async def _refresh_snapshot(self):
+        """ refresh the models loaded from a snapshot
+
+        :return:
+        """
+        try:
+            await self.refresh_all()
+        except (socket.error, struct.error) as err:
+            self.__logger.warning('Refreshing the snapshot failed: %s', err)
+
+    async def group_list(self):
+        """ get the dict of group indices and names
+            deprecated, for backward compatibility only!
+
+        :return: dict of groups (key is group index and value is group name)
+        """
+        await self.update_group_list()
+        return dict((group.idx(), name)
+                    for name, group in self.groups().items())
+
+    async def group_info(self, group):
+        """ get the list of group's light mac addresses
+            deprecated, for backward compatibility only!
+
+        :param group: Group object
+        :return: list of group's light mac addresses
+        """
+        await self.update_all_light_status()
+        return group.lights()
+
+    async def connect(self):
+        """ establish a connection with the lightify gateway and fetch
+            the lights, scenes and groups
+
+        :return:
+        """
+        await self._ensure_connected()
+        await self.refresh_all()
+
+    async def refresh_all(self, deadline=None):
+        """ update the lights, scenes and groups. the three commands are
+            in flight together and the replies are parsed when all of them
+            arrived
+
+        :param deadline: optional time (time.time()) by which the gateway
+            must have answered
+        :return:
+        """
+        data = await asyncio.gather(
+            self.send(self.build_all_light_status(), deadline=deadline),
+            self.send(self.build_scene_list(), deadline=deadline),
+            self.send(self.build_group_list(), deadline=deadline))
+        self._apply_all(data)
+
+    async def close(self):
+        """ close the connection with the lightify gateway
+
+        :return:
+        """
+        self.stop_polling()
+        writer = self.__writer
+        self._fail(socket.error('Connection closed'), writer)
+        if writer is not None:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def _ensure_connected(self):
+        """ (re)establish the connection if there is none
+
+        :return:
+        """
+        async with self.__connect_lock:
+            if self.__writer is not None:
+                return
+
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.__host, PORT),
+                GATEWAY_TIMEOUT_SECONDS)
+            sock = writer.get_extra_info('socket')
+            if sock is not None:
+                self._configure_socket(sock)
+            self.__writer = writer
+            asyncio.ensure_future(self._read_loop(reader, writer))
+
+    def _fail(self, err, writer):
+        """ drop the connection and fail all commands in flight
+
+        :param err: exception to fail the commands with
+        :param writer: asyncio.StreamWriter of the failed connection
+        :return:
+        """
+        if writer is None or writer is not self.__writer:
+            return
+
+        self.__writer = None
+        writer.close()
+
+        pending = list(self.__pending.values())
+        self.__pending.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(err)
+
+    async def _read_loop(self, reader, writer):
+        """ receive packets and hand them to the waiting commands
+
+        :param reader: asyncio.StreamReader of the connection
+        :param writer: asyncio.StreamWriter of the connection
+        :return:
+        """
+        try:
+            while True:
+                header = await reader.readexactly(2)
+                (length,) = struct.unpack('<H', header)
+                data = await reader.readexactly(length)
+                (seq,) = struct.unpack_from('<B', data, RESPONSE_SEQ_OFFSET)
+
+                future = self.__pending.pop(seq, None)
+                if future is None:
+                    self.__logger.debug('Dropping response with unknown '
+                                        'sequence number %d', seq)
+                elif not future.done():
+                    future.set_result(data)
+        except asyncio.IncompleteReadError:
+            self._fail(socket.error('Connection closed by gateway'), writer)
+        except (socket.error, struct.error) as err:
+            self._fail(err, writer)
+
+    async def send_many(self, packets, reconnect=True, deadline=None):
+        """ send several packets to the gateway and wait for all received
+            packets. the commands are in flight together.
+
+        :param packets: list of binary commands to send
+        :param reconnect: if true, will try to reconnect once. if false,
+                        will raise a socket.error.
+        :param deadline: optional time (time.time()) by which the commands
+            must be answered, socket.timeout is raised when it expires
+        :return: list of received packets, in the order of 'packets'
+        """
+        return list(await asyncio.gather(*(
+            self.send(data, reconnect, deadline) for data in packets)))
+
+    def submit(self, data, callback=None):
+        """ send the packet 'data' to the gateway without waiting for the
+            response
+
+        :param data: binary command to send
+        :param callback: optional callable invoked with the task when the
+            command is done
+        :return: asyncio.Task resolving to the received packet
+        """
+        task = self.send(data)
+        if callback:
+            task.add_done_callback(callback)
+
+        return task
+
+    def send(self, data, reconnect=True, deadline=None):
+        """ send the packet 'data' to the gateway
+            must be called from the event loop. the command is sent even if
+            the result is not awaited.
+
+        :param data: binary command to send
+        :param reconnect: if true, will try to reconnect once. if false,
+                        will raise a socket.error.
+        :param deadline: optional time (time.time()) by which the command
+            must be answered, socket.timeout is raised when it expires
+        :return: asyncio.Task resolving to the received packet
+        """
+        return asyncio.ensure_future(self._send(data, reconnect, deadline))
+
+    async def _send(self, data, reconnect, deadline=None):
+        """ send the packet 'data' to the gateway and wait for the response
+
+        :param data: binary command to send
+        :param reconnect: if true, will try to reconnect once. if false,
+                        will raise a socket.error.
+        :param deadline: optional time (time.time()) by which the command
+            must be answered
+        :return: received packet
+        """
+        (command,) = struct.unpack_from('<B', data, COMMAND_OFFSET)
+        # the retry waits for the timeout backed off after a timeout
+        timeout = self.command_timeout(command, deadline)
+        try:
+            # waiting for a slot and connecting count against the timeout
+            return await asyncio.wait_for(self._slotted(data, timeout),
+                                          timeout)
+        except asyncio.TimeoutError:
+            err = socket.timeout('timed out')
+            self.__logger.warning('Command timed out')
+            self._timed_out([command])
+            if reconnect and (deadline is None or time.time() < deadline):
+                return await self._send(data, False, deadline)
+
+            raise err
+        except socket.error as err:
+            self.__logger.warning('Lost connection to lightify gateway:')
+            self.__logger.warning('socketError: %s', err)
+            if reconnect and (deadline is None or time.time() < deadline):
+                return await self._send(data, False, deadline)
+
+            raise err
+
+    async def _slotted(self, data, timeout):
+        """ wait for a free slot in the window and send the packet 'data'
+
+        :param data: binary command to send
+        :param timeout: time in seconds to wait for the response
+        :return: received packet
+        """
+        async with self.__slots:
+            return await self._request(data, timeout)
+
+    async def _request(self, data, timeout=GATEWAY_TIMEOUT_SECONDS):
+        """ send the packet 'data' on the current connection and wait for the
+            response
+
+        :param data: binary command to send
+        :param timeout: time in seconds to wait for the response
+        :return: received packet
+        """
+        await self._ensure_connected()
+        (seq,) = struct.unpack_from('<B', data, SEQ_OFFSET)
+        while seq in self.__pending:
+            await asyncio.wait([self.__pending[seq]])
+
+        writer = self.__writer
+        if writer is None:
+            raise socket.error('Connection closed')
+
+        future = asyncio.get_running_loop().create_future()
+        self.__pending[seq] = future
+        done = self._observe(data)
+        # reported if the task is cancelled
+        error = asyncio.CancelledError()
+        response = None
+        try:
+            if self.__logger.isEnabledFor(logging.DEBUG):
+                self.__logger.debug('Sending "%s"', binascii.hexlify(data))
+            writer.write(data)
+            await writer.drain()
+            response = await asyncio.wait_for(future, timeout)
+            error = None
+            return response
+        except asyncio.TimeoutError:
+            error = socket.timeout('timed out')
+            raise error
+        except socket.error as err:
+            error = err
+            self._fail(err, writer)
+            raise err
+        finally:
+            if done is not None:
+                done(response, error)
+            if self.__pending.get(seq) is future:
+                del self.__pending[seq]
+
+    async def update_all_light_status(self, throttling_interval=None,
+                                      deadline=None):
+        """ update the status of all lights
+
+        :param throttling_interval: optional throttling interval (skip call to
+            gateway if last call finished less than throttling interval seconds
+            ago)
+        :param deadline: optional time (time.time()) by which the gateway
+            must have answered
+        :return: dict from light mac address to Light object of newly
+                discovered lights
+        """
+        if (throttling_interval and
+                time.time() < self.lights_updated() + throttling_interval):
+            return {}
+
+        data = await self.send(self.build_all_light_status(),
+                               deadline=deadline)
+        return self._parse('lights', self._apply_all_light_status, data)
+
+    async def update_group_list(self, throttling_interval=None,
+                                deadline=None):
+        """ update all groups
+
+        :param throttling_interval: optional throttling interval (skip call to
+            gateway if last call finished less than throttling interval seconds
+            ago)
+        :param deadline: optional time (time.time()) by which the gateway
+            must have answered
+        :return: dict from group name to Group object of newly
+                discovered groups
+        """
+        if (throttling_interval and
+                time.time() < self.groups_updated() + throttling_interval):
+            return {}
+
+        data = await self.send(self.build_group_list(), deadline=deadline)
+        return self._parse('groups', self._apply_group_list, data)
+
+    async def update_scene_list(self, throttling_interval=None,
+                                deadline=None):
+        """ update all scenes
+
+        :param throttling_interval: optional throttling interval (skip call to
+            gateway if last call finished less than throttling interval seconds
+            ago)
+        :param deadline: optional time (time.time()) by which the gateway
+            must have answered
+        :return: dict from scene name to Scene object of newly
+                discovered scenes
+        """
+        if (throttling_interval and
+                time.time() < self.scenes_updated() + throttling_interval):
+            return {}
+
+        data = await self.send(self.build_scene_list(), deadline=deadline)
+        return self._parse('scenes', self._apply_scene_list, data)
+
+    async def update_light_status(self, light, deadline=None):
+        """ get the status of the given light (only subset of values)
+
+        :param light: Light object
+        :param deadline: optional time (time.time()) by which the gateway
+            must have answered
+        :return: tuple containing (onoff, lum, temp, red, green, blue)
+        """
+        data = await self.send(self.build_light_status(light),
+                               deadline=deadline)
+
+        unreachable_data_len = 18
+        if len(data) == unreachable_data_len:
+            return None, None, None, None, None, None
+
+        return struct.unpack('<19x2BH3B4x', data)
+
+    @staticmethod
+    def _skip(item, feature):
+        """
+        :param item: Light or Group object
+        :param feature: feature required by the command
+        :return: true if the command must not be sent to the item
+        """
+        return item.deleted() or (isinstance(item, Light) and
+                                  feature not in item.supported_features())
+
+    def _set_changed(self, item):
+        """ update lights changed timestamp after a command
+
+        :param item: Light or Group object
+        :return:
+        """
+        if isinstance(item, Light):
+            self.set_lights_changed([item.addr()])
+        else:
+            self.set_lights_changed(item.lights())
+
+    async def set_onoff(self, item, onoff, deadline=None):
+        """ set on/off
+
+        :param item: Light or Group object
+        :param onoff: true/false
+        :param deadline: optional time (time.time()) by which the gateway
+            must have answered
+        :return:
+        """
+        if self._skip(item, 'on'):
+            return
+
+        onoff = bool(onoff)
+        item.set_onoff(onoff, send=False)
+        await self.send(self.build_onoff(item, onoff), deadline=deadline)
+        self._set_changed(item)
+
+    async def set_luminance(self, item, lum, transition, deadline=None):
+        """ set luminance (brightness)
+
+        :param item: Light or Group object
+        :param lum: luminance (brightness). if 0, the light is turned off.
+        :param transition: transition time in 1/10 seconds, 0 to disable
+        :param deadline: optional time (time.time()) by which the gateway
+            must have answered
+        :return:
+        """
+        if self._skip(item, 'lum'):
+            return
+
+        lum = min(int(lum), MAX_LUMINANCE)
+        item.set_luminance(lum, transition, send=False)
+        await self.send(self.build_luminance(item, lum, transition),
+                        deadline=deadline)
+        self._set_changed(item)
+
+    async def set_temperature(self, item, temp, transition, deadline=None):
+        """ set colour temperature
+
+        :param item: Light or Group object
+        :param temp: colour temperature in kelvin
+        :param transition: transition time in 1/10 seconds, 0 to disable
+        :param deadline: optional time (time.time()) by which the gateway
+            must have answered
+        :return:
+        """
+        if self._skip(item, 'temp'):
+            return
+
+        temp = max(item.min_temp(), int(temp))
+        temp = min(temp, item.max_temp())
+        item.set_temperature(temp, transition, send=False)
+        await self.send(self.build_temp(item, temp, transition),
+                        deadline=deadline)
+        self._set_changed(item)
+
+    async def set_rgb(self, item, red, green, blue, transition, deadline=None):
+        """ set RGB colour
+
+        :param item: Light or Group object
+        :param red: amount of red
+        :param green: amount of green
+        :param blue: amount of blue
+        :param transition: transition time in 1/10 seconds, 0 to disable
+        :param deadline: optional time (time.time()) by which the gateway
+            must have answered
+        :return:
+        """
+        if self._skip(item, 'rgb'):
+            return
+
+        red = min(int(red), MAX_COLOUR)
+        green = min(int(green), MAX_COLOUR)
+        blue = min(int(blue), MAX_COLOUR)
+        item.set_rgb(red, green, blue, transition, send=False)
+        await self.send(self.build_colour(item, red, green, blue, transition),
+                        deadline=deadline)
+        self._set_changed(item)
+
+    async def reconcile(self, desired, transition=0, execute=True):
+        """ bring the lights to the desired state with as few commands as
+            possible, see Lightify.reconcile()
+
+        :param desired: dict from light mac address to dict with the
+            desired values: {'on': true/false, 'lum': <luminance>,
+            'temp': <colour temperature>, 'rgb': (red, green, blue)}, each
+            of them optional
+        :param transition: transition time in 1/10 seconds, 0 to disable
+        :param execute: whether to send the commands or only plan them
+        :return: list of (Light or Group object, feature, value) tuples
+            in the order the commands are sent
+        """
+        plan = super().reconcile(desired, transition, execute=False)
+        if execute:
+            commands = []
+            for item, feature, value in plan:
+                if feature == 'on':
+                    commands.append(self.set_onoff(item, value))
+                elif feature == 'lum':
+                    commands.append(self.set_luminance(item, value,
+                                                       transition))
+                elif feature == 'temp':
+                    commands.append(self.set_temperature(item, value,
+                                                         transition))
+                else:
+                    commands.append(self.set_rgb(item, value[0], value[1],
+                                                 value[2], transition))
+
+            await asyncio.gather(*commands)
+
+        return plan
+
+    async def activate_scene(self, scene, deadline=None):
+        """ activate a scene
+
+        :param scene: Scene object
+        :param deadline: optional time (time.time()) by which the gateway
+            must have answered
+        :return:
+        """
+        if scene.deleted():
+            return
+
+        await self.send(self.build_command(COMMAND_ACTIVATE_SCENE, scene.idx(),
+                                           b''), deadline=deadline)
+        self.set_lights_updated()
@@ -0,0 +1,45 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Constants shared by the package and its transport and polling modules
+# The package re-exports them
+#
+
+import struct
+
+# name of the package logger
+MODULE = __package__
+
+GATEWAY_TIMEOUT_SECONDS = 10
+
+# length prefix of the packets and initial size of the receive buffer
+FRAME_HEADER = struct.Struct('<H')
+FRAME_BUFFER_SIZE = 4096
+
+DEFAULT_PIPELINE_WINDOW = 32
+MAX_PIPELINE_WINDOW = 255
+COMMAND_OFFSET = 3  # position of the command id in a sent packet
+SEQ_OFFSET = 7  # position of the sequence number in a sent packet
+ADDR_OFFSET = 8  # position of the light mac address or group/scene index
+RESPONSE_COMMAND_OFFSET = 1  # position in a received packet (without length)
+RESPONSE_SEQ_OFFSET = 5  # position of the sequence number
+RESPONSE_STATUS_OFFSET = 6  # position of the status (0 = success)
+
+# background polling intervals in seconds (minimum, maximum)
+POLL_LIGHTS_INTERVAL = (1, 30)
+POLL_SCENES_INTERVAL = (60, 600)
+POLL_GROUPS_INTERVAL = (60, 600)
+POLL_BACKOFF = 2
+POLL_RESOURCES = ('lights', 'scenes', 'groups')
@@ -0,0 +1,438 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Transport of the blocking Lightify class: reading the length prefixed
+# packets of the gateway and keeping several commands in flight
+#
+
+import logging
+import socket
+import struct
+import threading
+import time
+from concurrent import futures
+
+from .constants import (DEFAULT_PIPELINE_WINDOW, FRAME_BUFFER_SIZE,
+                        FRAME_HEADER, GATEWAY_TIMEOUT_SECONDS,
+                        MAX_PIPELINE_WINDOW, MODULE, RESPONSE_SEQ_OFFSET,
+                        SEQ_OFFSET)
+
+
+class FrameReader:
+    """ reads the length prefixed packets sent by the gateway with recv_into,
+        without copying the received data
+    """
+
+    def __init__(self, sock, reuse=True, size=FRAME_BUFFER_SIZE):
+        """
+        :param sock: connected socket
+        :param reuse: if true, all packets are received into one buffer that
+            grows as needed, otherwise each packet gets its own buffer
+        :param size: initial size of the reused buffer
+        """
+        self.__sock = sock
+        self.__reuse = reuse
+        self.__header = bytearray(FRAME_HEADER.size)
+        self.__buffer = bytearray(size if reuse else 0)
+        # length of the packet being received or None while receiving the
+        # header, and the number of bytes received of either
+        self.__length = None
+        self.__received = 0
+
+    def read(self, deadline=None):
+        """ receive the next packet. if a socket.timeout interrupted the
+            previous call, the partially received packet is continued.
+
+        :param deadline: optional time (time.time()) by which the packet
+            must be received. the socket timeout applies to each receive
+            call otherwise
+        :return: memoryview of the received packet (without the length). a
+            reused buffer is only valid until the next call.
+        """
+        if self.__length is None:
+            self._fill(memoryview(self.__header), FRAME_HEADER.size, deadline)
+            (length,) = FRAME_HEADER.unpack(self.__header)
+            if not self.__reuse:
+                self.__buffer = bytearray(length)
+            elif length > len(self.__buffer):
+                # older views keep the previous buffer alive
+                self.__buffer = bytearray(max(length, 2 * len(self.__buffer)))
+
+            self.__length = length
+            self.__received = 0
+
+        view = memoryview(self.__buffer)[:self.__length]
+        self._fill(view, self.__length, deadline)
+        self.__length = None
+        self.__received = 0
+        return view
+
+    def _fill(self, view, size, deadline=None):
+        """ receive until the first 'size' bytes of 'view' are filled
+
+        :param view: writable memoryview
+        :param size: number of bytes
+        :param deadline: optional time (time.time()) by which the bytes must
+            be received
+        :return:
+        """
+        while self.__received < size:
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise socket.timeout('timed out')
+
+                timeout = self.__sock.gettimeout()
+                if timeout is None or remaining < timeout:
+                    self.__sock.settimeout(remaining)
+
+            received = self.__sock.recv_into(view[self.__received:size])
+            if not received:
+                raise socket.error('Connection closed by gateway')
+
+            self.__received += received
+
+
+class Pipeline:
+    """ pipelined request/response engine for a gateway connection
+        keeps several commands in flight and matches the received packets to
+        the commands by their sequence number
+    """
+
+    def __init__(self, sock, window=DEFAULT_PIPELINE_WINDOW,
+                 timeout=GATEWAY_TIMEOUT_SECONDS, logger=None):
+        """
+        :param sock: connected socket (owned by the pipeline from now on)
+        :param window: maximum number of commands in flight
+        :param timeout: time in seconds to wait for the response to a command
+        :param logger: logging.Logger object
+        """
+        if not 0 < window <= MAX_PIPELINE_WINDOW:
+            raise ValueError('Pipeline window must be between 1 and {}'
+                             .format(MAX_PIPELINE_WINDOW))
+
+        self.__sock = sock
+        self.__window = window
+        self.__slots = threading.BoundedSemaphore(window)
+        self.__timeout = timeout
+        self.__logger = logger or logging.getLogger(MODULE)
+        # sequence number -> (future, deadline), in order of submission
+        self.__pending = {}
+        self.__cond = threading.Condition()
+        self.__write_lock = threading.Lock()
+        self.__error = None
+        self.__frames = FrameReader(sock, reuse=False)
+        self.__reader = threading.Thread(target=self._read_loop,
+                                         name='lightify-pipeline-reader')
+        self.__reader.daemon = True
+        self.__reader.start()
+        self.__expirer = threading.Thread(target=self._expire_loop,
+                                          name='lightify-pipeline-expirer')
+        self.__expirer.daemon = True
+        self.__expirer.start()
+
+    def window(self):
+        """
+        :return: maximum number of commands in flight
+        """
+        return self.__window
+
+    def in_flight(self):
+        """
+        :return: number of commands waiting for a response
+        """
+        return len(self.__pending)
+
+    def error(self):
+        """
+        :return: the error that broke the pipeline or None if it is healthy
+        """
+        return self.__error
+
+    def submit(self, data, callback=None, timeout=None):
+        """ send the packet 'data' to the gateway without waiting for the
+            response. blocks while the window is full or the sequence number
+            of the packet is still in flight (after a wraparound).
+
+        :param data: binary command to send
+        :param callback: optional callable invoked with the future when the
+            command is done
+        :param timeout: time in seconds for waiting for a free slot and the
+            response, default: the timeout of the pipeline
+        :return: concurrent.futures.Future resolving to the received packet
+            (bytes)
+        """
+        return self.submit_many([data], callback, timeout)[0]
+
+    def submit_many(self, packets, callback=None, timeout=None):
+        """ send several packets to the gateway without waiting for the
+            responses. the packets are written together, up to 'window'
+            packets with a single write.
+
+        :param packets: list of binary commands to send
+        :param callback: optional callable invoked with each future when its
+            command is done
+        :param timeout: time in seconds for waiting for free slots and the
+            responses, default: the timeout of the pipeline
+        :return: list of concurrent.futures.Future objects resolving to the
+            received packets (bytes), in the order of 'packets'
+        """
+        deadline = time.time() + (self.__timeout if timeout is None
+                                  else timeout)
+        result = []
+        chunk = []
+        seqs = set()
+
+        def flush():
+            self._write(chunk)
+            del chunk[:]
+            seqs.clear()
+
+        for data in packets:
+            (seq,) = struct.unpack_from('<B', data, SEQ_OFFSET)
+            if len(chunk) >= self.__window or seq in seqs:
+                flush()
+
+            future = self._register(seq, callback, deadline, flush)
+            result.append(future)
+            if not future.done():
+                chunk.append(data)
+                seqs.add(seq)
+
+        flush()
+        return result
+
+    def _register(self, seq, callback=None, deadline=None, flush=None):
+        """ wait for a free slot in the window and register a command
+
+        :param seq: sequence number of the command
+        :param callback: optional callable invoked with the future when the
+            command is done
+        :param deadline: time (time.time()) by which the command must be
+            answered, default: the timeout of the pipeline from now
+        :param flush: optional callable writing the commands registered
+            before this one. it is called before blocking, the commands would
+            hold their slots and sequence numbers otherwise and concurrent
+            callers could wait for each other forever
+        :return: concurrent.futures.Future object (already failed if the
+            pipeline is broken or the deadline expired)
+        """
+        if deadline is None:
+            deadline = time.time() + self.__timeout
+
+        future = futures.Future()
+        if callback:
+            future.add_done_callback(callback)
+
+        if not self.__slots.acquire(blocking=False):
+            if flush is not None:
+                flush()
+                flush = None
+
+            if not self.__slots.acquire(
+                    timeout=max(deadline - time.time(), 0)):
+                self._resolve(future, error=socket.timeout('timed out'))
+                return future
+
+        future.add_done_callback(lambda _: self.__slots.release())
+
+        error = None
+        with self.__cond:
+            while seq in self.__pending and self.__error is None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+
+                if flush is not None:
+                    # write without holding the lock the reader needs
+                    self.__cond.release()
+                    try:
+                        flush()
+                    finally:
+                        self.__cond.acquire()
+                    flush = None
+                    continue
+
+                self.__cond.wait(remaining)
+
+            if self.__error is not None:
+                error = self.__error
+            elif seq in self.__pending:
+                error = socket.timeout('timed out')
+            else:
+                self.__pending[seq] = (future, deadline)
+                # the expirer waits for the nearest deadline
+                self.__cond.notify_all()
+
+        if error is not None:
+            self._resolve(future, error=error)
+
+        return future
+
+    def discard(self, pending):
+        """ give up waiting for the responses to commands, e.g. before
+            sending them again. their sequence numbers can be reused at once.
+
+        :param pending: list of concurrent.futures.Future objects
+        :return:
+        """
+        pending = set(pending)
+        discarded = []
+        with self.__cond:
+            for seq, (future, _) in list(self.__pending.items()):
+                if future in pending:
+                    del self.__pending[seq]
+                    discarded.append(future)
+
+            if discarded:
+                self.__cond.notify_all()
+
+        for future in discarded:
+            self._resolve(future, error=socket.timeout('timed out'))
+
+    def _write(self, packets):
+        """ write registered packets to the gateway
+
+        :param packets: list of binary commands
+        :return:
+        """
+        if not packets:
+            return
+
+        try:
+            with self.__write_lock:
+                self.__sock.sendall(b''.join(packets))
+        except socket.error as err:
+            self._fail(err)
+
+    def close(self):
+        """ shut down the connection and fail all commands in flight
+
+        :return:
+        """
+        try:
+            self.__sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+        self.__sock.close()
+        self._fail(socket.error('Pipeline closed'))
+        for thread in (self.__reader, self.__expirer):
+            if thread is not threading.current_thread():
+                thread.join(self.__timeout)
+
+    @staticmethod
+    def _resolve(future, result=None, error=None):
+        """ complete a future unless it was cancelled by the caller
+
+        :param future: concurrent.futures.Future object
+        :param result: received packet
+        :param error: exception to fail the future with
+        :return:
+        """
+        if not future.set_running_or_notify_cancel():
+            return
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _fail(self, err):
+        """ mark the pipeline as broken and fail all commands in flight
+
+        :param err: exception to fail the commands with
+        :return:
+        """
+        with self.__cond:
+            if self.__error is None:
+                self.__error = err
+            pending = list(self.__pending.values())
+            self.__pending.clear()
+            self.__cond.notify_all()
+
+        for future, _ in pending:
+            self._resolve(future, error=self.__error)
+
+    def _expire(self):
+        """ fail the commands whose response did not arrive in time
+
+        :return:
+        """
+        now = time.time()
+        expired = []
+        with self.__cond:
+            # commands with a custom timeout can expire before older ones
+            for seq, (future, deadline) in list(self.__pending.items()):
+                if deadline > now:
+                    continue
+
+                del self.__pending[seq]
+                expired.append(future)
+
+            if expired:
+                self.__cond.notify_all()
+
+        for future in expired:
+            self._resolve(future, error=socket.timeout('timed out'))
+
+    def _expire_loop(self):
+        """ wait for the nearest deadline of the commands in flight and fail
+            the expired commands, until the pipeline is broken or closed
+
+        :return:
+        """
+        while True:
+            with self.__cond:
+                if self.__error is not None:
+                    return
+
+                nearest = min((deadline for _, deadline
+                               in self.__pending.values()), default=None)
+                if nearest is None or nearest > time.time():
+                    self.__cond.wait(None if nearest is None
+                                     else nearest - time.time())
+                    continue
+
+            self._expire()
+
+    def _read_loop(self):
+        """ receive packets and hand them to the waiting commands
+
+        :return:
+        """
+        try:
+            while self.__error is None:
+                try:
+                    data = self.__frames.read()
+                except socket.timeout:
+                    # the reader continues a partially received packet
+                    continue
+
+                (seq,) = struct.unpack_from('<B', data, RESPONSE_SEQ_OFFSET)
+
+                with self.__cond:
+                    entry = self.__pending.pop(seq, None)
+                    self.__cond.notify_all()
+
+                if entry is None:
+                    self.__logger.debug('Dropping response with unknown '
+                                        'sequence number %d', seq)
+                else:
+                    # the futures are public, callers get bytes like from
+                    # the blocking transport
+                    self._resolve(entry[0], result=data.tobytes())
+        except (socket.error, struct.error) as err:
+            self._fail(err)
@@ -0,0 +1,208 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Background polling of the lights, groups and scenes of a Lightify
+# connection on adaptive schedules
+#
+
+import logging
+import socket
+import struct
+import threading
+import time
+
+from .constants import MODULE, POLL_BACKOFF, POLL_RESOURCES
+
+
+class PollSchedule:
+    """ adaptive polling interval of a resource (lights, groups or scenes)
+        the interval drops to the minimum on activity and backs off towards
+        the maximum while the resource is idle
+    """
+
+    def __init__(self, min_interval, max_interval, backoff=POLL_BACKOFF):
+        """
+        :param min_interval: polling interval in seconds on activity
+        :param max_interval: maximum polling interval in seconds when idle
+        :param backoff: factor applied to the interval after an idle poll
+        """
+        self.__min_interval = min_interval
+        self.__max_interval = max(min_interval, max_interval)
+        self.__backoff = backoff
+        self.__interval = min_interval
+        self.__due = 0
+
+    def interval(self):
+        """
+        :return: current polling interval in seconds
+        """
+        return self.__interval
+
+    def due(self):
+        """
+        :return: timestamp of the next poll
+        """
+        return self.__due
+
+    def polled(self, active):
+        """ schedule the next poll after a poll
+
+        :param active: whether the poll found any changes
+        :return:
+        """
+        if active:
+            self.__interval = self.__min_interval
+        else:
+            self.__interval = min(self.__interval * self.__backoff,
+                                  self.__max_interval)
+
+        self.__due = time.time() + self.__interval
+
+    def hurry(self):
+        """ poll soon, e.g. after a local command
+
+        :return:
+        """
+        self.__interval = self.__min_interval
+        self.__due = min(self.__due, time.time() + self.__min_interval)
+
+
+class Poller:
+    """ background thread refreshing the lights, scenes and groups of a
+        connection on independent adaptive schedules
+    """
+
+    def __init__(self, conn, schedules):
+        """
+        :param conn: Lightify object
+        :param schedules: dict from resource ('lights', 'scenes', 'groups') to
+            PollSchedule object
+        """
+        self.__conn = conn
+        self.__schedules = schedules
+        self.__logger = logging.getLogger(MODULE)
+        self.__wakeup = threading.Event()
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(target=self._run,
+                                         name='lightify-poller')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def schedules(self):
+        """
+        :return: dict from resource to PollSchedule object
+        """
+        return self.__schedules
+
+    def hurry(self, resource):
+        """ poll a resource soon
+
+        :param resource: 'lights', 'scenes' or 'groups'
+        :return:
+        """
+        if resource in self.__schedules:
+            self.__schedules[resource].hurry()
+            self.__wakeup.set()
+
+    def stop(self):
+        """ stop the polling thread
+
+        :return:
+        """
+        self.__stopped.set()
+        self.__wakeup.set()
+        if self.__thread is not threading.current_thread():
+            self.__thread.join()
+
+    def poll(self, resource):
+        """ refresh a resource
+
+        :param resource: 'lights', 'scenes' or 'groups'
+        :return: true if the refresh found any changes
+        """
+        if resource == 'lights':
+            self.__conn.update_all_light_status()
+            diff = self.__conn.lights_diff()
+            if diff.added() or diff.removed() or any(
+                    'groups' in fields for fields in diff.changed().values()):
+                self.hurry('groups')
+
+            return self.lights_active(diff)
+
+        # scenes() and groups() would load them on demand before the update
+        if resource == 'scenes':
+            scenes = (list(self.__conn.scenes().values())
+                      if self.__conn.scenes_updated() else [])
+            self.__conn.update_scene_list()
+            return self.items_changed(scenes, self.__conn.scenes())
+
+        groups = (list(self.__conn.groups().values())
+                  if self.__conn.groups_updated() else [])
+        self.__conn.update_group_list()
+        return self.items_changed(groups, self.__conn.groups())
+
+    @staticmethod
+    def lights_active(diff):
+        """
+        :param diff: LightsDiff object of a lights update
+        :return: true if lights were added or removed or changed more than
+            their last seen times, which change on almost every poll
+        """
+        return bool(diff.added() or diff.removed() or any(
+            set(fields) - {'last_seen'} for fields in diff.changed().values()))
+
+    @staticmethod
+    def items_changed(before, after):
+        """
+        :param before: list of the Group or Scene objects before an update
+        :param after: dict from name to Group or Scene object after the
+            update
+        :return: true if the update created or deleted any groups or scenes
+        """
+        return (set(id(item) for item in before) !=
+                set(id(item) for item in after.values()))
+
+    def _run(self):
+        """ poll the resources when they are due
+
+        :return:
+        """
+        while not self.__stopped.is_set():
+            # stop() or hurry() during the polls must wake up the wait below
+            self.__wakeup.clear()
+            for resource in POLL_RESOURCES:
+                schedule = self.__schedules.get(resource)
+                if schedule is None or schedule.due() > time.time():
+                    continue
+
+                if self.__stopped.is_set():
+                    return
+
+                try:
+                    active = self.poll(resource)
+                except (socket.error, struct.error) as err:
+                    self.__logger.warning('Polling %s failed: %s', resource,
+                                          err)
+                    active = False
+                except Exception:
+                    # the thread must outlive unexpected errors, e.g. in an
+                    # event callback
+                    self.__logger.exception('Polling %s failed', resource)
+                    active = False
+
+                schedule.polled(active)
+
+            due = min(schedule.due() for schedule in self.__schedules.values())
+            self.__wakeup.wait(max(due - time.time(), 0))
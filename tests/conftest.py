@@ -0,0 +1,239 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Test fixtures: the package loaded from the repository root as 'lightify'
+# and an in-process fake gateway speaking the binary protocol
+#
+
+import importlib.util
+import os
+import socketserver
+import struct
+import sys
+import threading
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _load_package():
+    """ import the repository root as the 'lightify' package
+
+    :return: module object
+    """
+    if 'lightify' not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            'lightify', os.path.join(ROOT, '__init__.py'),
+            submodule_search_locations=[ROOT])
+        module = importlib.util.module_from_spec(spec)
+        sys.modules['lightify'] = module
+        spec.loader.exec_module(module)
+
+    return sys.modules['lightify']
+
+
+lightify = _load_package()
+import lightify.aio  # noqa: E402 pylint: disable=wrong-import-position
+
+
+class FakeGateway:
+    """ answers the commands of a Lightify connection like a gateway with
+        a few lights, groups and scenes
+    """
+
+    GROUPS = ((1, 'Living'), (2, 'Kitchen'), (3, 'Bed'))
+    SCENES = ((1, 'Relax', 1), (2, 'Cook', 2))
+
+    def __init__(self, num_lights=6):
+        """
+        :param num_lights: number of lights
+        """
+        self.lights = {}
+        for i in range(num_lights):
+            self.lights[0x1000 + i] = {
+                'type': (10, 2, 4)[i % 3], 'reachable': 1,
+                'groups': 1 << (i % 3), 'on': i % 2, 'lum': 50,
+                'temp': 3000, 'rgb': (10, 20, 30),
+                'name': 'light%d' % i, 'seen': 1}
+
+        # delay in seconds before each response and status of the responses
+        self.delay = 0
+        self.status = 0
+        # (flag, command id, sequence number, payload) of the commands
+        self.received = []
+        self.lock = threading.Lock()
+        gateway = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                gateway.serve(self.request)
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0),
+                                                      Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       args=(0.05,))
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def commands(self):
+        """
+        :return: list of the received command ids
+        """
+        with self.lock:
+            return [command for _, command, _, _ in self.received]
+
+    def serve(self, sock):
+        """ answer the commands received on a connection
+
+        :param sock: connected socket
+        :return:
+        """
+        buffer = b''
+        while True:
+            try:
+                chunk = sock.recv(4096)
+            except OSError:
+                return
+
+            if not chunk:
+                return
+
+            buffer += chunk
+            while len(buffer) >= 2:
+                (length,) = struct.unpack_from('<H', buffer)
+                if len(buffer) < length + 2:
+                    break
+
+                packet, buffer = buffer[:length + 2], buffer[length + 2:]
+                if self.delay:
+                    time.sleep(self.delay)
+
+                try:
+                    sock.sendall(self.respond(packet))
+                except OSError:
+                    return
+
+    def respond(self, packet):
+        """
+        :param packet: received command
+        :return: framed response
+        """
+        flag, command = packet[2], packet[3]
+        request_id = packet[4:8]
+        target, payload = packet[8:16], packet[16:]
+        with self.lock:
+            self.received.append((flag, command, packet[7], payload))
+            body = self.payload(flag, command, target, payload)
+
+        body = (struct.pack('<BB', flag, command) + request_id +
+                struct.pack('<B', self.status) + body)
+        return struct.pack('<H', len(body)) + body
+
+    def payload(self, flag, command, target, payload):
+        """
+        :return: payload of the response to a command
+        """
+        if command == lightify.COMMAND_ALL_LIGHT_STATUS:
+            records = b''
+            for i, (addr, light) in enumerate(sorted(self.lights.items())):
+                status = struct.pack(
+                    '<B4sBH2BH4B', light['type'], b'\1\2\3\4',
+                    light['reachable'], light['groups'], light['on'],
+                    light['lum'], light['temp'], *light['rgb'], 0xff)
+                records += struct.pack('<HQ16s16sI4x', i, addr, status,
+                                       light['name'].encode(), light['seen'])
+            return struct.pack('<H', len(self.lights)) + records
+
+        if command == lightify.COMMAND_GROUP_LIST:
+            return struct.pack('<H', len(self.GROUPS)) + b''.join(
+                struct.pack('<H16s', idx, name.encode())
+                for idx, name in self.GROUPS)
+
+        if command == lightify.COMMAND_SCENE_LIST:
+            return struct.pack('<H', len(self.SCENES)) + b''.join(
+                struct.pack('<Bx16sH', idx, name.encode(), 1 << (group - 1))
+                for idx, name, group in self.SCENES)
+
+        if flag == lightify.FLAG_LIGHT:
+            (addr,) = struct.unpack('<Q', target)
+            targets = [addr] if addr in self.lights else []
+        else:
+            targets = [addr for addr, light in self.lights.items()
+                       if light['groups'] & (1 << (target[0] - 1))]
+
+        for addr in targets:
+            light = self.lights[addr]
+            if command == lightify.COMMAND_ONOFF:
+                light['on'] = payload[0]
+            elif command == lightify.COMMAND_LUMINANCE:
+                light['lum'] = payload[0]
+                light['on'] = int(payload[0] > 0)
+            elif command == lightify.COMMAND_TEMP:
+                (light['temp'],) = struct.unpack_from('<H', payload)
+            elif command == lightify.COMMAND_COLOUR:
+                light['rgb'] = tuple(payload[:3])
+
+        if command == lightify.COMMAND_LIGHT_STATUS:
+            light = self.lights[struct.unpack('<Q', target)[0]]
+            return target + b'\0' * 4 + struct.pack(
+                '<2BH3B4x', light['on'], light['lum'], light['temp'],
+                *light['rgb'])
+
+        return b'\1\0' + target + b'\0'
+
+
+def wait_for(condition, timeout=2):
+    """ wait until condition() is true
+
+    :param condition: callable
+    :param timeout: time in seconds
+    :return: true if the condition became true in time
+    """
+    end = time.time() + timeout
+    while not condition():
+        if time.time() > end:
+            return False
+        time.sleep(0.01)
+
+    return True
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    gateway = FakeGateway()
+    gateway.start()
+    monkeypatch.setattr(lightify, 'PORT', gateway.port)
+    monkeypatch.setattr(lightify.aio, 'PORT', gateway.port)
+    yield gateway
+    gateway.stop()
+
+
+@pytest.fixture
+def conn(gateway):
+    conn = lightify.Lightify.connection_class('127.0.0.1')
+    yield conn
+    conn.stop_polling()
+    conn.disable_debouncing(flush=False)
+    conn.disconnect()
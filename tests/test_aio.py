@@ -0,0 +1,136 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+import lightify
+from lightify.aio import AsyncLightify, EventStream
+
+
+def test_commands_and_updates(gateway):
+    async def main():
+        async with AsyncLightify('127.0.0.1') as conn:
+            assert sorted(conn.lights()) == sorted(gateway.lights)
+            assert sorted(conn.groups()) == ['Bed', 'Kitchen', 'Living']
+            light = conn.lights()[0x1000]
+            await conn.set_onoff(light, not light.on())
+            assert gateway.lights[0x1000]['on'] == int(light.on())
+            responses = await asyncio.gather(*(
+                conn.send(conn.build_onoff(light, True)) for _ in range(300)))
+            assert len(responses) == 300
+
+    asyncio.run(main())
+
+
+def test_readers_do_not_fetch(gateway):
+    async def main():
+        conn = AsyncLightify('127.0.0.1')
+        assert conn.lights() == {}
+        assert conn.groups() == {}
+        assert conn.light_byname('light0') is None
+        await conn.update_all_light_status()
+        assert conn.light_byname('light0') is conn.lights()[0x1000]
+        await conn.close()
+
+    asyncio.run(main())
+    assert gateway.commands() == [lightify.COMMAND_ALL_LIGHT_STATUS]
+
+
+def test_send_gives_up_at_the_deadline(gateway):
+    async def main():
+        async with AsyncLightify('127.0.0.1') as conn:
+            gateway.delay = 0.5
+            start = time.time()
+            with pytest.raises(socket.timeout):
+                await conn.send(conn.build_group_list(), deadline=start + 0.2)
+            assert time.time() - start < 0.45
+
+    asyncio.run(main())
+
+
+def test_retry_waits_for_the_adaptive_timeout(gateway):
+    async def main():
+        async with AsyncLightify('127.0.0.1') as conn:
+            timeouts = conn.enable_adaptive_timeouts()
+            for _ in range(lightify.RTT_MIN_SAMPLES):
+                await conn.update_group_list()
+            gateway.delay = 3
+            start = time.time()
+            with pytest.raises(socket.timeout):
+                await conn.send(conn.build_group_list())
+            assert time.time() - start < 2
+            ((_, stats),) = timeouts.stats().items()
+            assert stats['samples'] == lightify.RTT_MIN_SAMPLES
+
+    asyncio.run(main())
+
+
+def test_cancelled_command_is_not_in_flight(gateway):
+    async def main():
+        async with AsyncLightify('127.0.0.1') as conn:
+            metrics = conn.enable_metrics()
+            gateway.delay = 0.3
+            task = conn.send(conn.build_group_list())
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert metrics.snapshot()['in_flight'] == 0
+
+    asyncio.run(main())
+
+
+def test_event_stream_needs_a_running_loop(conn):
+    with pytest.raises(RuntimeError):
+        EventStream(conn)
+
+
+def test_send_many(gateway):
+    async def main():
+        async with AsyncLightify('127.0.0.1') as conn:
+            light = conn.lights()[0x1000]
+            packets = [conn.build_onoff(light, i % 2) for i in range(20)]
+            responses = await conn.send_many(packets)
+            assert [response[lightify.RESPONSE_SEQ_OFFSET]
+                    for response in responses] == [
+                        packet[lightify.SEQ_OFFSET] for packet in packets]
+
+    asyncio.run(main())
+
+
+def test_refresh_all(gateway):
+    async def main():
+        conn = AsyncLightify('127.0.0.1')
+        await conn.refresh_all()
+        assert sorted(conn.lights()) == sorted(gateway.lights)
+        assert sorted(conn.scenes()) == ['Cook', 'Relax']
+        await conn.close()
+
+    asyncio.run(main())
+
+
+def test_reconcile_sends_the_plan(gateway):
+    async def main():
+        async with AsyncLightify('127.0.0.1') as conn:
+            plan = await conn.reconcile({0x1000: {'on': True},
+                                         0x1001: {'on': False}})
+            assert len(plan) == 2
+            assert gateway.lights[0x1000]['on'] == 1
+            assert gateway.lights[0x1001]['on'] == 0
+            assert conn.lights()[0x1000].on()
+            assert not await conn.reconcile({0x1000: {'on': True}})
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize('method', [
+    'batch', 'enable_debouncing', 'enable_fire_and_forget',
+    'enable_health_checks', 'enable_pipelining', 'disable_pipelining'])
+def test_blocking_features_are_not_supported(gateway, method):
+    async def main():
+        async with AsyncLightify('127.0.0.1') as conn:
+            with pytest.raises(NotImplementedError):
+                getattr(conn, method)()
+
+    asyncio.run(main())
@@ -0,0 +1,56 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import lightify
+
+
+def test_failed_connect_closes_the_socket(monkeypatch):
+    sockets = []
+
+    class Socket(socket.socket):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            sockets.append(self)
+
+    # a port nobody listens on
+    with socket.socket() as free:
+        free.bind(('127.0.0.1', 0))
+        port = free.getsockname()[1]
+    monkeypatch.setattr(lightify, 'PORT', port)
+    monkeypatch.setattr(lightify.socket, 'socket', Socket)
+
+    conn = lightify.Lightify.connection_class('127.0.0.1')
+    with pytest.raises(socket.error):
+        conn.update_group_list()
+    assert sockets
+    assert all(sock.fileno() == -1 for sock in sockets)
+
+
+def test_failed_command_is_checked_after_the_lock_is_released(
+        conn, gateway, monkeypatch):
+    manager = conn.enable_health_checks(probe_interval=60)
+    io_lock = conn._Lightify__io_lock
+    checks = []
+
+    def probe():
+        checks.append(io_lock.acquire(False))
+        if checks[-1]:
+            io_lock.release()
+
+    def check():
+        # the probe runs on the connection manager's thread
+        thread = threading.Thread(target=probe)
+        thread.start()
+        thread.join()
+
+    monkeypatch.setattr(manager, 'check', check)
+    conn.update_group_list()
+    gateway.delay = 0.5
+    start = time.time()
+    with pytest.raises(socket.timeout):
+        conn.send(conn.build_group_list(), deadline=start + 0.2)
+    assert checks == [True]
+    conn.disable_health_checks()
@@ -0,0 +1,62 @@
+import socket
+import time
+
+import pytest
+
+import lightify
+
+
+@pytest.mark.parametrize('pipelined', [False, True])
+def test_send_gives_up_at_the_deadline(conn, gateway, pipelined):
+    conn.update_group_list()
+    if pipelined:
+        conn.enable_pipelining()
+
+    gateway.delay = 0.5
+    start = time.time()
+    with pytest.raises(socket.timeout):
+        conn.send(conn.build_group_list(), deadline=start + 0.2)
+    assert time.time() - start < 0.45
+
+
+def test_send_many_gives_up_at_the_deadline(conn, gateway):
+    conn.update_all_light_status()
+    light = next(iter(conn.lights().values()))
+    gateway.delay = 0.3
+    start = time.time()
+    with pytest.raises(socket.timeout):
+        conn.send_many([conn.build_onoff(light, True)] * 5,
+                       deadline=start + 0.5)
+    assert time.time() - start < 0.8
+
+
+def test_updates_accept_a_deadline(conn, gateway):
+    gateway.delay = 0.5
+    start = time.time()
+    with pytest.raises(socket.timeout):
+        conn.update_all_light_status(deadline=start + 0.2)
+    assert time.time() - start < 0.45
+    assert not conn.lights_updated()
+
+
+@pytest.mark.parametrize('pipelined', [False, True])
+def test_timed_out_commands_back_off_the_adaptive_timeout(conn, gateway,
+                                                          pipelined):
+    timeouts = conn.enable_adaptive_timeouts()
+    if pipelined:
+        conn.enable_pipelining()
+    for _ in range(lightify.RTT_MIN_SAMPLES):
+        conn.update_group_list()
+    ((command, stats),) = timeouts.stats().items()
+    assert stats['timeout'] == lightify.TIMEOUT_BOUNDS[0]
+
+    gateway.delay = 3
+    start = time.time()
+    with pytest.raises(socket.timeout):
+        conn.send(conn.build_group_list())
+    # the retry waits for the backed off timeout, not the fixed one
+    assert time.time() - start < 2
+    stats = timeouts.stats()[command]
+    assert stats['samples'] == lightify.RTT_MIN_SAMPLES
+    assert stats['timeout'] == (lightify.TIMEOUT_BOUNDS[0] *
+                                lightify.TIMEOUT_BACKOFF ** 2)
@@ -0,0 +1,46 @@
+import lightify
+
+from conftest import wait_for
+
+
+def _dimmable(conn):
+    """
+    :return: a light supporting luminance
+    """
+    conn.update_all_light_status()
+    return next(light for light in conn.lights().values()
+                if 'lum' in light.supported_features())
+
+
+def test_held_command_is_sent_before_a_later_one(conn, gateway):
+    light = _dimmable(conn)
+    conn.enable_debouncing(0.5)
+    light.set_luminance(10, 0)
+    light.set_luminance(20, 0)
+    light.set_luminance(30, 0)
+    light.set_onoff(False)
+    assert wait_for(lambda: len(gateway.received) >= 4)
+    sent = [(command, payload[0])
+            for _, command, _, payload in gateway.received[1:]]
+    assert sent == [(lightify.COMMAND_LUMINANCE, 10),
+                    (lightify.COMMAND_LUMINANCE, 30),
+                    (lightify.COMMAND_ONOFF, 0)]
+    assert conn.debouncer().dropped() == 1
+    assert conn.debouncer().pending() == 0
+
+
+def test_held_command_is_sent_after_the_interval(conn, gateway):
+    light = _dimmable(conn)
+    conn.enable_debouncing(0.2)
+    light.set_luminance(10, 0)
+    light.set_luminance(20, 0)
+    assert gateway.commands().count(lightify.COMMAND_LUMINANCE) == 1
+    assert wait_for(lambda: gateway.commands().count(
+        lightify.COMMAND_LUMINANCE) == 2)
+    assert gateway.received[-1][3][0] == 20
+
+
+def test_enable_debouncing_changes_the_interval(conn):
+    debouncer = conn.enable_debouncing(0.2)
+    assert conn.enable_debouncing(0.5) is debouncer
+    assert debouncer.interval() == 0.5
@@ -0,0 +1,68 @@
+import socket
+import time
+
+import pytest
+
+import lightify
+
+
+def _sent(gateway, received):
+    return gateway.commands()[received:]
+
+
+def test_commands_are_sent_without_elision(conn, gateway):
+    conn.refresh_all()
+    received = len(gateway.commands())
+    conn.lights()[0x1001].set_onoff(True)
+    assert _sent(gateway, received) == [lightify.COMMAND_ONOFF]
+    assert conn.elided() == 0
+
+
+def test_commands_matching_the_fresh_cache_are_elided(conn, gateway):
+    gateway.lights[0x1000]['on'] = 1
+    conn.refresh_all()
+    conn.enable_elision()
+    received = len(gateway.commands())
+    light = conn.lights()[0x1001]
+    light.set_onoff(True)
+    light.set_luminance(50, 0)
+    conn.groups()['Living'].set_luminance(50, 0)
+    assert _sent(gateway, received) == []
+    assert conn.elided() == 3
+
+    light.set_luminance(60, 0)
+    # the kitchen's lights are not all on
+    conn.groups()['Kitchen'].set_onoff(True)
+    assert _sent(gateway, received) == [lightify.COMMAND_LUMINANCE,
+                                        lightify.COMMAND_ONOFF]
+    assert conn.elided() == 3
+
+
+def test_stale_cache_is_not_elided(conn, gateway):
+    conn.refresh_all()
+    conn.enable_elision(max_age=0.05)
+    time.sleep(0.1)
+    received = len(gateway.commands())
+    conn.lights()[0x1001].set_onoff(True)
+    assert _sent(gateway, received) == [lightify.COMMAND_ONOFF]
+    assert conn.elided() == 0
+
+
+def test_failed_commands_are_not_elided(conn, gateway):
+    conn.refresh_all()
+    conn.enable_elision()
+    light = conn.lights()[0x1000]
+    gateway.delay = 0.3
+    with pytest.raises(socket.timeout):
+        light.set_onoff(True, deadline=time.time() + 0.1)
+    gateway.delay = 0
+
+    # the light may still be off
+    received = len(gateway.commands())
+    light.set_onoff(True)
+    assert _sent(gateway, received) == [lightify.COMMAND_ONOFF]
+    assert conn.elided() == 0
+
+    conn.update_all_light_status()
+    light.set_onoff(True)
+    assert conn.elided() == 1
@@ -0,0 +1,65 @@
+import struct
+
+import pytest
+
+import lightify
+
+
+def _packed(flag, command, addr, data, seq):
+    """ a command as struct.pack built it before the encoder """
+    return struct.pack('<H6B', 6 + len(addr) + len(data), flag, command, 0,
+                       0, 0x07, seq) + addr + data
+
+
+def test_encoder_matches_struct_pack():
+    encoder = lightify.CommandEncoder()
+    for seq in (0, 1, 0x7f, 0xff):
+        for data in (b'', b'\1', b'\x10\x27\5\0', b'\1\2\3\xff\5\0'):
+            assert encoder.light(
+                lightify.COMMAND_TEMP, 0x84182600000a1b2c, data, seq) == (
+                _packed(lightify.FLAG_LIGHT, lightify.COMMAND_TEMP,
+                        struct.pack('<Q', 0x84182600000a1b2c), data, seq))
+            assert encoder.group(
+                lightify.COMMAND_ONOFF, 3, data, seq) == _packed(
+                lightify.FLAG_GLOBAL, lightify.COMMAND_ONOFF,
+                struct.pack('<8B', 3, 0, 0, 0, 0, 0, 0, 0), data, seq)
+            assert encoder.encode(
+                lightify.FLAG_GLOBAL, lightify.COMMAND_GROUP_LIST, b'', data,
+                seq) == _packed(lightify.FLAG_GLOBAL,
+                                lightify.COMMAND_GROUP_LIST, b'', data, seq)
+
+
+@pytest.mark.parametrize('build, command, payload', [
+    (lambda conn, item: conn.build_onoff(item, True),
+     lightify.COMMAND_ONOFF, struct.pack('<B', True)),
+    (lambda conn, item: conn.build_temp(item, 4000, 5),
+     lightify.COMMAND_TEMP, struct.pack('<HH', 4000, 5)),
+    (lambda conn, item: conn.build_luminance(item, 80, 5),
+     lightify.COMMAND_LUMINANCE, struct.pack('<BH', 80, 5)),
+    (lambda conn, item: conn.build_colour(item, 1, 2, 3, 5),
+     lightify.COMMAND_COLOUR,
+     struct.pack('<BBBBH', 1, 2, 3, lightify.DEFAULT_ALPHA, 5)),
+])
+def test_commands_match_struct_pack(conn, gateway, build, command, payload):
+    conn.refresh_all()
+    light = conn.lights()[0x1000]
+    group = conn.groups()['Kitchen']
+    for _ in range(2):
+        data = build(conn, light)
+        assert data == _packed(lightify.FLAG_LIGHT, command,
+                               struct.pack('<Q', 0x1000), payload, data[7])
+        data = build(conn, group)
+        assert data == _packed(
+            lightify.FLAG_GLOBAL, command,
+            struct.pack('<8B', group.idx(), 0, 0, 0, 0, 0, 0, 0), payload,
+            data[7])
+
+
+def test_global_commands_match_struct_pack(conn):
+    data = conn.build_all_light_status()
+    assert data == _packed(lightify.FLAG_GLOBAL,
+                           lightify.COMMAND_ALL_LIGHT_STATUS, b'',
+                           struct.pack('<B', 1), data[7])
+    data = conn.build_group_list()
+    assert data == _packed(lightify.FLAG_GLOBAL, lightify.COMMAND_GROUP_LIST,
+                           b'', b'', data[7])
@@ -0,0 +1,62 @@
+import asyncio
+
+from lightify import EventType
+from lightify.aio import EventStream
+
+
+def _events(conn, **filters):
+    events = []
+    conn.subscribe(lambda event: events.append(
+        (event.type(), event.item(), event.value())), **filters)
+    return events
+
+
+def test_events_filtered_by_address(conn, gateway):
+    conn.update_all_light_status()
+    events = _events(conn, addrs=[0x1001])
+    gateway.lights[0x1001]['lum'] = 80
+    gateway.lights[0x1002]['lum'] = 80
+    conn.update_all_light_status()
+    assert events == [(EventType.LUM, conn.lights()[0x1001], 80)]
+
+
+def test_events_filtered_by_type(conn, gateway):
+    conn.update_all_light_status()
+    events = _events(conn, types=[EventType.ON, EventType.DELETED])
+    light = conn.lights()[0x1000]
+    light.set_temperature(4000, 0)
+    light.set_onoff(True)
+    del gateway.lights[0x1005]
+    removed = conn.lights()[0x1005]
+    conn.update_all_light_status()
+    assert events == [(EventType.ON, light, True),
+                      (EventType.DELETED, removed, None)]
+
+
+def test_events_filtered_by_group(conn, gateway):
+    conn.update_all_light_status()
+    conn.update_group_list()
+    events = _events(conn, groups=[2])
+    for light in gateway.lights.values():
+        light['temp'] = 5000
+    conn.update_all_light_status()
+    assert sorted((event_type, item.addr(), value)
+                  for event_type, item, value in events) == [
+        (EventType.TEMP, 0x1001, 5000), (EventType.TEMP, 0x1004, 5000)]
+
+
+def test_event_stream(conn, gateway):
+    conn.update_all_light_status()
+
+    async def main():
+        stream = EventStream(conn, types=[EventType.ADDED])
+        gateway.lights[0x1009] = dict(gateway.lights[0x1000], name='new')
+        await asyncio.get_running_loop().run_in_executor(
+            None, conn.update_all_light_status)
+        event = await stream.__anext__()
+        stream.close()
+        assert event.type() is EventType.ADDED
+        assert event.item() is conn.lights()[0x1009]
+        assert [event async for event in stream] == []
+
+    asyncio.run(main())
@@ -0,0 +1,44 @@
+import struct
+from concurrent import futures
+
+import lightify
+
+
+def test_acks_are_counted(conn, gateway):
+    conn.update_all_light_status()
+    conn.enable_fire_and_forget()
+    acks = []
+    for light in conn.lights().values():
+        light.set_onoff(True)
+        acks.append(conn.last_ack())
+
+    assert [ack.wait(1) for ack in acks] == [lightify.AckStatus.SUCCESS] * 6
+    stats = conn.ack_stats()
+    assert stats[lightify.AckStatus.PENDING] == 0
+    assert stats[lightify.AckStatus.SUCCESS] == 6
+    assert all(light.on() for light in conn.lights().values())
+    conn.disable_fire_and_forget()
+    assert conn.pipeline() is None
+
+
+def test_failed_command_marks_the_lights_outdated(conn, gateway):
+    conn.update_all_light_status()
+    conn.enable_fire_and_forget()
+    gateway.status = 1
+    conn.lights()[0x1000].set_onoff(True)
+    assert conn.last_ack().wait(1) == lightify.AckStatus.FAILED
+    assert conn.lights_updated() == lightify.OUTDATED_TIMESTAMP
+    assert conn.ack_stats()[lightify.AckStatus.FAILED] == 1
+    conn.disable_fire_and_forget()
+
+
+def test_short_response_fails_the_ack():
+    completed = []
+    ack = lightify.Ack(b'\0' * 8, completed.append)
+    future = futures.Future()
+    future.set_result(b'\0\0')
+    ack.complete(future)
+    assert ack.wait(0) == lightify.AckStatus.FAILED
+    assert ack.done()
+    assert isinstance(ack.error(), struct.error)
+    assert completed == [ack]
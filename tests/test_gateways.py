@@ -0,0 +1,40 @@
+import logging
+
+import pytest
+
+import lightify
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """ keep the connections registered by the tests out of the others """
+    monkeypatch.setattr(lightify.Lightify, 'instance', None)
+    monkeypatch.setattr(lightify.Lightify, 'instances', {})
+    monkeypatch.setattr(lightify.Lightify, 'instance_arguments', {})
+
+
+def test_one_connection_per_host(registry, gateway):
+    conn = lightify.Lightify('127.0.0.1', log_level=logging.DEBUG).instance
+    assert lightify.Lightify('127.0.0.1').instance is conn
+    assert lightify.Lightify('127.0.0.1', None,
+                             logging.DEBUG).instance is conn
+    with pytest.raises(ValueError):
+        lightify.Lightify('127.0.0.1', log_level=logging.WARNING)
+    assert lightify.Lightify.instance is conn
+
+
+def test_removed_gateway_is_closed(registry, gateway):
+    manager = lightify.GatewayManager(['127.0.0.1'])
+    conn = manager.gateway('127.0.0.1')
+    assert sorted(conn.lights()) == sorted(gateway.lights)
+    conn.enable_pipelining()
+    conn.start_polling()
+    conn.enable_health_checks()
+    pipeline = conn.pipeline()
+
+    manager.remove_gateway('127.0.0.1')
+    assert manager.gateways() == {}
+    assert conn.poller() is None
+    assert conn.connection_manager() is None
+    assert pipeline.error() is not None
+    manager.close()
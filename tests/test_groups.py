@@ -0,0 +1,49 @@
+def _expected(conn, group):
+    """ the group's lights as found by scanning all lights """
+    return [light.addr() for light in sorted(conn.lights().values(),
+                                              key=lambda light: light.idx())
+            if group.idx() in light.groups()]
+
+
+def test_group_lights_follow_the_light_status(conn, gateway):
+    conn.refresh_all()
+    groups = conn.groups()
+    assert groups['Living'].lights() == [0x1000, 0x1003]
+    assert groups['Kitchen'].lights() == [0x1001, 0x1004]
+
+    # 0x1002 joins the living room, 0x1003 moves to the kitchen and 0x1000
+    # is deleted
+    gateway.lights[0x1002]['groups'] |= 1
+    gateway.lights[0x1003]['groups'] = 2
+    del gateway.lights[0x1000]
+    conn.update_all_light_status()
+    assert groups['Living'].lights() == [0x1002]
+    assert groups['Kitchen'].lights() == [0x1001, 0x1003, 0x1004]
+    for group in groups.values():
+        assert group.lights() == _expected(conn, group)
+
+
+def test_group_lights_keep_the_light_order(conn, gateway):
+    for addr in range(0x1006, 0x1040):
+        gateway.lights[addr] = dict(gateway.lights[0x1000],
+                                    groups=1 << (addr % 3),
+                                    name='light%x' % addr)
+    conn.refresh_all()
+    for group in conn.groups().values():
+        assert group.lights() == _expected(conn, group)
+        assert group.light_names() == [conn.lights()[addr].name()
+                                       for addr in group.lights()]
+
+
+def test_group_scenes(conn, gateway):
+    conn.refresh_all()
+    groups = conn.groups()
+    assert groups['Living'].scenes() == ['Relax']
+    assert groups['Kitchen'].scenes() == ['Cook']
+    assert groups['Bed'].scenes() == []
+
+    gateway.SCENES = ((1, 'Relax', 1), (2, 'Cook', 1), (3, 'Sleep', 3))
+    conn.update_scene_list()
+    assert sorted(groups['Living'].scenes()) == ['Cook', 'Relax']
+    assert groups['Kitchen'].scenes() == []
+    assert groups['Bed'].scenes() == ['Sleep']
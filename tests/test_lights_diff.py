@@ -0,0 +1,50 @@
+import lightify
+
+
+def test_diff_lists_the_changed_fields(conn, gateway):
+    added = conn.update_all_light_status()
+    assert sorted(added) == sorted(gateway.lights)
+    assert sorted(conn.lights_diff().added()) == sorted(gateway.lights)
+
+    gateway.lights[0x1001]['lum'] = 80
+    gateway.lights[0x1002]['name'] = 'desk'
+    assert conn.update_all_light_status() == {}
+    diff = conn.lights_diff()
+    assert diff.added() == {}
+    assert diff.removed() == {}
+    assert diff.changed() == {0x1001: {'lum'}, 0x1002: {'name'}}
+    assert conn.lights()[0x1001].lum() == 80
+    assert conn.light_byname('desk') is conn.lights()[0x1002]
+
+
+def test_diff_lists_added_and_removed_lights(conn, gateway):
+    conn.update_all_light_status()
+    light = conn.lights()[0x1005]
+    del gateway.lights[0x1005]
+    gateway.lights[0x1009] = dict(gateway.lights[0x1000], name='new')
+    added = conn.update_all_light_status()
+    diff = conn.lights_diff()
+    assert list(added) == [0x1009]
+    assert list(diff.added()) == [0x1009]
+    assert diff.removed() == {0x1005: light}
+    assert diff.changed() == {}
+    assert 0x1005 not in conn.lights()
+
+
+def test_unchanged_records_are_not_decoded(conn, gateway, monkeypatch):
+    conn.update_all_light_status()
+    updated = []
+    update_status = lightify.Light.update_status
+
+    def spy(light, *args):
+        updated.append(light.addr())
+        return update_status(light, *args)
+
+    monkeypatch.setattr(lightify.Light, 'update_status', spy)
+    gateway.lights[0x1003]['seen'] = 2
+    conn.update_all_light_status()
+    assert updated == [0x1003]
+    assert conn.lights_diff().changed() == {0x1003: {'last_seen'}}
+    conn.update_all_light_status()
+    assert updated == [0x1003]
+    assert len(conn.lights_diff()) == 0
@@ -0,0 +1,90 @@
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+import lightify
+
+
+def _response(seq, command=lightify.COMMAND_ONOFF):
+    """
+    :return: framed response to a light command
+    """
+    body = struct.pack('<BB3xBB', lightify.FLAG_LIGHT, command, seq, 0)
+    return struct.pack('<H', len(body)) + body
+
+
+@pytest.fixture
+def socket_pair():
+    local, remote = socket.socketpair()
+    local.settimeout(0.1)
+    yield local, remote
+    remote.close()
+
+
+def test_sequence_numbers_wrap_around(conn, gateway):
+    conn.update_all_light_status()
+    conn.enable_pipelining(window=8)
+    light = next(iter(conn.lights().values()))
+    packets = [conn.build_onoff(light, i % 2) for i in range(600)]
+    responses = conn.send_many(packets)
+    assert gateway.commands().count(lightify.COMMAND_ONOFF) == 600
+    for packet, response in zip(packets, responses):
+        assert (response[lightify.RESPONSE_SEQ_OFFSET] ==
+                packet[lightify.SEQ_OFFSET])
+    conn.disable_pipelining()
+
+
+def test_commands_expire_at_their_deadlines(socket_pair):
+    local, remote = socket_pair
+    pipeline = lightify.Pipeline(local, timeout=5)
+    encoder = lightify.CommandEncoder()
+    start = time.time()
+    slow = pipeline.submit(encoder.light(lightify.COMMAND_ONOFF, 1, b'\1', 1),
+                           timeout=2)
+    fast = pipeline.submit(encoder.light(lightify.COMMAND_ONOFF, 1, b'\1', 2),
+                           timeout=0.2)
+    with pytest.raises(socket.timeout):
+        fast.result(1)
+    assert time.time() - start < 0.5
+    assert not slow.done()
+    pipeline.close()
+
+
+def test_partial_packet_survives_a_receive_timeout(socket_pair):
+    local, remote = socket_pair
+    pipeline = lightify.Pipeline(local, timeout=5)
+    future = pipeline.submit(lightify.CommandEncoder().light(
+        lightify.COMMAND_ONOFF, 1, b'\1', 7))
+    frame = _response(7)
+    remote.sendall(frame[:4])
+    time.sleep(0.3)
+    remote.sendall(frame[4:])
+    assert bytes(future.result(1)) == frame[2:]
+    assert pipeline.error() is None
+    pipeline.close()
+
+
+@pytest.mark.parametrize('window,threads,count', [(4, 3, 6), (32, 4, 25)])
+def test_concurrent_send_many(conn, gateway, window, threads, count):
+    conn.update_all_light_status()
+    conn.enable_pipelining(window=window)
+    light = next(iter(conn.lights().values()))
+    results = []
+    start = time.time()
+
+    def send():
+        packets = [conn.build_onoff(light, True) for _ in range(count)]
+        results.append(conn.send_many(packets, deadline=start + 2))
+
+    workers = [threading.Thread(target=send) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert time.time() - start < 1
+    assert [len(responses) for responses in results] == [count] * threads
+    assert (gateway.commands().count(lightify.COMMAND_ONOFF) ==
+            threads * count)
@@ -0,0 +1,63 @@
+import time
+
+import lightify
+
+from conftest import wait_for
+
+
+def test_schedule_backs_off_and_hurries():
+    schedule = lightify.PollSchedule(1, 5)
+    for interval in (2, 4, 5, 5):
+        schedule.polled(False)
+        assert schedule.interval() == interval
+
+    schedule.hurry()
+    assert schedule.interval() == 1
+    schedule.polled(False)
+    schedule.polled(True)
+    assert schedule.interval() == 1
+
+
+def _poller(conn):
+    """
+    :return: Poller object after its first poll of the lights, scenes and
+        groups (the next ones are not due during a test)
+    """
+    poller = conn.start_polling((100, 100), (100, 100), (100, 100))
+    assert wait_for(lambda: all(schedule.due()
+                                for schedule in poller.schedules().values()))
+    return poller
+
+
+def test_last_seen_changes_are_not_activity(conn, gateway):
+    poller = _poller(conn)
+    for light in gateway.lights.values():
+        light['seen'] += 1
+    assert not poller.poll('lights')
+
+    gateway.lights[0x1000]['lum'] = 80
+    assert poller.poll('lights')
+    assert not poller.poll('lights')
+
+
+def test_deleted_groups_and_scenes_are_activity(conn, gateway):
+    poller = _poller(conn)
+    assert not poller.poll('groups')
+    assert not poller.poll('scenes')
+
+    gateway.GROUPS = gateway.GROUPS[:2]
+    gateway.SCENES = gateway.SCENES[:1]
+    assert poller.poll('groups')
+    assert poller.poll('scenes')
+    assert sorted(conn.groups()) == ['Kitchen', 'Living']
+    assert not poller.poll('groups')
+
+
+def test_stop_during_a_poll(conn, gateway):
+    gateway.delay = 0.1
+    poller = conn.start_polling()
+    start = time.time()
+    assert wait_for(lambda: gateway.commands())
+    conn.stop_polling()
+    assert time.time() - start < 0.5
+    assert not poller._Poller__thread.is_alive()
@@ -0,0 +1,29 @@
+import pytest
+
+import lightify
+
+
+@pytest.mark.parametrize('pipelined', [False, True])
+def test_public_paths_return_bytes(conn, gateway, pipelined):
+    conn.update_all_light_status()
+    if pipelined:
+        conn.enable_pipelining()
+
+    light = conn.lights()[0x1000]
+    assert type(conn.send(conn.build_group_list())) is bytes
+    assert [type(response) for response in conn.send_many(
+        [conn.build_onoff(light, True), conn.build_group_list()])] == [
+            bytes, bytes]
+    assert type(conn.submit(conn.build_group_list()).result(1)) is bytes
+
+    batch = conn.batch()
+    batch.add(conn.build_onoff(light, True))
+    assert [type(response) for response in batch.flush()] == [bytes]
+
+    conn.enable_fire_and_forget()
+    light.set_onoff(False)
+    ack = conn.last_ack()
+    assert ack.wait(1) == lightify.AckStatus.SUCCESS
+    assert type(ack.response()) is bytes
+    conn.disable_fire_and_forget()
+
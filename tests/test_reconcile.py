@@ -0,0 +1,49 @@
+import lightify
+
+DESIRED = {
+    # the colour is already set
+    0x1000: {'on': True, 'lum': 80, 'rgb': (10, 20, 30)},
+    0x1003: {'on': True, 'lum': 80},
+    # the luminance is already set and the colour is not supported
+    0x1001: {'lum': 50, 'temp': 4000, 'rgb': (1, 2, 3)},
+    0x1004: {'temp': 5000},
+    # switched off, the luminance is ignored
+    0x1005: {'on': False, 'lum': 90},
+    # clamped to the only supported temperature
+    0x1002: {'temp': 9000},
+}
+
+
+def _plan(plan):
+    return [(item.name(), feature, value) for item, feature, value in plan]
+
+
+def test_plan_uses_group_commands_and_skips_set_values(conn, gateway):
+    conn.refresh_all()
+    received = len(gateway.commands())
+    plan = conn.reconcile(DESIRED, execute=False)
+    assert _plan(plan) == [('Living', 'lum', 80),
+                                 ('light0', 'on', True),
+                                 ('light1', 'temp', 4000),
+                                 ('light4', 'temp', 5000),
+                                 ('light5', 'on', False)]
+    assert len(gateway.commands()) == received
+
+
+def test_reconcile_reaches_the_desired_state(conn, gateway):
+    conn.refresh_all()
+    received = len(gateway.commands())
+    conn.reconcile(DESIRED, transition=5)
+    assert [(flag, command) for flag, command, _, _
+            in gateway.received[received:]] == [
+        (lightify.FLAG_GLOBAL, lightify.COMMAND_LUMINANCE),
+        (lightify.FLAG_LIGHT, lightify.COMMAND_ONOFF),
+        (lightify.FLAG_LIGHT, lightify.COMMAND_TEMP),
+        (lightify.FLAG_LIGHT, lightify.COMMAND_TEMP),
+        (lightify.FLAG_LIGHT, lightify.COMMAND_ONOFF)]
+    assert [gateway.lights[addr]['lum'] for addr in (0x1000, 0x1003)] == [
+        80, 80]
+    assert gateway.lights[0x1000]['on'] == 1
+    assert gateway.lights[0x1004]['temp'] == 5000
+    assert gateway.lights[0x1005]['on'] == 0
+    assert conn.reconcile(DESIRED) == []
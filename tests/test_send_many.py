@@ -0,0 +1,45 @@
+import pytest
+
+import lightify
+
+
+def _same_sequence(conn, seq=5):
+    """
+    :return: on/off, luminance and temperature commands to one light, all
+        with the sequence number 'seq'
+    """
+    conn.update_all_light_status()
+    light = next(iter(conn.lights().values()))
+    packets = []
+    for data in (conn.build_onoff(light, True),
+                 conn.build_luminance(light, 30, 0),
+                 conn.build_temp(light, 3000, 0)):
+        data = bytearray(data)
+        data[lightify.SEQ_OFFSET] = seq
+        packets.append(bytes(data))
+
+    return packets
+
+
+@pytest.mark.parametrize('pipelined', [False, True])
+def test_repeated_sequence_numbers(conn, gateway, pipelined):
+    packets = _same_sequence(conn)
+    if pipelined:
+        conn.enable_pipelining()
+
+    responses = conn.send_many(packets)
+    assert [response[lightify.RESPONSE_COMMAND_OFFSET]
+            for response in responses] == [lightify.COMMAND_ONOFF,
+                                           lightify.COMMAND_LUMINANCE,
+                                           lightify.COMMAND_TEMP]
+    assert gateway.commands()[1:] == [lightify.COMMAND_ONOFF,
+                                      lightify.COMMAND_LUMINANCE,
+                                      lightify.COMMAND_TEMP]
+
+
+def test_chunks_split_on_repeated_sequence_numbers():
+    packets = [bytes([0] * lightify.SEQ_OFFSET + [seq]) for seq in
+               (1, 2, 1, 3, 3)]
+    chunks = list(lightify.Lightify.connection_class._chunks(packets))
+    assert [[packet[-1] for packet in chunk] for chunk in chunks] == [
+        [1, 2], [1, 3], [3]]
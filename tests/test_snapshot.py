@@ -0,0 +1,69 @@
+import json
+import os
+import threading
+
+import lightify
+
+from conftest import wait_for
+
+
+def _saved(path):
+    """
+    :return: resources in the snapshot file or an empty list
+    """
+    try:
+        with open(path) as snapshot_file:
+            return sorted(key for key in json.load(snapshot_file)
+                          if key in lightify.SNAPSHOT_RESOURCES)
+    except (IOError, ValueError):
+        return []
+
+
+def _refresh(conn, path):
+    conn.enable_snapshot(path, refresh=False)
+    conn.refresh_all()
+    assert wait_for(lambda: _saved(path) == ['groups', 'lights', 'scenes'])
+    assert wait_for(lambda: not any(
+        thread.name == 'lightify-snapshot-writer'
+        for thread in threading.enumerate()))
+
+
+def test_snapshot_is_loaded_as_outdated(conn, gateway, tmp_path):
+    path = str(tmp_path / 'snapshot.json')
+    _refresh(conn, path)
+    loaded = lightify.Lightify.connection_class('127.0.0.1')
+    assert loaded.enable_snapshot(path, refresh=False)
+    assert sorted(loaded.lights()) == sorted(gateway.lights)
+    assert sorted(loaded.groups()) == sorted(conn.groups())
+    assert sorted(loaded.scenes()) == sorted(conn.scenes())
+    assert loaded.lights_updated() == lightify.OUTDATED_TIMESTAMP
+    loaded.enable_elision()
+    assert not loaded.cache_fresh()
+
+
+def test_snapshot_is_saved_when_more_than_last_seen_changed(
+        conn, gateway, tmp_path):
+    path = str(tmp_path / 'snapshot.json')
+    _refresh(conn, path)
+    os.utime(path, (0, 0))
+    for light in gateway.lights.values():
+        light['seen'] += 1
+    conn.update_all_light_status()
+    assert not wait_for(lambda: os.stat(path).st_mtime != 0, 0.3)
+
+    next(iter(gateway.lights.values()))['lum'] = 80
+    conn.update_all_light_status()
+    assert wait_for(lambda: os.stat(path).st_mtime != 0)
+
+
+def test_damaged_snapshot_is_ignored(conn, tmp_path):
+    path = str(tmp_path / 'snapshot.json')
+    _refresh(conn, path)
+    with open(path) as snapshot_file:
+        snapshot = json.load(snapshot_file)
+    snapshot['lights']['hash'] = '0' * 64
+    with open(path, 'w') as snapshot_file:
+        json.dump(snapshot, snapshot_file)
+
+    assert not lightify.Lightify.connection_class('127.0.0.1').load_snapshot(
+        path)
@@ -0,0 +1,56 @@
+import threading
+
+import pytest
+
+
+def test_state_is_an_immutable_snapshot(conn, gateway):
+    conn.refresh_all()
+    state = conn.state()
+    assert conn.state() is state
+    assert sorted(state.lights()) == sorted(gateway.lights)
+    assert [light.addr for light in state.group_lights('Living')] == [
+        0x1000, 0x1003]
+    with pytest.raises(TypeError):
+        state.lights()[0x1000] = None
+
+    light = conn.lights()[0x1000]
+    light.set_onoff(True, send=False)
+    assert not state.lights()[0x1000].on
+    assert conn.state().lights()[0x1000].on
+    assert conn.state().version() > state.version()
+
+
+def _waits_for_state_lock(conn, func):
+    """
+    :return: true if func() only completed after the state lock of the
+        connection was released
+    """
+    done = threading.Event()
+    worker = threading.Thread(target=lambda: (func(), done.set()))
+    with conn._Lightify__lock:
+        worker.start()
+        waited = not done.wait(0.2)
+    worker.join()
+    return waited and done.is_set()
+
+
+def test_local_changes_are_written_under_the_state_lock(conn, gateway):
+    conn.update_all_light_status()
+    light = conn.lights()[0x1000]
+    worker = threading.Thread(
+        target=lambda: light.set_luminance(30, 0, send=False))
+    with conn._Lightify__lock:
+        worker.start()
+        worker.join(0.2)
+        # state() would see the light half changed otherwise
+        assert (light.on(), light.lum()) == (False, 50)
+    worker.join()
+    assert (light.on(), light.lum()) == (True, 30)
+    state = conn.state().lights()[0x1000]
+    assert (state.on, state.lum) == (True, 30)
+
+
+def test_queries_use_the_state_lock(conn, gateway):
+    conn.update_all_light_status()
+    assert _waits_for_state_lock(conn, lambda: conn.query_lights(on=True))
+    assert sorted(conn.query_lights(on=True)) == [0x1001, 0x1003, 0x1005]